@@ -1,5 +1,6 @@
 import sys
 import argparse
+import contextlib
 
 from inspect import getmembers, isclass
 
@@ -9,20 +10,34 @@ def main():
     import flaccurate
     args = _init_argparse()
 
+    # One database and plugin registry for every command given - created
+    # by whichever command first needs them (see: flaccurate.context)
+    context = flaccurate.Context(args)
+
+    # Everything the commands do is profiled, when asked (see: flaccurate.profiler)
+    profiler = contextlib.nullcontext()
+    if(args.profile is not None):
+        import flaccurate.profiler
+        profiler = flaccurate.profiler.Profiler(args.profile, args.profile_memory, args.profile_output)
+
     # Here we'll try to dynamically match the command the user is trying to run
     # with a pre-defined command class we've already created.
     # Inspired by: https://github.com/rdegges/skele-cli
-    for user_command in args.command:
-        if hasattr(flaccurate.commands, user_command):
-            module = getattr(flaccurate.commands, user_command)
-            flaccurate.commands = getmembers(module, isclass) # get class name
-            command = [command[1] for command in flaccurate.commands if command[0] != 'Base'][0]
-            try:
-                command = command(args) # instantiate
-            except flaccurate.Usage as e:
-                print(e)
-            else:
-                command.run()
+    with profiler:
+        try:
+            for user_command in args.command:
+                if hasattr(flaccurate.commands, user_command):
+                    module = getattr(flaccurate.commands, user_command)
+                    classes = getmembers(module, isclass) # get class name
+                    command = [command[1] for command in classes if command[0] != 'Base'][0]
+                    try:
+                        command = command(args, context) # instantiate
+                        command.run()
+                    except flaccurate.Usage as e:
+                        print(e)
+        finally:
+            # Even when interrupted - what was done so far is kept
+            context.close()
 
 def _init_argparse():
     # obtain list of commands found in flaccurate.commands module namespace
@@ -58,16 +73,47 @@ def _init_argparse():
         '--usage',
         help='provide command specific usage guidance', action='store_true'
     )
+    parser.add_argument(
+        '--staging',
+        help='work on a copy of the database in memory, written back atomically every few minutes and when done', action='store_true'
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        type=str,
+        choices=('sample', 'deterministic'),
+        const='sample',
+        default=None,
+        help='profile the command: sample (low overhead, collapsed stacks, the default) or deterministic (cProfile, pstats)',
+    )
+    parser.add_argument(
+        '--profile-memory',
+        help='with --profile, also trace memory allocations', action='store_true'
+    )
+    parser.add_argument(
+        '--profile-output',
+        nargs='?',
+        type=str,
+        default=None,
+        help='with --profile, filename prefix of the report and profile data (default: flaccurate-profile)',
+    )
     parser.add_argument(
         '--force',
         help='force through actions - ignoring warnings accepting implicit defaults', action='store_true'
     )
     parser.add_argument(
         '--input',
+        type=str,
+        default=None,
+        action='append',
+        help='specify directory where audio files are stored - curate takes several',
+    )
+    parser.add_argument(
+        '--catalog',
         nargs='?',
         type=str,
         default=None,
-        help='specify directory where audio files are stored'
+        help='curate: specify catalog of library roots, each recorded in a database of its own',
     )
     parser.add_argument(
         '--database',
@@ -76,6 +122,207 @@ def _init_argparse():
         default=None,
         help='specify the database file to use',
     )
+    parser.add_argument(
+        '--compare',
+        nargs='?',
+        type=str,
+        default=None,
+        help='specify a database file or directory of .md5/.ffp sidecar files to compare against (.md5 entries checked against the whole file)',
+    )
+    parser.add_argument(
+        '--file',
+        nargs='?',
+        type=str,
+        default=None,
+        help='specify a single audio file to report on',
+    )
+    parser.add_argument(
+        '--limit',
+        nargs='?',
+        type=int,
+        default=None,
+        help='limit the number of entries reported',
+    )
+    parser.add_argument(
+        '--rescan',
+        help='read every directory, ignoring listings recorded by earlier runs', action='store_true'
+    )
+    parser.add_argument(
+        '--exclude',
+        type=str,
+        action='append',
+        default=None,
+        help='leave out paths matching this gitignore style pattern, may be given more than once',
+    )
+    parser.add_argument(
+        '--include',
+        type=str,
+        action='append',
+        default=None,
+        help='keep paths matching this gitignore style pattern although excluded, may be given more than once',
+    )
+    parser.add_argument(
+        '--schedule',
+        type=str,
+        default='glob',
+        choices=['glob', 'device', 'cost'],
+        help='order in which curate processes files: as found (glob), per device in on-disk order (device) or longest first (cost)',
+    )
+    parser.add_argument(
+        '--workers',
+        nargs='?',
+        type=int,
+        default=None,
+        help='number of worker threads for --schedule cost (default: from the tuning file, or one per CPU) or per device for --schedule device (default: 1)',
+    )
+    parser.add_argument(
+        '--io-direct',
+        help='read audio files with O_DIRECT, bypassing the page cache', action='store_true'
+    )
+    parser.add_argument(
+        '--io-limit',
+        nargs='?',
+        type=float,
+        default=None,
+        help='limit the combined audio file read rate to this many MB/s',
+    )
+    parser.add_argument(
+        '--read-buffer',
+        nargs='?',
+        type=int,
+        default=None,
+        help='read audio files this many KB at a time (default: from the tuning file, or 1024)',
+    )
+    parser.add_argument(
+        '--read-ahead',
+        nargs='?',
+        type=int,
+        default=None,
+        help='ask the kernel to read this many buffers ahead, 0 to leave it to the kernel (default: from the tuning file, or 0)',
+    )
+    parser.add_argument(
+        '--pcm-buffer',
+        nargs='?',
+        type=int,
+        default=None,
+        help='hash decoded audio this many KB at a time, 0 as it is decoded (default: from the tuning file, or 0)',
+    )
+    parser.add_argument(
+        '--tuning',
+        nargs='?',
+        type=str,
+        default=None,
+        help='host tuning file written by selfcheck --calibrate (default: ~/.config/flaccurate/tuning.json)',
+    )
+    parser.add_argument(
+        '--calibrate',
+        help='with selfcheck, measure this host and save recommended settings to the tuning file', action='store_true'
+    )
+    parser.add_argument(
+        '--digests',
+        nargs='?',
+        type=str,
+        default=None,
+        help='comma separated digests to calculate in addition to md5: sha256, blake2b, accuraterip, segments',
+    )
+    parser.add_argument(
+        '--verify-digest',
+        nargs='?',
+        type=str,
+        default=None,
+        help='digest used to verify files against the database (default: md5)',
+    )
+    parser.add_argument(
+        '--accuraterip-cache',
+        nargs='?',
+        type=str,
+        default=None,
+        help='specify directory of cached AccurateRip responses (dBAR-*.bin)',
+    )
+    parser.add_argument(
+        '--sample',
+        nargs='?',
+        type=int,
+        default=None,
+        help='curate a stratified random sample of this many files from the database instead of the whole library',
+    )
+    parser.add_argument(
+        '--time-budget',
+        nargs='?',
+        type=float,
+        default=None,
+        help='stop sampling, or with --schedule cost stop starting files that would not finish, after this many seconds',
+    )
+    parser.add_argument(
+        '--spot-check',
+        nargs='?',
+        type=int,
+        default=None,
+        help='verify files with a segments digest by this many random segments each, 0 for every segment',
+    )
+    parser.add_argument(
+        '--socket',
+        nargs='?',
+        type=str,
+        default=None,
+        help='specify the socket of the flaccurate service (default: the database filename with .sock appended)',
+    )
+    parser.add_argument(
+        '--shard-action',
+        type=str,
+        default=None,
+        choices=['export', 'merge'],
+        help='shard: export work manifests, or merge results files',
+    )
+    parser.add_argument(
+        '--shards',
+        nargs='?',
+        type=int,
+        default=None,
+        help='number of work manifests to export (default: 2)',
+    )
+    parser.add_argument(
+        '--shard-by',
+        type=str,
+        default=None,
+        choices=['path', 'directory', 'bytes'],
+        help='how to split work manifests: by path, by directory or balanced by bytes (default)',
+    )
+    parser.add_argument(
+        '--shard-dir',
+        nargs='?',
+        type=str,
+        default=None,
+        help='specify directory holding work manifests and results files (default: current directory)',
+    )
+    parser.add_argument(
+        '--sidecar-action',
+        type=str,
+        default=None,
+        choices=['export', 'import'],
+        help='sidecar: write sidecar files from the database, or record the checksums in them',
+    )
+    parser.add_argument(
+        '--sidecar-format',
+        nargs='?',
+        type=str,
+        default=None,
+        help='comma separated sidecar formats to export: ffp (default: ffp)',
+    )
+    parser.add_argument(
+        '--manifest',
+        nargs='?',
+        type=str,
+        default=None,
+        help='specify a work manifest for curate to verify instead of --input',
+    )
+    parser.add_argument(
+        '--results',
+        nargs='?',
+        type=str,
+        default=None,
+        help='specify the results file written for --manifest (default: alongside the manifest)',
+    )
     parser.add_argument(
         'command',
         nargs='*',
@@ -84,7 +331,12 @@ def _init_argparse():
         metavar='command',
         choices=_discover_commands()
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+
+    # Every command takes the first --input, curate all of them
+    args.inputs = args.input or []
+    args.input = args.inputs[0] if args.inputs else None
+    return args
 
 def _discover_commands():
     return [module_name.replace('flaccurate.commands.','')
@@ -3,5 +3,7 @@
 # import Class
 from flaccurate.database import Database
 from flaccurate.dynloader import Plugins
+from flaccurate.context import Context
 from flaccurate.exception import Usage
 import flaccurate.plugins
+from flaccurate.library import Library
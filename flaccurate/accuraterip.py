@@ -0,0 +1,173 @@
+import os
+import struct
+
+try:
+    import numpy
+except ImportError:  # optional - without it AccurateRip CRCs are simply not calculated
+    numpy = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+# AccurateRip CRCs of CD audio tracks (16 bit, stereo, 44.1kHz PCM).
+#
+# Each stereo sample is taken as a little endian 32 bit value (left in the low
+# 16 bits) and multiplied by its 1-based position in the track:
+#   v1 = sum(position * value) mod 2^32
+#   v2 = sum(high32(position * value) + low32(position * value)) mod 2^32
+# The first track of a disc skips the first 5 sectors (less one sample), the
+# last track skips the last 5 sectors - drive read offsets make them unreliable.
+#
+# Whether a track is first or last on its disc is not known while decoding, so
+# all four variants are kept.  Because the sums are linear, only the head and
+# tail windows need accounting for separately, and the variants fall out as:
+#   middle = all samples
+#   first  = all - head
+#   last   = all - tail
+#   only   = all - head - tail (the single track of a disc)
+
+SAMPLES_PER_SECTOR = 588
+SKIP_SAMPLES = 5 * SAMPLES_PER_SECTOR
+VARIANTS = ('middle', 'first', 'last', 'only')
+MASK = 0xFFFFFFFF
+
+# Stored record: total samples followed by (v1, v2) for each variant
+RECORD = struct.Struct('<Q8I')
+
+# dBAR-*.bin response file layout, all little endian
+RESPONSE_HEADER = struct.Struct('<BIII')  # track count, disc id 1, disc id 2, freedb disc id
+RESPONSE_TRACK = struct.Struct('<BII')    # confidence, crc, crc of offset finding frame
+
+
+def supported(stream_info):
+    return (numpy is not None and
+            stream_info.get('sample_rate') == 44100 and
+            stream_info.get('channels') == 2 and
+            stream_info.get('bits_per_sample') == 16)
+
+
+class AccurateRipHasher():
+    """hashlib style interface over signed little endian 16 bit stereo PCM.
+
+update() works on whole buffers at a time with NumPy, the digest is a RECORD.
+"""
+    name = 'accuraterip'
+
+    def __init__(self):
+        self.samples = 0
+        self.total = [0, 0]
+        self.head = [0, 0]
+        self.tail = numpy.zeros(0, dtype=numpy.uint32)
+        self.carry = b''
+
+    @staticmethod
+    def _sums(values, first_position):
+        product = values.astype(numpy.uint64) * numpy.arange(first_position, first_position + len(values), dtype=numpy.uint64)
+        low = int((product & MASK).sum())
+        high = int((product >> numpy.uint64(32)).sum())
+        return low, low + high
+
+    def update(self, buffer):
+        data = self.carry + bytes(buffer) if self.carry else buffer
+        usable = len(data) - len(data) % 4
+        self.carry = bytes(data[usable:])
+        values = numpy.frombuffer(data, dtype='<u4', count=usable // 4)
+        if(not len(values)):
+            return
+
+        v1, v2 = self._sums(values, self.samples + 1)
+        self.total = [(self.total[0] + v1) & MASK, (self.total[1] + v2) & MASK]
+
+        # Positions 1 .. SKIP_SAMPLES - 1 are skipped on a first track
+        head = SKIP_SAMPLES - 1 - self.samples
+        if(head > 0):
+            v1, v2 = self._sums(values[:head], self.samples + 1)
+            self.head = [(self.head[0] + v1) & MASK, (self.head[1] + v2) & MASK]
+
+        self.tail = numpy.concatenate((self.tail, values))[-SKIP_SAMPLES:]
+        self.samples += len(values)
+
+    def digest(self):
+        # Last SKIP_SAMPLES positions are skipped on a last track.  Where a short
+        # track's head and tail windows overlap, only subtract the overlap once.
+        tail_start = self.samples - len(self.tail) + 1
+        tail = self._sums(self.tail, tail_start)
+        overlap = max(SKIP_SAMPLES - tail_start, 0)
+        tail_after_head = self._sums(self.tail[overlap:], tail_start + overlap)
+
+        crcs = {
+            'middle': self.total,
+            'first': [self.total[i] - self.head[i] for i in (0, 1)],
+            'last': [self.total[i] - tail[i] for i in (0, 1)],
+            'only': [self.total[i] - self.head[i] - tail_after_head[i] for i in (0, 1)],
+        }
+        return RECORD.pack(self.samples, *[crc & MASK for variant in VARIANTS for crc in crcs[variant]])
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+
+def unpack(record):
+    """Return (samples, {variant: (v1, v2)}) from a stored record."""
+    values = RECORD.unpack(record)
+    return values[0], {variant: values[1 + i * 2:3 + i * 2] for i, variant in enumerate(VARIANTS)}
+
+
+def variant(track_number, track_count):
+    if(track_count == 1):
+        return 'only'
+    if(track_number == 1):
+        return 'first'
+    if(track_number == track_count):
+        return 'last'
+    return 'middle'
+
+
+def disc_ids(track_samples):
+    """AccurateRip disc ids for tracks of the given lengths, as if they were a CD
+without pregaps - returns (id1, id2, freedb_id)."""
+    sectors = [samples // SAMPLES_PER_SECTOR for samples in track_samples]
+    offsets = [sum(sectors[:i]) for i in range(len(sectors))]
+    lead_out = sum(sectors)
+
+    id1 = (sum(offsets) + lead_out) & MASK
+    id2 = (sum(n * max(offset, 1) for n, offset in enumerate(offsets, 1)) + (len(sectors) + 1) * lead_out) & MASK
+
+    # freedb offsets include the 2 second lead-in
+    digit_sum = sum(sum(map(int, str((offset + 150) // 75))) for offset in offsets)
+    freedb_id = ((digit_sum % 255) << 24) | (((lead_out // 75) & 0xFFFF) << 8) | (len(sectors) & 0xFF)
+
+    return id1, id2, freedb_id
+
+
+def response_filename(track_count, ids):
+    return 'dBAR-%03d-%08x-%08x-%08x.bin' % ((track_count,) + tuple(ids))
+
+
+def find_response(cache_dir, track_count, ids):
+    """Locate a cached response - either flat in cache_dir, or in the
+x/y/z/ layout used by the AccurateRip server (last three digits of disc id 1)."""
+    filename = response_filename(track_count, ids)
+    for candidate in (os.path.join(cache_dir, filename),
+                      os.path.join(cache_dir, filename[16], filename[15], filename[14], filename)):
+        if(os.path.isfile(candidate)):
+            return candidate
+    return None
+
+
+def parse_response(data, ids):
+    """Return {track_number: [(confidence, crc, crc450), ...]} for the entries
+in a response matching the disc ids - one entry per pressing submitted."""
+    matches = {}
+    offset = 0
+    while(offset + RESPONSE_HEADER.size <= len(data)):
+        track_count, id1, id2, freedb_id = RESPONSE_HEADER.unpack_from(data, offset)
+        offset += RESPONSE_HEADER.size
+        for track_number in range(1, track_count + 1):
+            if(offset + RESPONSE_TRACK.size > len(data)):
+                logger.warning('Truncated AccurateRip response')
+                return matches
+            if((id1, id2, freedb_id) == tuple(ids)):
+                matches.setdefault(track_number, []).append(RESPONSE_TRACK.unpack_from(data, offset))
+            offset += RESPONSE_TRACK.size
+    return matches
@@ -0,0 +1,88 @@
+import os
+import re
+import json
+import time
+
+import flaccurate.history
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Catalog of library roots, each recorded in a database of its own (see:
+# curate --catalog).
+#
+# A library spread over several volumes is curated in one run: each root in
+# a shard database of its own - the roots on one device one after another,
+# those on different devices at the same time.  A shard is validated and
+# checksummed on its own, so opening and updating one costs in proportion to
+# its root rather than to the whole library.
+#
+# The catalog is a small JSON file, kept alongside the shard databases:
+#
+#   {"version": 1,
+#    "roots": {"/mnt/a/music": {"database": "catalog-mnt-a-music.db",
+#                               "run": {"finished": ..., "counts": {outcome: count}},
+#                               "failed": ...}}}
+#
+# The database is relative to the catalog, run the totals of the root's
+# latest complete run, and failed when its latest run could not be completed
+# - present only then.
+
+FORMAT_VERSION = 1
+
+
+def load(filename):
+    """The catalog in filename - an empty one when there is no such file."""
+    try:
+        with open(filename) as fileh:
+            catalog = json.load(fileh)
+    except FileNotFoundError:
+        logger.info('Catalog not found - creating: %s', filename)
+        return {'version': FORMAT_VERSION, 'roots': {}}
+    if(catalog.get('version') != FORMAT_VERSION):
+        raise ValueError('Unsupported catalog version: %s' % catalog.get('version'))
+    return catalog
+
+
+def save(filename, catalog):
+    partial = filename + '.partial'
+    with open(partial, 'w') as fileh:
+        json.dump(catalog, fileh, indent=2, sort_keys=True)
+    os.replace(partial, filename)
+
+
+def shard_database(filename, catalog, root):
+    """The shard database of root, adding root to the catalog when it is not there yet."""
+    entry = catalog['roots'].get(root)
+    if(entry is None):
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        name = '%s-%s' % (stem, re.sub('[^A-Za-z0-9]+', '-', root).strip('-') or 'root')
+        taken = {entry['database'] for entry in catalog['roots'].values()}
+        database, suffix = name + '.db', 1
+        while(database in taken):
+            suffix += 1
+            database = '%s-%i.db' % (name, suffix)
+        entry = catalog['roots'][root] = {'database': database}
+        logger.info('Catalog: %s recorded in %s', root, database)
+    return os.path.join(os.path.dirname(os.path.abspath(filename)), entry['database'])
+
+
+def record_run(catalog, root, counts):
+    entry = catalog['roots'][root]
+    entry['run'] = {
+        'finished': int(time.time()),
+        'counts': {flaccurate.history.OUTCOMES[outcome]: count for outcome, count in counts.items()},
+    }
+    entry.pop('failed', None)
+
+
+def record_failure(catalog, root):
+    catalog['roots'][root]['failed'] = int(time.time())
+
+
+def device_lanes(roots):
+    """Split roots into one lane per device (st_dev), each in the order given."""
+    lanes = {}
+    for root in roots:
+        lanes.setdefault(os.stat(root).st_dev, []).append(root)
+    return list(lanes.values())
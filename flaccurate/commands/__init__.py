@@ -1,3 +1,10 @@
 from flaccurate.commands.curate import Curate
 from flaccurate.commands.selfcheck import SelfCheck
 from flaccurate.commands.noop import NoOp
+from flaccurate.commands.compare import Compare
+from flaccurate.commands.history import History
+from flaccurate.commands.accuraterip import AccurateRip
+from flaccurate.commands.rejects import Rejects
+from flaccurate.commands.serve import Serve
+from flaccurate.commands.shard import Shard
+from flaccurate.commands.sidecar import Sidecar
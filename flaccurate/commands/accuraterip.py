@@ -0,0 +1,77 @@
+from .base import Base
+
+import os
+
+import flaccurate
+import flaccurate.accuraterip
+
+import logging
+logger = logging.getLogger(__name__)
+
+class AccurateRip(Base):
+    """The accuraterip command verifies recorded AccurateRip CRCs against cached AccurateRip responses.
+
+CRCs are recorded by curate when run with --digests accuraterip, in the same
+pass as the audio md5.  This command does no decoding at all: each directory
+holding recorded CRCs is treated as a disc, its tracks ordered by filename,
+and the disc ids derived from the recorded track lengths.  The matching
+dBAR-*.bin response is read from the --accuraterip-cache directory (either
+flat, or in the x/y/z/ layout of the AccurateRip server) - no network lookups
+are made.
+
+Each track is reported as accurate (with the confidence of the best matching
+pressing, v1 or v2 CRC) or not matched.
+
+Usage:
+    flaccurate.py [--usage] --accuraterip-cache DIR accuraterip
+
+For general help:
+    flaccurate.py --help
+"""
+    def __init__(self, args, context=None):
+        super().__init__(args, context)
+
+    def run(self):
+        if(self.args.accuraterip_cache is None):
+            raise flaccurate.Usage('No --accuraterip-cache specified - nothing TODO - exiting...')
+
+        self.db = self._init_database()
+
+        counts = dict.fromkeys(('accurate', 'unmatched', 'unknown', 'incomplete'), 0)
+        for root, directory, tracks in self.db._iterate_directory_digests('accuraterip'):
+            counts[self.verify_disc(os.path.join(root, directory), tracks)] += 1
+
+        logger.info('AccurateRip complete: %i accurate, %i not matched, %i not in cache, %i incomplete discs',
+            counts['accurate'], counts['unmatched'], counts['unknown'], counts['incomplete'])
+
+    def verify_disc(self, directory, tracks):
+        logger.debug('verify_disc( %s )', directory)
+
+        missing = [basename for basename, record in tracks if record is None]
+        if(missing):
+            logger.info('%s: No AccurateRip CRCs recorded for %s - skipping', directory, ', '.join(missing))
+            return 'incomplete'
+
+        records = [flaccurate.accuraterip.unpack(bytes.fromhex(record)) for basename, record in tracks]
+        ids = flaccurate.accuraterip.disc_ids([samples for samples, crcs in records])
+        response = flaccurate.accuraterip.find_response(self.args.accuraterip_cache, len(tracks), ids)
+        if(response is None):
+            logger.info('%s: Not in AccurateRip cache (%s)', directory, flaccurate.accuraterip.response_filename(len(tracks), ids))
+            return 'unknown'
+
+        with open(response, 'rb') as response_fh:
+            matches = flaccurate.accuraterip.parse_response(response_fh.read(), ids)
+
+        accurate = True
+        for track_number, ((basename, record), (samples, crcs)) in enumerate(zip(tracks, records), 1):
+            v1, v2 = crcs[flaccurate.accuraterip.variant(track_number, len(tracks))]
+            confidence = [(entry_confidence, 'v2' if crc == v2 else 'v1')
+                for entry_confidence, crc, crc450 in matches.get(track_number, [])
+                    if crc in (v1, v2)]
+            if(confidence):
+                logger.info('%s: %s - Accurate (confidence %i, %s)', directory, basename, *max(confidence))
+            else:
+                logger.warning('%s: %s - Not matched (v1: %08x v2: %08x)', directory, basename, v1, v2)
+                accurate = False
+
+        return 'accurate' if accurate else 'unmatched'
@@ -1,9 +1,10 @@
 import sys
 
+import flaccurate.context
 import flaccurate.exception
 
 import logging
-logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
 class Base(object):
     """The Base class from which all flaccurate.commands.* should inherit.
@@ -13,9 +14,19 @@ Currently only one abstract method which needs overriding: run()
 Implements the --usage output for each derived class, where they are expected
 to have a docstring header unique to the class explaining what the command does
 and any specific options required.
+
+The database and plugins come from a context shared with the other commands
+of the same invocation (see: flaccurate.context) - a command run on its own
+gets a context of its own.
+
+A command run on behalf of another (embedded) raises RuntimeError when
+either cannot be created, rather than ending the process.
 """
-    def __init__(self, args):
+    embedded = False
+
+    def __init__(self, args, context=None):
         self.args = args
+        self.context = context or flaccurate.context.Context(args)
 
         # Recommended by Guido himself:
         # See: http://www.artima.com/weblogs/viewpost.jsp?thread=4829
@@ -26,7 +37,7 @@ and any specific options required.
         self.silent = self.args.silent
         self.quiet = self.args.quiet
         self.log_level = self._init_logging()
-        logging.debug('Base __init__ %s', vars(self.args))
+        logger.debug('Base __init__ %s', vars(self.args))
 
     def _init_logging(self):
         if( self.debug ):
@@ -53,21 +64,26 @@ and any specific options required.
         )
         return log_level
 
-    def _init_database(self):
+    def _init_database(self, args=None):
+        # Any database other than --database is the caller's alone
         db = None
         try:
-            db = flaccurate.Database(self.args)
+            db = flaccurate.Database(args) if args is not None else self.context.database
         except RuntimeError as e:
-            logging.critical('%s - exiting', e.args[0])
+            if(self.embedded):
+                raise
+            logger.critical('%s - exiting', e.args[0])
             sys.exit(1)
         return db
 
     def _init_plugins(self):
         plugins = None
         try:
-            plugins = flaccurate.Plugins(self.args)
+            plugins = self.context.plugins
         except RuntimeError as e:
-            logging.critical('%s - exiting', e.args[0])
+            if(self.embedded):
+                raise
+            logger.critical('%s - exiting', e.args[0])
             sys.exit(1)
         return plugins
 
@@ -0,0 +1,143 @@
+from .base import Base
+
+import os
+import copy
+
+import flaccurate
+import flaccurate.sidecar
+
+import logging
+logger = logging.getLogger(__name__)
+
+class Compare(Base):
+    """The compare command checks the checksum database against another record of the same library.
+
+The --compare target is either a second flaccurate database (e.g. the one
+kept with a backup copy of the library), or a directory tree containing
+.md5 / .ffp sidecar files.  No audio is decoded - only recorded checksums
+are compared, paths being matched relative to their library root.  An .md5
+(md5sum) entry holds the md5 of the whole file rather than of its audio, so
+one which is not the database audio md5 is checked against the file it names
+in the --compare tree instead - reading that file, but decoding nothing.
+
+The records compared are those under --input: a library root, or a directory
+inside one - which may be left out when the database holds a single root.
+In a second database, the records under the same path are compared - or
+when it has none, under the same place in its single root (a backup mounted
+elsewhere).
+
+Both sides are streamed in the same sorted order and merged in a single pass,
+reporting entries which are:
+    missing    - in the database but not in the --compare target
+    extra      - in the --compare target but not in the database
+    mismatched - in both with differing checksums
+
+Usage:
+    flaccurate.py [--usage] [--input PATH] --compare PATH compare
+
+For general help:
+    flaccurate.py --help
+"""
+    def __init__(self, args, context=None):
+        super().__init__(args, context)
+
+    def run(self):
+        if(self.args.compare is None):
+            raise flaccurate.Usage('No --compare target specified - nothing TODO - exiting...')
+
+        self.db = self._init_database()
+        self.root = self._compared_root(self.db)
+
+        if(os.path.isdir(self.args.compare)):
+            logger.info('Comparing %s against sidecar files in: %s', self.db.db_file, self.args.compare)
+            other = flaccurate.sidecar.walk(self.args.compare)
+        elif(os.path.isfile(self.args.compare)):
+            logger.info('Comparing %s against database: %s', self.db.db_file, self.args.compare)
+            other = self._iterate_database(self.args.compare)
+        else:
+            logger.critical('Compare target not found: %s - exiting', self.args.compare)
+            return
+
+        logger.info('Comparing records under %s', self.root)
+        ours = ((directory, basename, md5, None) for directory, basename, md5, filetype in self.db._iterate_checksums(self.root))
+        counts = self.merge(ours, other)
+
+        logger.info('Compare complete: %i matched, %i missing, %i extra, %i mismatched',
+            counts['matched'], counts['missing'], counts['extra'], counts['mismatched'])
+
+    def _iterate_database(self, db_file):
+        # Opened through Database so the comparison target gets the same
+        # integrity and checksum validation as our own database.
+        # Never create it - a missing target is a mistake, not an inaugural launch.
+        args = copy.copy(self.args)
+        args.database = db_file
+        args.force = False
+        other_db = self._init_database(args)
+
+        # The same path, or the same place in the only root of a copy mounted elsewhere
+        root = self.root
+        if(other_db._scope(root)[0] is None):
+            if(len(other_db.roots) != 1):
+                raise flaccurate.Usage('%s is not within a library root in %s' % (root, db_file))
+            library_root, root_id, prefix = self.db._scope(root)
+            root = os.path.join(next(iter(other_db.roots)), prefix) if prefix else next(iter(other_db.roots))
+        logger.info('Compared with records under %s', root)
+
+        for directory, basename, md5, filetype in other_db._iterate_checksums(root):
+            yield directory, basename, md5, None
+
+    def _compared_root(self, db):
+        if(self.args.input is not None):
+            root = os.path.abspath(self.args.input)
+            if(db._scope(root)[0] is None):
+                raise flaccurate.Usage('%s is not within a library root in %s' % (root, db.db_file))
+            return root
+        if(len(db.roots) != 1):
+            raise flaccurate.Usage('%s holds %i library roots - choose the records to compare with --input: %s' % (
+                db.db_file, len(db.roots), ', '.join(sorted(db.roots))))
+        return next(iter(db.roots))
+
+    def merge(self, ours, other):
+        """Single pass sorted merge of two (directory, basename, md5, sidecar extension) streams."""
+        counts = dict.fromkeys(('matched', 'missing', 'extra', 'mismatched'), 0)
+        sentinel = (None, None, None, None)
+
+        def key(entry):
+            return (flaccurate.sidecar.walk_key(entry[0]), entry[1])
+
+        our_entry = next(ours, sentinel)
+        other_entry = next(other, sentinel)
+
+        while(our_entry is not sentinel or other_entry is not sentinel):
+            if(other_entry is sentinel or
+                (our_entry is not sentinel and key(our_entry) < key(other_entry))):
+                logger.warning('Missing: %s', os.path.join(our_entry[0], our_entry[1]))
+                counts['missing'] += 1
+                our_entry = next(ours, sentinel)
+            elif(our_entry is sentinel or key(other_entry) < key(our_entry)):
+                logger.warning('Extra: %s', os.path.join(other_entry[0], other_entry[1]))
+                counts['extra'] += 1
+                other_entry = next(other, sentinel)
+            else:
+                if(our_entry[2] == other_entry[2]):
+                    logger.debug('Matched: %s (%s)', os.path.join(our_entry[0], our_entry[1]), our_entry[2])
+                    counts['matched'] += 1
+                elif(other_entry[3] == '.md5' and self._file_md5(other_entry) == other_entry[2]):
+                    logger.debug('Matched: %s (whole file %s)', os.path.join(our_entry[0], our_entry[1]), other_entry[2])
+                    counts['matched'] += 1
+                else:
+                    logger.warning('Mismatched: %s (Database: %s Compare: %s)', os.path.join(our_entry[0], our_entry[1]), our_entry[2], other_entry[2])
+                    counts['mismatched'] += 1
+                our_entry = next(ours, sentinel)
+                other_entry = next(other, sentinel)
+
+        return counts
+
+    def _file_md5(self, entry):
+        # The whole file md5 of a sidecar entry's file - None when unreadable
+        filename = os.path.join(self.args.compare, entry[0], entry[1])
+        try:
+            return flaccurate.sidecar.file_md5(filename)
+        except OSError as e:
+            logger.error('Failed to read %s: %s', filename, e)
+            return None
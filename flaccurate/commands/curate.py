@@ -1,14 +1,26 @@
 from .base import Base
 
+import os
 import sys
-import glob
+import copy
+import socket
+import time
 from pathlib import Path
 
-import filetype as filemagic
-import filetype.utils
+import flaccurate
+import flaccurate.catalog
+import flaccurate.context
+import flaccurate.history
+import flaccurate.processor
+import flaccurate.rules
+import flaccurate.sampling
+import flaccurate.scheduler
+import flaccurate.service
+import flaccurate.shard
+import flaccurate.walker
 
 import logging
-logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
 class Curate(Base):
     """The curate command performs the real work of flaccurate.
@@ -17,27 +29,149 @@ Takes the given --input and calculates it checksum.
 If an entry exists in the checksum database from a previous run,
 it is compared to check for accuracy, any discrepancies are highlighted.
 
+Files are processed in the order they are found, one filetype at a time.
+The listing of every directory walked is recorded, and reused by the next run
+while the directory's mtime is unchanged - only changed directories are read
+again.  --rescan reads every directory regardless.
+
+--staging keeps the database in memory for the run, for the first curate of a
+large library in particular: it is written back to disk every few minutes and
+at the end, each time in full to a temporary file renamed over the database,
+and the database checksum only updated then - rather than after every file.
+
+Parts of the library can be left out with gitignore style rules: one per line
+in .flaccurate-ignore at the root of --input, then each --exclude PATTERN,
+then each --include PATTERN re-including what an earlier rule excluded (see:
+flaccurate/rules.py).  An excluded directory is never read, for example:
+    @eaDir/
+    /Incoming/
+    **/Samples/*.wav
+With --schedule device, files are grouped by the device they live on with one
+worker thread per device, each reading its files in on-disk order (physical
+extent where the filesystem reports it, otherwise inode) to minimise seeking.
+With --schedule cost, files are processed longest first by --workers threads
+(default: one per CPU), using the size, stream format and processing time
+recorded for each file by earlier runs - so the largest files do not hold up
+the end of the run - and the time remaining is reported as the run goes.  With
+--time-budget, files not expected to finish within it are left for a later run.
+
+Audio files are read with page cache hints so a run does not evict everything
+else from memory.  --io-direct bypasses the page cache altogether (O_DIRECT),
+and --io-limit caps the combined read rate in MB/s so a run can share the
+machine with other workloads.  --read-buffer sets the size of each read in KB,
+and --read-ahead how many reads ahead the kernel is asked to fetch.
+--pcm-buffer gathers decoded audio into buffers of that many KB before it is
+hashed, 0 hashing it as decoded (see: flaccurate/dynloader.py).  When not
+given, these and --workers are taken from the host's tuning file, if
+selfcheck --calibrate has written one.
+
+An md5 of the audio data is always calculated.  --digests adds further digests
+(sha256, blake2b), calculated in the same pass over the audio and recorded
+alongside it.  accuraterip adds AccurateRip CRCs for CD audio flac files, from
+the same decode (see the accuraterip command).  --verify-digest chooses which digest verification relies on;
+until a file has a record of it, md5 is used and the new digest is recorded
+once md5 verifies - so switching algorithm costs no additional pass.
+
+segments adds a segmented digest: a hash tree over 4MB segments of the audio
+range of an mp3, or the encoded frames of a flac (an extra read, undecoded).
+A file failing verification then has only its changed segments re-read and
+reported - as does a flac which no longer decodes, damage inside a frame
+failing its CRC before any digest could be compared.  --spot-check N verifies files recorded with one by N segments
+picked at random - every segment with 0 - hashed in parallel and without
+decoding, in place of calculating the digests.
+
+With --manifest, the files of a shard exported from another host's database
+are verified instead (see the shard command) - against the digests recorded
+in the manifest, without any database here.  --input gives the library root
+when it is mounted somewhere else than on the exporting host.  The outcomes
+are written to --results, by default alongside the manifest.
+
+When a flaccurate service is running for the database (see the serve command)
+the work is handed to it, and its results reported here - saving the cost of
+loading and validating the database again.  The service processes it with
+its own settings, so only a curate given none of its own is handed over.
+
+Files found to be invalid or undecodable are remembered, along with their
+size and modification time, and skipped by later runs until either changes
+(see the rejects command).  Files already in the database are never skipped.
+
+An --input inside a library root already in the database is curated as part
+of that root, and a root inside a new --input becomes part of it - each file
+is only ever recorded once.
+
+--input may be given several times, the roots curated one after another into
+the one database.  With --catalog FILE each root is instead recorded in a
+database of its own - a shard, created alongside the catalog the first time
+the root is curated - and the roots on different devices are curated at the
+same time, those on one device one after another.  Each shard is validated
+and checksummed on its own, at a cost in proportion to its root.  The
+catalog records every root, its shard and the totals of its latest run;
+--catalog without --input curates every root in it (see: flaccurate/catalog.py).
+A root which cannot be curated (its shard failing validation, say) is
+reported and recorded in the catalog, the others curated regardless - and
+curate exits non-zero.
+
+--sample N is a quick spot check instead of a full run: N files already in the
+database under --input are drawn at random, stratified by top level directory,
+format and size, and verified - within --time-budget seconds if given.  An
+estimated corruption rate is reported with its 95% confidence interval, and
+every directory where a sampled file fails is then verified in full.  No new
+files are looked for.
+
 Usage:
-    flaccurate.py [--usage] curate
+    flaccurate.py [--usage] [--staging] [--rescan] [--exclude PATTERN]... [--include PATTERN]...
+                  [--schedule glob|device|cost] [--workers N]
+                  [--io-direct] [--io-limit MBPS] [--read-buffer KB] [--read-ahead N] [--pcm-buffer KB] [--tuning FILE]
+                  [--digests LIST] [--verify-digest DIGEST]
+                  [--sample N] [--time-budget SECONDS] [--spot-check N] curate
+    flaccurate.py [--usage] [--input PATH]... [--catalog FILE] [options as above] curate
+    flaccurate.py [--usage] [--input PATH] [--workers N] --manifest FILE [--results FILE] curate
 
 For general help:
     flaccurate.py --help
 """
-    def __init__(self,args):
-        super().__init__(args)
+    # Seconds between progress reports for scheduled work
+    PROGRESS_INTERVAL = 30
+
+    def __init__(self, args, context=None):
+        super().__init__(args, context)
 
     def run(self):
-        self.db = self._init_database()
-        self.plugins = self._init_plugins()
+        # Totals of the run, once complete - the service's when it did the work
+        self.counts = None
+
+        if(self.args.manifest is not None):
+            # A shard of another host's database - no database of our own
+            self._init_processing()
+            self.process_manifest(self.args.manifest, self.args.results or flaccurate.shard.results_filename(self.args.manifest))
+            return
+
+        if(getattr(self.args, 'catalog', None) is not None or len(getattr(self.args, 'inputs', None) or []) > 1):
+            self.process_roots()
+            return
 
         if(self.args.input is None):
             raise flaccurate.Usage('No input specified - nothing TODO - exiting...')
             # implement checking for config elsewhere (file / env variable)
         else:
             if not(Path(self.args.input).is_dir()):
-                logging.info('Specified input does not exist - exiting')
+                if(self.embedded):
+                    raise RuntimeError('Specified input does not exist: %s' % self.args.input)
+                logger.info('Specified input does not exist - exiting')
                 sys.exit(0)
 
+        # A running service (see: serve command) already has the database and
+        # plugins loaded - hand it the work rather than loading them again
+        self.counts = flaccurate.service.curate(self.args)
+        if(self.counts is not None):
+            return
+
+        self._init_curate()
+
+        # Paths are recorded relative to the library root they were found under -
+        # the root already holding --input when there is one
+        self.db._register_root(self.args.input)
+
         # For all supported filetypes,
         # recurse through the supplied path and determine the audio hash.
         # A supported filetype is determined by the presence of a
@@ -46,86 +180,307 @@ For general help:
         # Operation as follows:
         # For each supported file type (read: plugin) (see: process_filetype())
         # For each matching file found in file type (see: itterate_iglob())
-        # Calculate the audio md5 checksum: (see: _process_file())
+        # Calculate the audio md5 checksum: (see: flaccurate.processor.Processor.process_file())
         # 1. If the database record exists for file (see: Database._retrieve_checksum())
-        #       Compare new checksum against database record (see: _process_file())
+        #       Compare new checksum against database record (see: Processor.verify())
         #           If checksum matches all good
         #           If checksum doesn't match report it
         # 2. If the database has no record of file - insert it for first time (see: Database._insert_checksum())
-        
-        self.process_all()
+        # The outcome for every file is recorded against this run (see: flaccurate.history)
+
+        # Path rules are the library root's, matched relative to it - --input
+        # may be a directory inside the root
+        root, root_id, prefix = self.db._scope(self.args.input)
+        self.rules = flaccurate.rules.load(root, self.args.exclude, self.args.include)
+
+        # Directories unchanged since the last walk reuse their recorded listing
+        self.walker = flaccurate.walker.Walker(self.args.input, None if self.args.rescan else self.db._retrieve_listings(self.args.input), rules=self.rules, prefix=prefix)
+
+        # Cost hints recorded by earlier runs
+        self.costs = self.db._retrieve_costs(self.args.input)
+
+        # Segment digests for files to spot check rather than checksum
+        if(self.args.spot_check is not None):
+            self.processor.segments = self.db._retrieve_segments(self.args.input)
+
+        if(self.args.sample is not None):
+            self.history = self.processor.begin_run('curate --sample')
+            self.process_sample(self.args.sample, self.args.time_budget)
+        else:
+            self.history = self.processor.begin_run('curate')
+            self.process_all()
+        self.processor.finish_run()
+        self.counts = self.history.counts
 
-    def _calculate_checksum(self, filename, filetype):
-        logging.debug('_calculate_checksum( %s, %s )', filename, filetype)
-        return self.plugins.plugin(filetype).md5(filename)
+    def process_roots(self):
+        catalog = None
+        catalog_file = getattr(self.args, 'catalog', None)
+        roots = [os.path.abspath(path) for path in getattr(self.args, 'inputs', None) or []]
+        if(catalog_file is not None):
+            try:
+                catalog = flaccurate.catalog.load(catalog_file)
+            except (OSError, ValueError) as e:
+                raise flaccurate.Usage('Unable to read catalog: %s' % e)
+            roots = roots or sorted(catalog['roots'])
+
+        for root in [root for root in roots if not os.path.isdir(root)]:
+            logger.warning('Specified input does not exist: %s - skipping', root)
+            roots.remove(root)
+        if(not roots):
+            raise flaccurate.Usage('No input specified - nothing TODO - exiting...')
+
+        failed = []
+        if(catalog is None):
+            # One database - one root after another
+            for root in roots:
+                try:
+                    root, counts = self._curate_root(root)
+                except Exception:
+                    logger.exception('Failed to curate %s', root)
+                    counts = None
+                self._curated_root(root, counts, failed)
+        else:
+            databases = {root: flaccurate.catalog.shard_database(catalog_file, catalog, root) for root in roots}
+            flaccurate.catalog.save(catalog_file, catalog)
+
+            lanes = flaccurate.catalog.device_lanes(roots)
+            logger.info('Curating %i roots on %i devices', len(roots), len(lanes))
+            lanes = [[(root, databases[root]) for root in lane] for lane in lanes]
+            for root, counts in flaccurate.scheduler.run_lanes(lanes, self._curate_root, failed=lambda root, database: (root, None)):
+                if(counts is not None):
+                    flaccurate.catalog.record_run(catalog, root, counts)
+                else:
+                    flaccurate.catalog.record_failure(catalog, root)
+                self._curated_root(root, counts, failed)
+            flaccurate.catalog.save(catalog_file, catalog)
+
+        if(failed):
+            logger.critical('Failed to curate %i of %i roots: %s - exiting', len(failed), len(roots), ', '.join(failed))
+            sys.exit(1)
+
+    def _curated_root(self, root, counts, failed):
+        if(counts is None):
+            failed.append(root)
+            logger.error('Failed to curate %s', root)
+        else:
+            logger.info('Curated %s: %s', root, ' '.join('%s: %i' % (flaccurate.history.OUTCOMES[outcome], count) for outcome, count in counts.items()))
+
+    def _curate_root(self, root, database=None):
+        # A curate of its own for the root - with a database of its own when
+        # given one, opened on the thread running it.  Raises rather than
+        # exiting when the database or plugins cannot be loaded.
+        args = copy.copy(self.args)
+        args.input = root
+        args.inputs = [root]
+        args.catalog = None
+        if(database is None):
+            context = self.context
+        else:
+            args.database = database
+            args.force = args.force or not os.path.exists(database)
+            context = flaccurate.context.Context(args)
+
+        curate = Curate(args, context)
+        curate.embedded = True
+        try:
+            curate.run()
+        finally:
+            if(database is not None):
+                context.close()
+        return root, curate.counts
+    def _init_curate(self):
+        # Everything needed to process files, independent of --input -
+        # the file processing itself is the library's (see: flaccurate.processor)
+        self._init_processing(self._init_database())
+        self.db = self.processor.db
+
+    def _init_processing(self, db=None):
+        # Everything needed to checksum files - without a database unless given one
+        self.processor = flaccurate.processor.Processor(self.args, self._init_plugins(), db)
+        self.plugins = self.processor.plugins
+
+        # Cost hints recorded by earlier runs, for scheduling
+        self.costs = {}
 
     def _itterate_iglob(self, filetype):
-        logging.debug('itterate_iglob( %s )', filetype)
-        logging.info('Processing %s files', filetype)
+        logger.debug('itterate_iglob( %s )', filetype)
+        logger.info('Processing %s files', filetype)
         count = 0
-        for filename in glob.iglob(self.args.input + '**/*.' + filetype, recursive=True):
-            logging.info('%s: %s', filetype, filename)
+        for filename in self._discover(filetype):
+            logger.info('%s: %s', filetype, filename)
             count += 1
-            self._process_file(filename, filetype)
-
-        logging.info('Processed %i %s files', count, filetype)
-
-    def _valid_file(self, filename, filetype):
-        logging.debug('_valid_file( %s, %s )', filename, filetype)
-        # Delegate file validation to the filetype module.
-        # Aliased to filemagic on import - already using a variable
-        # called filetype throughout.
-
-        # The filetype module does file magic checking in pure python,
-        # so no deps or bindings on libmagic or anything else.
-        # Interface is a bit clunky, considered duplicating its validation
-        # logic in each plugin, but placing the one very awkward call here
-        # means it will apply to every supported filetype (read: plugin)
-        # without any additional work.
-        #
-        # 1. Retrieve a filemagic object of the type we want
-        # to validate against.  Bit of a nightmare, as the function:
-        # get_type() compares the "filetype" argument passed in,
-        # against an enumerated list of filetypes, using is().
-        # is() does not play nicely if the filetype argument takes the form
-        # of a key from a dictionary - never matching against what looks like
-        # identical strings.  Need to jump through an intern() hoop to get the
-        # "correct string" for comparison.
-        # 2. Using the filemagic object returned from step one above, via:
-        # get_type() - call it's instance method: match() passing in the
-        # appropriate bytes from the file being tested - this is where the
-        # the magic happens..
-        # The public API is at least helpful here, providing a utility function:
-        # get_signature_bytes(filename)
-        # Return from match() is Boolean, so just pass it back to caller.
-        return filemagic.get_type(None,sys.intern(filetype)).match( filemagic.utils.get_signature_bytes( filename ) )
-
-    def _process_file(self, filename, filetype):
-        logging.debug('_process_file( %s, %s )', filename, filetype)
-
-        if(not self._valid_file(filename, filetype)):
-            logging.info('Skipping invalid %s: %s', filetype, filename)
-            return
+            self.processor.record_outcome(filename, self.processor.process_file(filename, filetype))
 
-        checksum_calculated = self._calculate_checksum( filename, filetype )
-        checksum_record = self.db._retrieve_checksum( filename )
+        logger.info('Processed %i %s files', count, filetype)
 
-        if( checksum_record is not None ):
-            if( checksum_calculated == checksum_record ):
-                logging.debug('_process_file( %s, %s ): Checksum verified (%s)', filename, filetype, checksum_calculated)
-            else:
-                logging.warning('%s: %s - Failed checksum (Current: %s Previous: %s)', filetype, filename, checksum_calculated, checksum_record)
-        else:
-            logging.debug('_process_file( %s, %s ): Inserting checksum (%s)', filename, filetype, checksum_calculated)
-            self.db._insert_checksum({
-                'filename': filename,
-                'md5': checksum_calculated,
-                'filetype': filetype
-            })
+    def _discover(self, filetype):
+        extension = '.' + filetype
+        for directory, files in self.walker.walk():
+            for basename in files:
+                if(basename.endswith(extension)):
+                    filename = os.path.join(directory, basename)
+                    if(not self.processor.known_reject(filename)):
+                        yield filename
 
     def process_filetype(self, filetype):
         self._itterate_iglob(filetype)
 
+    def process_scheduled(self, lanes, workers_per_lane=1, estimates=None):
+        # Checksums are calculated on the scheduler's worker threads,
+        # everything touching the database happens back here
+        count = 0
+        if(estimates is not None):
+            progress = flaccurate.scheduler.Progress(estimates.values(), workers_per_lane)
+            reported = time.monotonic()
+
+        for filename, filetype, digests_calculated, outcome in flaccurate.scheduler.run_lanes(lanes, self.processor.checksum_file, workers_per_lane, failed=self.processor.checksum_failed):
+            logger.info('%s: %s', filetype, filename)
+            count += 1
+            self.processor.record_outcome(filename, self.processor.process_checksum(filename, filetype, digests_calculated, outcome))
+
+            if(estimates is not None):
+                progress.update(estimates.get(filename, 0))
+                if(time.monotonic() - reported > self.PROGRESS_INTERVAL):
+                    reported = time.monotonic()
+                    logger.info('Processed %i of %i files - estimated %s remaining', count, len(estimates), _duration(progress.eta()))
+
+        logger.info('Processed %i files', count)
+
     def process_all(self):
-        for filetype in self.plugins.supported_filetypes():
-            self.process_filetype(filetype)
+        if(self.args.schedule in ('device', 'cost')):
+            work = ((filename, filetype)
+                for filetype in self.plugins.supported_filetypes()
+                    for filename in self._discover(filetype))
+
+        if(self.args.schedule == 'device'):
+            self.process_scheduled(flaccurate.scheduler.device_lanes(work), self.args.workers or 1)
+        elif(self.args.schedule == 'cost'):
+            workers = self.args.workers or os.cpu_count() or 1
+            planned = flaccurate.scheduler.longest_first(work, flaccurate.scheduler.CostModel(self.costs))
+            estimates = {filename: estimate for estimate, filename, filetype in planned}
+            logger.info('Scheduled %i files longest first on %i workers - estimated %s', len(planned), workers, _duration(sum(estimates.values()) / workers))
+            self.process_scheduled([self._within_budget(planned, self.args.time_budget)], workers, estimates)
+        else:
+            for filetype in self.plugins.supported_filetypes():
+                self.process_filetype(filetype)
+
+        logger.info('Walked %i directories: %i read, %i unchanged since the last walk, %i pruned', self.walker.scanned + self.walker.reused, self.walker.scanned, self.walker.reused, len(self.walker.pruned))
+        if(self.walker.changed):
+            self.db._update_listings(self.args.input, self.walker.changed)
+
+        if(self.processor.rejects_skipped):
+            logger.info('Skipped %i unchanged files rejected by earlier runs (see: rejects command)', self.processor.rejects_skipped)
+
+    def process_manifest(self, manifest, results):
+        try:
+            header, entries = flaccurate.shard.read_lines(manifest)
+        except (OSError, ValueError) as e:
+            raise flaccurate.Usage('Unable to read manifest: %s' % e)
+
+        # The library may be mounted somewhere else here than on the exporting host
+        root = self.args.input or header['root']
+        expected = {}
+        work = []
+        for path, filetype, digests in entries:
+            expected[os.path.join(root, path)] = (path, digests)
+            work.append((os.path.join(root, path), filetype))
+        logger.info('Shard %i of %i: %i files under %s', header['shard'], header['shards'], len(work), root)
+
+        counts = dict.fromkeys(flaccurate.history.OUTCOMES, 0)
+        def outcomes():
+            for filename, filetype, digests_calculated, outcome in flaccurate.scheduler.run_lanes([work], self.processor.checksum_file, self.args.workers or 1, failed=self.processor.checksum_failed):
+                logger.info('%s: %s', filetype, filename)
+                path, digests_record = expected[filename]
+                if( outcome is None ):
+                    outcome = self.processor.verify(filename, filetype, digests_calculated, digests_record)
+                elif( outcome == flaccurate.history.ERROR ):
+                    outcome = self.processor.check_undecoded(filename, filetype, digests_record)
+                counts[outcome] += 1
+                yield {'path': path, 'filetype': filetype, 'outcome': flaccurate.history.OUTCOMES[outcome],
+                    'digests': digests_calculated, 'cost': self.processor.measured.pop(os.path.abspath(filename), None)}
+
+        flaccurate.shard.write_lines(results, {
+            'export': header['export'],
+            'shard': header['shard'],
+            'shards': header['shards'],
+            'host': socket.gethostname(),
+            'started': int(time.time()),
+        }, outcomes())
+
+        logger.info('Shard %i of %i complete: %s - results written to %s', header['shard'], header['shards'],
+            ' '.join('%s: %i' % (flaccurate.history.OUTCOMES[outcome], count) for outcome, count in counts.items()), results)
+
+    def _within_budget(self, planned, time_budget):
+        # Hand out work only while it is expected to finish inside the budget -
+        # a file too long for the time left is passed over for shorter ones
+        started = time.monotonic()
+        deferred = []
+        for estimate, filename, filetype in planned:
+            if(time_budget is not None and time.monotonic() - started + estimate > time_budget):
+                deferred.append(estimate)
+                continue
+            yield filename, filetype
+
+        if(deferred):
+            logger.warning('Time budget of %gs: %i files (estimated %s) left for a later run', time_budget, len(deferred), _duration(sum(deferred)))
+
+    def process_sample(self, size, time_budget=None):
+        started = time.monotonic()
+        # Records under --input - in the root holding it, as the rules are
+        files = []
+        for root, directory, basename, filetype in self.db._iterate_files(self.args.input):
+            if(not self.rules.pruned(os.path.join(directory, basename))):
+                files.append((os.path.join(root, directory, basename), filetype))
+        if(not files):
+            logger.info('No database records under %s - nothing to sample', self.args.input)
+            return
+
+        strata = flaccurate.sampling.stratify(files, self._stratum)
+        sample = flaccurate.sampling.draw(strata, size)
+        logger.info('Sampling %i of %i files across %i strata', len(sample), len(files), len(strata))
+
+        checked = failed = 0
+        suspect = set()
+        for filename, filetype in sample:
+            if(time_budget is not None and time.monotonic() - started > time_budget):
+                logger.warning('Time budget of %gs spent - stopping after %i of %i sampled files', time_budget, checked, len(sample))
+                break
+            logger.info('%s: %s', filetype, filename)
+            outcome = self.processor.process_file(filename, filetype)
+            self.processor.record_outcome(filename, outcome)
+            checked += 1
+            if(outcome != flaccurate.history.VERIFIED):
+                failed += 1
+                suspect.add(os.path.dirname(filename))
+
+        low, high = flaccurate.sampling.wilson_interval(failed, checked)
+        logger.info('Sample: %i of %i files checked, %i bad - estimated corruption rate %.2f%% (95%% confidence: %.2f%% - %.2f%%, up to %i files)',
+            checked, len(files), failed, 100.0 * failed / checked if checked else 0, 100.0 * low, 100.0 * high, round(high * len(files)))
+
+        # Escalate - a bad file rarely comes alone, verify everything alongside it
+        sampled = {filename for filename, filetype in sample[:checked]}
+        for directory in sorted(suspect):
+            logger.warning('Bad file found in %s - verifying the whole directory', directory)
+            for filename, filetype in files:
+                if(os.path.dirname(filename) == directory and filename not in sampled):
+                    logger.info('%s: %s', filetype, filename)
+                    self.processor.record_outcome(filename, self.processor.process_file(filename, filetype))
+
+    def _stratum(self, file):
+        filename, filetype = file
+        top_level = os.path.relpath(os.path.dirname(filename), self.args.input).split(os.sep)[0]
+        hint = self.costs.get(filename)
+        if(hint is not None and hint[0] is not None):
+            size = hint[0]
+        else:
+            try:
+                size = os.stat(filename).st_size
+            except OSError:
+                size = None  # missing files get a stratum of their own
+        return top_level, filetype, flaccurate.sampling.size_class(size)
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%02d:%02d:%02d' % (hours, minutes, seconds)
@@ -0,0 +1,69 @@
+from .base import Base
+
+import time
+
+import flaccurate
+import flaccurate.history
+
+import logging
+logger = logging.getLogger(__name__)
+
+class History(Base):
+    """The history command reports on previous curate runs recorded in the database.
+
+Without --file, lists each run (most recent first) with its outcome totals:
+verified, failed, inserted, invalid and error.  --limit restricts the
+number of runs listed.
+
+With --file, reports the outcome for that file in every run it was part of,
+and when it was last verified OK.
+
+Usage:
+    flaccurate.py [--usage] [--limit N] [--file PATH] history
+
+For general help:
+    flaccurate.py --help
+"""
+    def __init__(self, args, context=None):
+        super().__init__(args, context)
+
+    def run(self):
+        self.db = self._init_database()
+
+        if(self.args.file is not None):
+            self.report_file(self.args.file)
+        else:
+            self.report_runs(self.args.limit)
+
+    def report_runs(self, limit):
+        runs = self.db._retrieve_runs(limit)
+        if(not runs):
+            logger.info('No runs recorded')
+
+        for run_id, command, started, finished, verified, failed, inserted, invalid, error in runs:
+            if(finished is None):
+                logger.info('Run %i: %s started %s - did not finish', run_id, command, _timestamp(started))
+            else:
+                logger.info('Run %i: %s started %s took %is - verified: %i failed: %i inserted: %i invalid: %i error: %i',
+                    run_id, command, _timestamp(started), finished - started, verified, failed, inserted, invalid, error)
+
+    def report_file(self, filename):
+        file_id = self.db._retrieve_file_id(filename)
+        if(file_id is None):
+            logger.info('No database record for: %s', filename)
+            return
+
+        last_verified = None
+        for run_id, started, outcome in self.db._retrieve_file_history(file_id):
+            logger.info('Run %i: %s %s', run_id, _timestamp(started), flaccurate.history.OUTCOMES[outcome])
+            if(last_verified is None and outcome == flaccurate.history.VERIFIED):
+                last_verified = (run_id, started)
+
+        if(last_verified is not None):
+            logger.info('%s: last verified OK in run %i at %s', filename, last_verified[0], _timestamp(last_verified[1]))
+        else:
+            logger.warning('%s: never verified OK', filename)
+
+
+def _timestamp(seconds):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds))
@@ -1,7 +1,7 @@
 from .base import Base
 
 import logging
-logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
 class NoOp(Base):
     """The noop command does nothing practical for a user.
@@ -22,8 +22,8 @@ For general help:
     flaccurate.py --help
 """
 
-    def __init__(self,args):
-        super().__init__(args)
+    def __init__(self, args, context=None):
+        super().__init__(args, context)
 
     def run(self):
         return None
@@ -0,0 +1,49 @@
+from .base import Base
+
+import os
+import time
+
+import flaccurate
+
+import logging
+logger = logging.getLogger(__name__)
+
+class Rejects(Base):
+    """The rejects command lists the files curate has rejected.
+
+A file is rejected when it is not a valid file of its type (partial downloads,
+misnamed files, empty files) or cannot be decoded.  curate skips a rejected
+file until its size or modification time changes.  Each is listed with the
+reason it was rejected, and whether it has changed since - in which case the
+next curate will try it again.  --limit restricts the number listed.
+
+Usage:
+    flaccurate.py [--usage] [--limit N] rejects
+
+For general help:
+    flaccurate.py --help
+"""
+    def __init__(self, args, context=None):
+        super().__init__(args, context)
+
+    def run(self):
+        self.db = self._init_database()
+
+        rejects = sorted(self.db._retrieve_rejects().items())
+        if(not rejects):
+            logger.info('No rejected files recorded')
+
+        for filename, (size, mtime_ns, reason, recorded) in rejects[:self.args.limit]:
+            logger.info('%s: %s (%i bytes, rejected %s)%s', filename, reason, size,
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(recorded)),
+                '' if _unchanged(filename, size, mtime_ns) else ' - changed since, will be retried')
+
+        logger.info('%i rejected files', len(rejects))
+
+
+def _unchanged(filename, size, mtime_ns):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return False
+    return (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns)
@@ -1,7 +1,9 @@
 from .base import Base
 
+import flaccurate.tuning
+
 import logging
-logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
 class SelfCheck(Base):
     """The selfcheck command performs some validation on the flaccurate environment then exits.
@@ -10,19 +12,37 @@ The validation consists of loading the database if it exists, or creating it if
 It then perfoms a database integrity check, and finally verifies the database checksum
 to ensure it has not changed since our last recorded change.
 
+With --calibrate it goes on to measure this host: read throughput of the
+storage under --input, flac decode and md5 throughput per core - and saves
+the worker count, read and PCM buffer sizes and read-ahead depth derived from them to
+--tuning (default: ~/.config/flaccurate/tuning.json), where curate picks them
+up (see flaccurate/tuning.py).  Calibration reads up to a few hundred MB.
+
 Usage:
     flaccurate.py [--usage] selfcheck
+    flaccurate.py [--usage] [--input PATH] [--tuning FILE] --calibrate selfcheck
 
 For general help:
     flaccurate.py --help
 """
-    def __init__(self,args):
-        super().__init__(args)
+    def __init__(self, args, context=None):
+        super().__init__(args, context)
 
     def run(self):
-        logging.info('Self check starting')
+        logger.info('Self check starting')
 
         self.db = self._init_database()
         self.plugins = self._init_plugins()
 
-        logging.info('Self check complete - exiting...')
+        if(self.args.calibrate):
+            self.calibrate()
+
+        logger.info('Self check complete - exiting...')
+
+    def calibrate(self):
+        logger.info('Calibrating%s', ' with %s' % self.args.input if self.args.input else ' - no --input, storage not measured')
+        tuning = flaccurate.tuning.calibrate(self.args.input, self.plugins)
+        filename = flaccurate.tuning.tuning_file(self.args)
+        flaccurate.tuning.save(filename, tuning)
+        logger.info('Recommended: %i workers, %i KB read buffer, read-ahead of %i buffers, %i KB PCM buffer - saved to %s',
+            tuning['workers'], tuning['read_buffer'], tuning['read_ahead'], tuning['pcm_buffer'], filename)
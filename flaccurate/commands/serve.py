@@ -0,0 +1,117 @@
+from .base import Base
+
+import os
+import contextlib
+import socketserver
+
+import flaccurate
+import flaccurate.history
+import flaccurate.library
+import flaccurate.service
+
+import logging
+logger = logging.getLogger(__name__)
+
+class Serve(Base):
+    """The serve command keeps flaccurate loaded, answering requests over a local socket.
+
+The database is opened and validated, and the plugins loaded, once - every
+request after that is served straight away.  Requests are read from a Unix
+domain socket (--socket, by default the database filename with .sock
+appended), and are batches of files or directories to verify, or to curate
+(verify, and record files not in the database yet).  Results are streamed
+back as each file completes, the files being processed by --workers threads
+(default: one per CPU).  Each request is recorded as a run in the history.
+
+While a service is running, the curate command hands its work to it rather
+than loading the database itself - unless given options a request cannot
+carry (digests, schedule, rules, I/O settings and the like, see:
+flaccurate/service.py), requests being processed with the service's own.  The protocol is described in
+flaccurate/service.py.
+
+Requests are served one at a time, in the order they arrive.
+
+Usage:
+    flaccurate.py [--usage] [--socket PATH] [--workers N] serve
+
+For general help:
+    flaccurate.py --help
+"""
+    def __init__(self, args, context=None):
+        super().__init__(args, context)
+
+    def run(self):
+        # All processing is the library's - only the source of the work differs
+        self.library = flaccurate.library.Library(args=self.args, context=self.context)
+        self.workers = self.args.workers or os.cpu_count() or 1
+
+        path = flaccurate.service.socket_path(self.args)
+        if(flaccurate.service.connect(path) is not None):
+            raise flaccurate.Usage('A flaccurate service is already running: %s' % path)
+        if(os.path.exists(path)):
+            os.unlink(path)  # left behind by a service that did not shut down cleanly
+
+        server = socketserver.UnixStreamServer(path, _Handler)
+        server.service = self
+        self.stopping = False
+        try:
+            os.chmod(path, 0o600)
+            logger.info('Serving on %s with %i workers', path, self.workers)
+            while(not self.stopping):
+                server.handle_request()
+        except KeyboardInterrupt:
+            logger.info('Interrupted')
+        finally:
+            server.server_close()
+            os.unlink(path)
+            logger.info('Service stopped')
+
+    def handle(self, message, stream):
+        action = message.get('action')
+        logger.debug('Serve.handle( %s )', message)
+
+        if(action in ('curate', 'verify')):
+            self.process(action, message.get('paths') or [], stream)
+        elif(action == 'status'):
+            flaccurate.service.send(stream, dict(self.settings(),
+                done=True,
+                plugins=list(self.library.plugins.supported_filetypes()),
+            ))
+        elif(action == 'shutdown'):
+            logger.info('Shutdown requested')
+            self.stopping = True
+            flaccurate.service.send(stream, {'done': True})
+        else:
+            flaccurate.service.send(stream, {'done': True, 'error': 'Unknown action: %s' % action})
+
+    def process(self, action, paths, stream):
+        logger.info('Request to %s %s', action, ', '.join(paths))
+        # Closed straight away when the client goes - stopping the workers with it
+        with contextlib.closing(self.library.verify(paths, record=(action == 'curate'), workers=self.workers, command='serve ' + action)) as results:
+            for result in results:
+                flaccurate.service.send(stream, {'filename': result.filename, 'filetype': result.filetype, 'outcome': result.outcome})
+
+        counts = {flaccurate.history.OUTCOMES[outcome]: count for outcome, count in self.library.run.counts.items() if count}
+        logger.info('Request complete: %s', counts)
+        flaccurate.service.send(stream, {'done': True, 'counts': counts, 'settings': self.settings()})
+
+    def settings(self):
+        # What every request is processed with - reported back to the client
+        return {
+            'database': self.library.database.db_file,
+            'digests': self.library.digests,
+            'verify_digest': self.library.verify_digest,
+            'workers': self.workers,
+        }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # A client going away mid request costs it the results, nothing more
+        try:
+            for message in flaccurate.service.receive(self.rfile):
+                self.server.service.handle(message, self.wfile)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            logger.warning('Client disconnected: %s', e)
+        except ValueError as e:
+            flaccurate.service.send(self.wfile, {'done': True, 'error': 'Invalid request: %s' % e})
@@ -0,0 +1,183 @@
+from .base import Base
+
+import os
+import glob
+import time
+import uuid
+
+import flaccurate
+import flaccurate.history
+import flaccurate.shard
+
+import logging
+logger = logging.getLogger(__name__)
+
+class Shard(Base):
+    """The shard command splits verification of the library across hosts, and merges the results.
+
+--shard-action export splits the database records under --input into
+--shards work manifests, written to --shard-dir.  --shard-by chooses how:
+    path      - contiguous runs of paths, equal numbers of files
+    directory - whole directories, balanced by number of files
+    bytes     - individual files, balanced by size (the default)
+
+Each manifest is verified on any host with access to a copy of the library:
+    flaccurate.py [--input PATH] --manifest FILE curate
+which needs no database (see the curate command), and writes a results file
+alongside the manifest.
+
+--shard-action merge folds every results file found in --shard-dir back
+into the database, recorded as one run in the history.  Results which
+conflict are reported and left out:
+    - the database record has changed since the manifest was exported
+    - the file is no longer in the database
+    - two results files disagree about the same file
+Merged results files are renamed with .merged appended.
+
+Usage:
+    flaccurate.py [--usage] --input PATH [--shards N] [--shard-by path|directory|bytes]
+                  [--shard-dir DIR] --shard-action export shard
+    flaccurate.py [--usage] [--shard-dir DIR] --shard-action merge shard
+
+For general help:
+    flaccurate.py --help
+"""
+    def __init__(self, args, context=None):
+        super().__init__(args, context)
+
+    def run(self):
+        self.shard_dir = self.args.shard_dir or os.curdir
+
+        if(self.args.shard_action == 'export'):
+            self.export()
+        elif(self.args.shard_action == 'merge'):
+            self.merge()
+        else:
+            raise flaccurate.Usage('No --shard-action specified - nothing TODO - exiting...')
+
+    def export(self):
+        if(self.args.input is None):
+            raise flaccurate.Usage('No input specified - nothing TODO - exiting...')
+        shards = self.args.shards or 2
+        by = self.args.shard_by or 'bytes'
+
+        self.db = self._init_database()
+        root = os.path.abspath(self.args.input)
+        if(self.db._scope(root)[0] is None):
+            raise flaccurate.Usage('%s is not within a library root in %s' % (root, self.db.db_file))
+
+        # Sizes from the cost hints, only asking the filesystem about files without one
+        costs = self.db._retrieve_costs(root)
+        def size(path):
+            filename = os.path.join(root, path)
+            hint = costs.get(filename)
+            if(hint is not None and hint[0] is not None):
+                return hint[0]
+            try:
+                return os.stat(filename).st_size
+            except OSError:
+                return None
+
+        entries = list(self.db._iterate_digests(root))
+        export = uuid.uuid4().hex[:12]
+        os.makedirs(self.shard_dir, exist_ok=True)
+
+        for shard, shard_entries in enumerate(flaccurate.shard.split(entries, shards, by, size), 1):
+            manifest = flaccurate.shard.manifest_filename(self.shard_dir, export, shard, shards)
+            flaccurate.shard.write_lines(manifest, {
+                'export': export,
+                'shard': shard,
+                'shards': shards,
+                'by': by,
+                'root': root,
+                'database': os.path.abspath(self.db.db_file),
+                'exported': int(time.time()),
+            }, shard_entries)
+            logger.info('Shard %i of %i: %i files, %i MB - %s', shard, shards, len(shard_entries),
+                sum(size(path) or 0 for path, filetype, digests in shard_entries) // (1024 * 1024), manifest)
+
+        logger.info('Exported %i files in %i shards (by %s)', len(entries), shards, by)
+
+    def merge(self):
+        self.db = self._init_database()
+
+        # Gather every result first - a file verified by two workers can only be
+        # judged once both are seen
+        results = {}
+        conflicts = set()
+        merged = []
+        manifests = {}
+        for results_file in sorted(glob.glob(os.path.join(self.shard_dir, '*.results'))):
+            try:
+                header, lines = flaccurate.shard.read_lines(results_file)
+                manifest = flaccurate.shard.manifest_filename(self.shard_dir, header['export'], header['shard'], header['shards'])
+                manifest_header, entries = flaccurate.shard.read_lines(manifest)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error('Skipping %s: %s', results_file, e)
+                continue
+
+            root = manifest_header['root']
+            expected = {path: digests for path, filetype, digests in entries}
+            manifests[manifest] = (root, expected)
+            logger.info('Reading %s (shard %i of %i, verified on %s)', results_file, header['shard'], header['shards'], header.get('host'))
+
+            for result in lines:
+                filename = os.path.join(root, result['path'])
+                if(result['path'] not in expected):
+                    logger.warning('%s: not in manifest %s - conflict', filename, manifest)
+                    conflicts.add(filename)
+                    continue
+                previous = results.get(filename)
+                if(previous is not None and (previous[0]['outcome'], previous[0]['digests']) != (result['outcome'], result['digests'])):
+                    logger.warning('%s: results disagree (%s, %s) - conflict', filename, previous[0]['outcome'], result['outcome'])
+                    conflicts.add(filename)
+                results[filename] = (result, expected[result['path']])
+            merged.append(results_file)
+
+        if(not merged):
+            logger.info('No results to merge in %s', self.shard_dir)
+            return
+
+        self.history = self.db._begin_run('shard merge')
+        outcomes = {name: outcome for outcome, name in flaccurate.history.OUTCOMES.items()}
+        costs = {}
+        for filename, (result, digests_exported) in sorted(results.items()):
+            if(filename in conflicts):
+                continue
+
+            digests_record = self.db._retrieve_digests(filename)
+            if(digests_record is None):
+                logger.warning('%s: no longer in the database - conflict', filename)
+                conflicts.add(filename)
+                continue
+            if(any(digests_record.get(name) != value for name, value in digests_exported.items())):
+                logger.warning('%s: database record changed since export - conflict', filename)
+                conflicts.add(filename)
+                continue
+
+            outcome = outcomes[result['outcome']]
+            if(outcome == flaccurate.history.VERIFIED):
+                missing = {name: value for name, value in (result['digests'] or {}).items() if name not in digests_record}
+                if(missing):
+                    self.db._update_digests(filename, missing)
+            elif(outcome == flaccurate.history.FAILED):
+                logger.warning('%s: %s - Failed checksum', result['filetype'], filename)
+            else:
+                logger.error('%s: %s - %s', result['filetype'], filename, result['outcome'])
+            self.history.record(outcome, self.db._retrieve_file_id(filename))
+            if(result.get('cost') is not None):
+                costs[filename] = result['cost']
+
+        if(costs):
+            self.db._update_costs(costs)
+        self.db._finish_run(self.history)
+
+        unverified = sum(1 for root, expected in manifests.values() for path in expected if os.path.join(root, path) not in results)
+        if(unverified):
+            logger.warning('%i files in the merged manifests have no result yet', unverified)
+        for results_file in merged:
+            os.replace(results_file, results_file + '.merged')
+
+        counts = self.history.counts
+        logger.info('Merge complete: %s conflicts: %i',
+            ' '.join('%s: %i' % (flaccurate.history.OUTCOMES[outcome], count) for outcome, count in counts.items()), len(conflicts))
@@ -0,0 +1,202 @@
+from .base import Base
+
+import os
+
+import flaccurate
+import flaccurate.history
+import flaccurate.rules
+import flaccurate.sidecar
+
+import logging
+logger = logging.getLogger(__name__)
+
+class Sidecar(Base):
+    """The sidecar command writes .ffp sidecar files from the database, and seeds the database from .ffp / .md5 sidecar files.
+
+--sidecar-action export writes one sidecar per recorded directory under
+--input, named after the directory, in each --sidecar-format given
+(comma separated):
+    ffp - flac files only, "<filename>:<md5>" - the STREAMINFO signature,
+          as metaflac --show-md5sum prints it
+Checksums come straight from the database - nothing is decoded.  flac files
+in a recorded directory without a record of their own are written with the
+signature read from their STREAMINFO block.  Sidecars already holding the
+same entries are left untouched; one holding anything else is only replaced
+with --force.  No .md5 is written: md5sum -c checks an md5 of the whole file,
+which the database does not record - only the audio md5.
+
+--sidecar-action import reads every .ffp / .md5 sidecar under --input and
+records the files which exist, are of a supported filetype and are not yet
+in the database - in batches of IMPORT_BATCH, one transaction each, recorded
+as one run in the history.  Only entries which can be checked are recorded:
+one matching a flac file's STREAMINFO signature as it is, one matching the
+md5 of the whole file (as md5sum writes them) with the audio md5 then
+calculated from the file it vouches for.  Any other entry is left out.
+
+Usage:
+    flaccurate.py [--usage] --input PATH [--sidecar-format ffp] [--force]
+                  --sidecar-action export sidecar
+    flaccurate.py [--usage] --input PATH [--exclude PATTERN] [--include PATTERN]
+                  --sidecar-action import sidecar
+
+For general help:
+    flaccurate.py --help
+"""
+    IMPORT_BATCH = 1000
+
+    # STREAMINFO signature of an encoder which did not calculate one
+    UNSET_SIGNATURE = '0' * 32
+
+    def __init__(self, args, context=None):
+        super().__init__(args, context)
+
+    def run(self):
+        if(self.args.input is None):
+            raise flaccurate.Usage('No input specified - nothing TODO - exiting...')
+        self.root = os.path.abspath(self.args.input)
+
+        self.db = self._init_database()
+        self.plugins = self._init_plugins()
+        flac = self.plugins.plugin('flac')
+        self.streaminfo_md5 = getattr(flac.module, 'streaminfo_md5', None) if flac is not None else None
+
+        if(self.args.sidecar_action == 'export'):
+            self.export()
+        elif(self.args.sidecar_action == 'import'):
+            self.import_sidecars()
+        else:
+            raise flaccurate.Usage('No --sidecar-action specified - nothing TODO - exiting...')
+
+    def _streaminfo(self, filename):
+        # None when there is no signature to be had
+        if(self.streaminfo_md5 is None):
+            return None
+        md5 = self.streaminfo_md5(filename)
+        return md5 if md5 != self.UNSET_SIGNATURE else None
+
+    def export(self):
+        if(self.db._scope(self.root)[0] is None):
+            raise flaccurate.Usage('%s is not within a library root in %s' % (self.root, self.db.db_file))
+
+        extensions = []
+        for sidecar_format in (self.args.sidecar_format or 'ffp').split(','):
+            extension = '.' + sidecar_format.strip().lower()
+            if(extension not in flaccurate.sidecar.FORMATTERS):
+                raise flaccurate.Usage('Unsupported sidecar format: %s - choose from: %s' % (sidecar_format, ', '.join(extension[1:] for extension in flaccurate.sidecar.FORMATTERS)))
+            extensions.append(extension)
+
+        counts = dict.fromkeys(('written', 'unchanged', 'kept', 'streaminfo'), 0)
+        for root, directory, records in self.db._iterate_directory_digests('md5'):
+            dirpath = os.path.join(root, directory) if directory else root
+            if(dirpath != self.root and not dirpath.startswith(self.root + os.sep)):
+                continue
+            if(not os.path.isdir(dirpath)):
+                logger.warning('Directory not found: %s - skipping', dirpath)
+                continue
+
+            entries = [(basename, md5) for basename, md5 in records if md5 is not None]
+            if('.ffp' in extensions):
+                recorded = {basename for basename, md5 in entries}
+                for basename in sorted(os.listdir(dirpath)):
+                    if(basename in recorded or not basename.lower().endswith('.flac')):
+                        continue
+                    md5 = self._streaminfo(os.path.join(dirpath, basename))
+                    if(md5 is not None):
+                        entries.append((basename, md5))
+                        counts['streaminfo'] += 1
+                entries.sort()
+
+            for extension in extensions:
+                sidecar_entries = entries if extension != '.ffp' else [entry for entry in entries if entry[0].lower().endswith('.flac')]
+                if(not sidecar_entries):
+                    continue
+                filename = os.path.join(dirpath, os.path.basename(dirpath) + extension)
+                written = flaccurate.sidecar.write_sidecar(filename, sidecar_entries, replace=self.args.force)
+                if(written):
+                    logger.debug('Written: %s (%i entries)', filename, len(sidecar_entries))
+                    counts['written'] += 1
+                elif(written is None):
+                    logger.warning('%s differs from the database - not replaced without --force', filename)
+                    counts['kept'] += 1
+                else:
+                    counts['unchanged'] += 1
+
+        logger.info('Export complete: %i written, %i unchanged, %i kept, %i checksums from STREAMINFO',
+            counts['written'], counts['unchanged'], counts['kept'], counts['streaminfo'])
+
+    def import_sidecars(self):
+        self.db._register_root(self.root)
+        # The library root's rules, matched relative to it
+        root, root_id, prefix = self.db._scope(self.root)
+        rules = flaccurate.rules.load(root, self.args.exclude, self.args.include)
+        filetypes = set(self.plugins.supported_filetypes())
+
+        self.history = self.db._begin_run('sidecar import')
+        counts = dict.fromkeys(('recorded', 'calculated', 'matched', 'conflicts', 'missing', 'unsupported'), 0)
+        batch = []
+        for directory, basename, md5, extension in flaccurate.sidecar.walk(self.root):
+            relative = os.path.join(directory, basename)
+            filename = os.path.join(self.root, relative)
+            filetype = os.path.splitext(basename)[1][1:].lower()
+            if(filetype not in filetypes or (rules and rules.pruned(os.path.join(prefix, relative)))):
+                counts['unsupported'] += 1
+                continue
+            if(not os.path.isfile(filename)):
+                logger.debug('Not found: %s - skipping', filename)
+                counts['missing'] += 1
+                continue
+
+            digests_record = self.db._retrieve_digests(filename)
+            if(digests_record is not None):
+                if(digests_record.get('md5') == md5):
+                    counts['matched'] += 1
+                else:
+                    logger.warning('%s: sidecar %s differs from the database %s - skipping', filename, md5, digests_record.get('md5'))
+                    counts['conflicts'] += 1
+                continue
+
+            audio_md5 = self._audio_md5(filename, filetype, md5)
+            if(audio_md5 is None):
+                counts['conflicts'] += 1
+                continue
+            if(audio_md5 != md5):
+                counts['calculated'] += 1
+
+            batch.append({'filename': filename, 'filetype': filetype, 'md5': audio_md5})
+            if(len(batch) >= self.IMPORT_BATCH):
+                counts['recorded'] += self._record_batch(batch)
+                batch = []
+        if(batch):
+            counts['recorded'] += self._record_batch(batch)
+
+        self.db._finish_run(self.history)
+        logger.info('Import complete: %i recorded (%i from whole file md5s), %i already matching, %i conflicts, %i missing files, %i unsupported or excluded',
+            counts['recorded'], counts['calculated'], counts['matched'], counts['conflicts'], counts['missing'], counts['unsupported'])
+
+    def _audio_md5(self, filename, filetype, md5):
+        # The audio md5 to record for a sidecar entry - None when the entry
+        # cannot be checked against the file
+        if(filetype == 'flac' and self._streaminfo(filename) == md5):
+            return md5
+
+        try:
+            whole_md5 = flaccurate.sidecar.file_md5(filename)
+        except OSError as e:
+            logger.error('%s: Failed to read: %s - skipping', filename, e)
+            return None
+        if(whole_md5 != md5):
+            logger.warning('%s: sidecar %s matches neither the audio nor the whole file (%s) - skipping', filename, md5, whole_md5)
+            return None
+
+        digests = self.plugins.plugin(filetype).digests(filename, ('md5',))
+        if(digests is None):
+            logger.error('%s: Failed to calculate checksum - skipping', filename)
+            return None
+        return digests['md5']
+
+    def _record_batch(self, batch):
+        inserted = self.db._insert_checksums(batch)
+        for filename, file_id in inserted.items():
+            logger.debug('Recorded: %s', filename)
+            self.history.record(flaccurate.history.INSERTED, file_id)
+        return len(inserted)
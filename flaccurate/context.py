@@ -0,0 +1,41 @@
+import flaccurate.database
+import flaccurate.dynloader
+
+import logging
+logger = logging.getLogger(__name__)
+
+class Context():
+    """What every command of one invocation shares - created on first use.
+
+Opening the database validates it (integrity check and whole file checksum)
+and loading the plugins discovers them - so when several commands are given
+on one command line (flaccurate.py selfcheck curate), only the first to ask
+pays for either.  Owned by the entry point and handed to each command.
+
+Raises RuntimeError, as Database and Plugins do, when either cannot be created.
+close() when every command is done - a staged database is persisted then.
+"""
+    def __init__(self, args):
+        self.args = args
+        self._database = None
+        self._plugins = None
+
+    @property
+    def database(self):
+        if(self._database is None):
+            self._database = flaccurate.database.Database(self.args)
+        else:
+            logger.debug('Context: Reusing database %s', self._database.db_file)
+        return self._database
+
+    @property
+    def plugins(self):
+        if(self._plugins is None):
+            self._plugins = flaccurate.dynloader.Plugins(self.args)
+        else:
+            logger.debug('Context: Reusing plugins')
+        return self._plugins
+
+    def close(self):
+        if(self._database is not None):
+            self._database._close()
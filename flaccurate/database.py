@@ -1,61 +1,96 @@
+import os
+import time
 import sqlite3
 import json
+import zlib
 import hashlib
+import contextlib
 from pathlib import Path
 
+import flaccurate.sidecar
+import flaccurate.history
+
 import logging
-logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
 class Database:
     DEFAULT_DB_FILE = 'flaccurate.db'
 
+    # Staging (--staging): the database is copied into memory and every write
+    # goes there, with neither the file nor its checksum touched.  Persisted
+    # with the backup API to a temporary file renamed over the database - so
+    # it is never left half written - every STAGING_CHECKPOINT seconds, and
+    # when closed (see: _close()).
+    STAGING_CHECKPOINT = 300
+
+    # Stored in PRAGMA user_version - databases created before versioning
+    # was introduced report 0 and are brought up to date by _migrate_db()
+    SCHEMA_VERSION = 10
+
+    # One BLOB column per supported digest algorithm
+    # (see: flaccurate.dynloader.DIGESTS and flaccurate.dynloader.PCM_DIGESTS)
+    DIGEST_COLUMNS = ('md5', 'sha256', 'blake2b', 'accuraterip', 'frames', 'segments')
+
     def __init__(self, args):
         self.debug = args.debug
         self.silent = args.silent
         self.force = args.force
         self.args = args
-        logging.debug('Database __init__ args: %s', vars(self.args))
+        logger.debug('Database __init__ args: %s', vars(self.args))
 
         if(args.database is not None):
-            logging.info('Database specified: %s', args.database)
+            logger.info('Database specified: %s', args.database)
             self.db_file = args.database
         else:
-            logging.info('Database not specified - defaulting to: %s', self.DEFAULT_DB_FILE)
+            logger.info('Database not specified - defaulting to: %s', self.DEFAULT_DB_FILE)
             self.db_file = self.DEFAULT_DB_FILE
 
         if(Path(self.db_file).is_file()):
-            logging.info('Database found: %s', self.db_file)
+            logger.info('Database found: %s', self.db_file)
         elif(self.force):
-            logging.info('Database not found - forcing creation: %s', self.db_file)
+            logger.info('Database not found - forcing creation: %s', self.db_file)
         elif(self.db_file == self.DEFAULT_DB_FILE):
             # This is here for convenience of first time users omitting options.
             # At least do something on the initial invokation instead of complain
             # about database filenames not existing.
-            logging.info('Database not found - inaugural launch, creating: %s', self.db_file)
+            logger.info('Database not found - inaugural launch, creating: %s', self.db_file)
         else:
             # Specified database not found do nothing - don't try and guess what
             # is intended. If user wants to continue wuth a custom db name there is a
             # --force flag
-            logging.info('Database not found: %s - use --force to create it', self.db_file)
+            logger.info('Database not found: %s - use --force to create it', self.db_file)
             raise RuntimeError('Database not found')
 
         self.db_md5_file = self.db_file + '.md5'
+        self.staging = getattr(args, 'staging', False)
+        self.staged = False
+
+        # Checksum updates deferred by _batch()
+        self.batching = 0
+        self.batched = False
+
+        # Lookup caches for the normalised schema, saves a SELECT for every
+        # file processed in the same directory / of the same filetype
+        self.roots = {}
+        self.directories = {}
+        self.plugin_ids = {}
+
         self.dbh = self._init_db()
 
     def _init_db(self):
-        logging.debug('_init_db( %s )', self.db_file)
+        logger.debug('_init_db( %s )', self.db_file)
 
         # Only try to validate existing database
         db_exists = Path(self.db_file).is_file()
         if(db_exists):
-            logging.debug('_init_db( %s ): Database file found', self.db_file)
-            logging.info('Validating %s', self.db_file)
+            logger.debug('_init_db( %s ): Database file found', self.db_file)
+            logger.info('Validating %s', self.db_file)
             if(self._valid_db()):
-                logging.info('Database is valid')
+                logger.info('Database is valid')
             else:
                 raise RuntimeError('Database is not valid')
         else:
-            logging.debug('_init_db( %s ): Database file not found, initialising', self.db_file)
+            logger.debug('_init_db( %s ): Database file not found, initialising', self.db_file)
             self.checksum = None
 
         # Always perform table creation and checksum update -
@@ -65,18 +100,145 @@ class Database:
         # 1. Want to return the db handle to constructor, not garbage collect it -
         #    so it is preserved as object attribute in self, for future use
         # 2. No transaction commit or rollback required on the initial creation of the table
-        dbh = self._connect_db()
-        dbh.execute("CREATE TABLE IF NOT EXISTS checksums(filename text PRIMARY KEY, md5 text NOT NULL, filetype text NOT NULL)")
-        self._update_db_checksum()
+        dbh = self._stage_db(db_exists) if self.staging else self._connect_db()
+        self._migrate_db(dbh)
+        self.roots = dict(dbh.execute('SELECT path, id FROM roots').fetchall())
+        if(not self.staging):
+            # A staged database only reaches the disk when persisted
+            self._update_db_checksum()
 
         return dbh
 
+    def _stage_db(self, db_exists):
+        logger.info('Staging %s in memory', self.db_file)
+        dbh = sqlite3.connect(':memory:')
+        if(db_exists):
+            disk_dbh = self._connect_db()
+            try:
+                disk_dbh.backup(dbh)
+            finally:
+                disk_dbh.close()
+        self.persisted = time.monotonic()
+        # Persisted at least once, so a new database or migration reaches the disk
+        self.staged = True
+        return dbh
+
+    def _persist_db(self):
+        logger.info('Persisting staged database to %s', self.db_file)
+        staging_file = self.db_file + '.staging'
+        if(os.path.exists(staging_file)):
+            os.unlink(staging_file)  # left behind by an interrupted persist
+        target = sqlite3.connect(staging_file)
+        try:
+            with target:
+                self.dbh.backup(target)
+        finally:
+            target.close()
+        with open(staging_file, 'rb') as fileh:
+            os.fsync(fileh.fileno())
+
+        # The checksum is of the file about to be renamed into place - the
+        # window where the two disagree is only that of the rename
+        checksum = self._calculate_db_checksum(staging_file)
+        os.replace(staging_file, self.db_file)
+        self.checksum = checksum
+        self._insert_db_checksum({
+            self.db_file : {
+                'md5' : checksum
+            }
+        })
+        self.staged = False
+        self.persisted = time.monotonic()
+
+    def _close(self):
+        # Only staging has anything left to do
+        if(self.staging and self.staged):
+            self._persist_db()
+
+    def _migrate_db(self, dbh):
+        schema_version = dbh.execute('PRAGMA user_version').fetchone()[0]
+        logger.debug('_migrate_db( %s ): Schema version %i', self.db_file, schema_version)
+
+        migrations = {
+            0: self._schema_v1,
+            1: self._schema_v2,
+            2: self._schema_v3,
+            3: self._schema_v4,
+            4: self._schema_v5,
+            5: self._schema_v6,
+            6: self._schema_v7,
+            7: self._schema_v8,
+            8: self._schema_v9,
+            9: self._schema_v10,
+        }
+
+        migrated = schema_version < self.SCHEMA_VERSION
+        while schema_version < self.SCHEMA_VERSION:
+            logger.info('Migrating database schema from version %i to %i', schema_version, schema_version + 1)
+            # Each step runs in its own transaction so an interrupted migration
+            # leaves the database at the last completed schema version.
+            # PRAGMA user_version cannot take a bound parameter.
+            with dbh:
+                dbh.execute('BEGIN')
+                migrations[schema_version](dbh)
+                schema_version += 1
+                dbh.execute('PRAGMA user_version = %i' % schema_version)
+
+        # Hand the space freed by the old layout back to the filesystem -
+        # the file size is what the whole file checksum pays for
+        if(migrated):
+            dbh.execute('VACUUM')
+
+    def _schema_v1(self, dbh):
+        # The original layout - also matches databases created before
+        # schema versioning existed, hence IF NOT EXISTS
+        dbh.execute("CREATE TABLE IF NOT EXISTS checksums(filename text PRIMARY KEY, md5 text NOT NULL, filetype text NOT NULL)")
+
+    def _schema_v2(self, dbh):
+        # Normalised layout:
+        # 1. Paths are split into a directory (relative to a registered library root) and a basename
+        # 2. md5 stored as a 16 byte BLOB instead of 32 hex characters
+        # 3. filetype stored as an integer plugin id
+        # 4. checksums is clustered on its primary key (WITHOUT ROWID) - no separate rowid b-tree
+        dbh.execute('ALTER TABLE checksums RENAME TO checksums_v1')
+        dbh.execute('CREATE TABLE roots(id INTEGER PRIMARY KEY, path text NOT NULL UNIQUE)')
+        dbh.execute('CREATE TABLE plugins(id INTEGER PRIMARY KEY, name text NOT NULL UNIQUE)')
+        dbh.execute('CREATE TABLE directories(id INTEGER PRIMARY KEY, root_id integer NOT NULL REFERENCES roots(id), path text NOT NULL, UNIQUE(root_id, path))')
+        dbh.execute('CREATE TABLE checksums(directory_id integer NOT NULL REFERENCES directories(id), basename text NOT NULL, md5 blob NOT NULL, plugin_id integer NOT NULL REFERENCES plugins(id), PRIMARY KEY(directory_id, basename)) WITHOUT ROWID')
+
+        # Version 1 stored whatever path the glob produced.  Relative paths are
+        # resolved against the current working directory - the best guess
+        # available - and the common ancestor of everything becomes the root.
+        rows = dbh.execute('SELECT filename, md5, filetype FROM checksums_v1').fetchall()
+        if(rows):
+            root = os.path.commonpath([os.path.dirname(os.path.abspath(row[0])) for row in rows])
+            self._register_root(root, dbh)
+            for filename, md5, filetype in rows:
+                directory_id, basename = self._locate(filename, dbh)
+                dbh.execute('INSERT OR IGNORE INTO checksums(directory_id, basename, md5, plugin_id) values (?, ?, ?, ?)',
+                    (directory_id, basename, self._digest_blob(md5), self._plugin_id(filetype, dbh)))
+            logger.info('Migrated %i checksums relative to root: %s', len(rows), root)
+
+        dbh.execute('DROP TABLE checksums_v1')
+
+    def _schema_v3(self, dbh):
+        # Run history:
+        # 1. Every file gets a small, stable integer id - its bit position in the outcome bitmaps
+        # 2. runs holds one row per run with the outcome totals
+        # 3. run_outcomes holds one compressed bitmap per run and outcome (see: flaccurate.history)
+        dbh.execute('ALTER TABLE checksums ADD COLUMN id integer')
+        dbh.executemany('UPDATE checksums SET id=? WHERE directory_id=? AND basename=?',
+            ((file_id,) + key for file_id, key in enumerate(dbh.execute('SELECT directory_id, basename FROM checksums').fetchall(), 1)))
+        dbh.execute('CREATE UNIQUE INDEX checksums_id ON checksums(id)')
+        dbh.execute('CREATE TABLE runs(id INTEGER PRIMARY KEY, command text NOT NULL, started integer NOT NULL, finished integer, verified integer, failed integer, inserted integer, invalid integer, error integer)')
+        dbh.execute('CREATE TABLE run_outcomes(run_id integer NOT NULL REFERENCES runs(id), outcome integer NOT NULL, bitmap blob NOT NULL, PRIMARY KEY(run_id, outcome)) WITHOUT ROWID')
+
     def _connect_db(self):
         dbh = None
         try:
             dbh = sqlite3.connect(self.db_file)
         except sqlite3.OperationalError as e:
-            logging.debug('_connect_db(): Failed to connect to %s: %s', self.db_file, e.args[0])
+            logger.debug('_connect_db(): Failed to connect to %s: %s', self.db_file, e.args[0])
             raise RuntimeError('Failed to connect to database')
 
         return dbh
@@ -86,7 +248,7 @@ class Database:
     # 1. Internal sqlite integrity_check
     # 2. Standalone checksum of the entire db_file
     def _valid_db(self):
-        logging.debug('_valid_db( %s )', self.db_file)
+        logger.debug('_valid_db( %s )', self.db_file)
 
         if(self._db_integrity_verified() and
             self._db_checksum_verified()):
@@ -99,16 +261,16 @@ class Database:
             with self._connect_db() as dbh:
                 integrity_results = dbh.execute("PRAGMA integrity_check").fetchone()
         except sqlite3.OperationalError as e:
-            logging.critical('_valid_db( %s ): Failed to perform database integrity check', self.db_file)
+            logger.critical('_valid_db( %s ): Failed to perform database integrity check', self.db_file)
         else:
             if(integrity_results is not None):
                 if(integrity_results[0] == 'ok'):
-                    logging.info('Database integrity verified')
+                    logger.info('Database integrity verified')
                     return True
                 else:
-                    logging.critical('_valid_db( %s ): Database integrity failure', self.db_file)
+                    logger.critical('_valid_db( %s ): Database integrity failure', self.db_file)
             else:
-                logging.critical('_valid_db( %s ): Failed to obtain database integrity results', self.db_file)
+                logger.critical('_valid_db( %s ): Failed to obtain database integrity results', self.db_file)
 
         return False
 
@@ -122,95 +284,607 @@ class Database:
                 return False
 
             if(db_checksum_calculated == db_checksum_record):
-                logging.info('Database checksum verified')
+                logger.info('Database checksum verified')
                 self.checksum = db_checksum_calculated
                 return True
             else:
-                logging.critical('_valid_db( %s ): Database checksum failure (Current: %s Previous: %s)', self.db_file, db_checksum_calculated, db_checksum_record)
+                logger.critical('_valid_db( %s ): Database checksum failure (Current: %s Previous: %s)', self.db_file, db_checksum_calculated, db_checksum_record)
         else:
-            logging.critical('_valid_db( %s ): Database checksum file not found %s', self.db_file, self.db_md5_file)
+            logger.critical('_valid_db( %s ): Database checksum file not found %s', self.db_file, self.db_md5_file)
 
         return False
     
+    def _schema_v4(self, dbh):
+        # Additional digests, calculated in the same pass as md5 when enabled.
+        # NULL until a run with that digest enabled has seen the file.
+        dbh.execute('ALTER TABLE checksums ADD COLUMN sha256 blob')
+        dbh.execute('ALTER TABLE checksums ADD COLUMN blake2b blob')
+
+    def _schema_v5(self, dbh):
+        # AccurateRip CRCs per track (see: flaccurate.accuraterip.RECORD)
+        dbh.execute('ALTER TABLE checksums ADD COLUMN accuraterip blob')
+
+    def _schema_v6(self, dbh):
+        # Negative cache - files curate rejected (invalid or undecodable) along
+        # with their stat fingerprint, skipped until the fingerprint changes
+        dbh.execute('CREATE TABLE rejects(directory_id integer NOT NULL REFERENCES directories(id), basename text NOT NULL, size integer NOT NULL, mtime_ns integer NOT NULL, reason text NOT NULL, recorded integer NOT NULL, PRIMARY KEY(directory_id, basename)) WITHOUT ROWID')
+
+    def _schema_v7(self, dbh):
+        # Directory snapshots for the walk (see: flaccurate.walker) - the
+        # listing is a zlib compressed JSON [subdirectories, files]
+        dbh.execute('CREATE TABLE listings(directory_id INTEGER PRIMARY KEY REFERENCES directories(id), mtime_ns integer NOT NULL, listing blob NOT NULL)')
+
+    def _schema_v8(self, dbh):
+        # Cost hints for scheduling (see: flaccurate.scheduler.CostModel) -
+        # size and stream format as last seen, and how long processing took
+        dbh.execute('CREATE TABLE costs(directory_id integer NOT NULL REFERENCES directories(id), basename text NOT NULL, size integer, total_samples integer, sample_rate integer, bits_per_sample integer, seconds real, PRIMARY KEY(directory_id, basename)) WITHOUT ROWID')
+
+    def _schema_v9(self, dbh):
+        # MP3 frame index - the extent of the audio frames and a digest per
+        # group of frames (see: flaccurate.plugins.mp3.FrameIndex)
+        dbh.execute('ALTER TABLE checksums ADD COLUMN frames blob')
+
+    def _schema_v10(self, dbh):
+        # Segmented digests - a hash tree over fixed size segments of the
+        # audio (see: flaccurate.merkle)
+        dbh.execute('ALTER TABLE checksums ADD COLUMN segments blob')
+
+    def _register_root(self, path, dbh=None):
+        logger.debug('_register_root( %s )', path)
+        dbh = dbh or self.dbh
+        root = os.path.abspath(path)
+
+        if(root not in self.roots):
+            # A directory inside a registered root is part of that root -
+            # registering it as well would record its files a second time
+            outer, outer_id = self._find_root(root)
+            if(outer is not None and outer != Path(outer).anchor):
+                logger.debug('_register_root( %s ): Part of library root %s', root, outer)
+                return outer_id
+
+            # Only commit when not already part of a larger transaction
+            # (migration or checksum insert) - they commit or rollback as a whole
+            in_transaction = dbh.in_transaction
+            dbh.execute('INSERT OR IGNORE INTO roots(path) values (?)', (root,))
+            self.roots[root] = dbh.execute('SELECT id FROM roots WHERE path=?', (root,)).fetchone()[0]
+            if(root != Path(root).anchor):
+                self._absorb_roots(root, dbh)
+            if(not in_transaction):
+                dbh.commit()
+            logger.info('Library root registered: %s', root)
+
+        return self.roots[root]
+
+    def _absorb_roots(self, root, dbh):
+        # Directories recorded under roots inside the new root - and under the
+        # filesystem root, for files recorded outside every root - become
+        # part of it, so their records are found relative to it from now on
+        root_id = self.roots[root]
+        anchor = Path(root).anchor
+        absorbed = False
+        for path, inner_id in list(self.roots.items()):
+            if(path != anchor and Path(root) not in Path(path).parents):
+                continue
+            for directory_id, directory in dbh.execute('SELECT id, path FROM directories WHERE root_id=?', (inner_id,)).fetchall():
+                relative = _relative(os.path.relpath(os.path.join(path, directory), root))
+                if(relative is not None):
+                    dbh.execute('UPDATE OR IGNORE directories SET root_id=?, path=? WHERE id=?', (root_id, relative, directory_id))
+                    absorbed = True
+            if(path != anchor and dbh.execute('SELECT count(*) FROM directories WHERE root_id=?', (inner_id,)).fetchone()[0] == 0):
+                dbh.execute('DELETE FROM roots WHERE id=?', (inner_id,))
+                del self.roots[path]
+                logger.info('Library root %s is now part of %s', path, root)
+        if(absorbed):
+            self.directories = {}
+
+    def _find_root(self, path, inclusive=False):
+        # Outermost registered root wins - so a root registered inside another
+        # before this rule (see: _register_root()) cannot split its records.
+        # The filesystem root, holding files recorded outside every library
+        # root, only when no other root holds the path.
+        path = Path(os.path.abspath(path))
+        found = None, None
+        for parent in ([path] if inclusive else []) + list(path.parents):
+            root_id = self.roots.get(str(parent))
+            if(root_id is not None and (found[0] is None or parent != Path(parent.anchor))):
+                found = str(parent), root_id
+        return found
+
+    def _scope(self, path):
+        """The registered root holding the directory path: (root, root_id, prefix),
+prefix being the path relative to the root - '' for the root itself.
+(None, None, None) when no root holds it."""
+        root, root_id = self._find_root(path, inclusive=True)
+        if(root is None):
+            return None, None, None
+        return root, root_id, _relative(os.path.relpath(os.path.abspath(path), root))
+
+    def _locate(self, filename, dbh=None, create=True):
+        """Map a filename onto its (directory_id, basename) key.
+
+Returns (None, basename) when the directory has never been recorded and
+create is False.  Files outside every registered root are recorded relative
+to the filesystem root they live on.
+"""
+        dbh = dbh or self.dbh
+        path = os.path.abspath(filename)
+        dirname, basename = os.path.split(path)
+
+        root, root_id = self._find_root(path)
+        if(root is None):
+            if(not create):
+                return None, basename
+            root = Path(path).anchor
+            root_id = self._register_root(root, dbh)
+
+        relative = os.path.relpath(dirname, root)
+        if(relative == os.curdir):
+            relative = ''
+
+        key = (root_id, relative)
+        directory_id = self.directories.get(key)
+        if(directory_id is None):
+            if(create):
+                dbh.execute('INSERT OR IGNORE INTO directories(root_id, path) values (?, ?)', key)
+            results = dbh.execute('SELECT id FROM directories WHERE root_id=? AND path=?', key).fetchone()
+            if(results is not None):
+                directory_id = self.directories[key] = results[0]
+
+        return directory_id, basename
+
+    def _plugin_id(self, filetype, dbh=None):
+        dbh = dbh or self.dbh
+        plugin_id = self.plugin_ids.get(filetype)
+        if(plugin_id is None):
+            dbh.execute('INSERT OR IGNORE INTO plugins(name) values (?)', (filetype,))
+            plugin_id = self.plugin_ids[filetype] = dbh.execute('SELECT id FROM plugins WHERE name=?', (filetype,)).fetchone()[0]
+        return plugin_id
+
+    @staticmethod
+    def _digest_blob(hexdigest):
+        # None is passed through so the NOT NULL constraint reports it
+        if(hexdigest is None):
+            return None
+        return bytes.fromhex(hexdigest)
+
     def _insert_checksum(self, data):
-        logging.debug('_insert_checksum( %s )', data)
+        logger.debug('_insert_checksum( %s )', data)
         # con.rollback() is called after the with block finishes with an exception, the
         # exception is still raised and must be caught
         try:
             with self.dbh:
-                self.dbh.execute("INSERT OR IGNORE INTO checksums(filename, md5, filetype) values (?, ?, ?)", (data.get('filename'), data.get('md5'), data.get('filetype')))
+                directory_id, basename = self._locate(data.get('filename'))
+                self.dbh.execute("INSERT OR IGNORE INTO checksums(directory_id, basename, %s, plugin_id, id) values (?, ?, %s, ?, (SELECT coalesce(max(id), 0) + 1 FROM checksums))" % (
+                        ', '.join(self.DIGEST_COLUMNS), ', '.join('?' * len(self.DIGEST_COLUMNS))),
+                    (directory_id, basename) +
+                    tuple(self._digest_blob(data.get(column)) for column in self.DIGEST_COLUMNS) +
+                    (self._plugin_id(data.get('filetype')),))
+        except (sqlite3.IntegrityError, sqlite3.OperationalError) as e:
+            logger.error("Failed to insert %s into database: %s", data.get('filename'), e.args[0])
+            self._reset_caches()
+        else:
+            self._update_db_checksum()
+
+    def _insert_checksums(self, records):
+        """Insert a batch of records in a single transaction, returning {filename: file id} for those inserted.
+
+Records already in the database are left as they are.  A failure rolls the
+whole batch back.
+"""
+        logger.debug('_insert_checksums( %i records )', len(records))
+        inserted = {}
+        try:
+            with self.dbh:
+                file_id = self.dbh.execute('SELECT coalesce(max(id), 0) FROM checksums').fetchone()[0]
+                for data in records:
+                    directory_id, basename = self._locate(data.get('filename'))
+                    cursor = self.dbh.execute("INSERT OR IGNORE INTO checksums(directory_id, basename, %s, plugin_id, id) values (?, ?, %s, ?, ?)" % (
+                            ', '.join(self.DIGEST_COLUMNS), ', '.join('?' * len(self.DIGEST_COLUMNS))),
+                        (directory_id, basename) +
+                        tuple(self._digest_blob(data.get(column)) for column in self.DIGEST_COLUMNS) +
+                        (self._plugin_id(data.get('filetype')), file_id + 1))
+                    if(cursor.rowcount == 1):
+                        file_id += 1
+                        inserted[data.get('filename')] = file_id
         except (sqlite3.IntegrityError, sqlite3.OperationalError) as e:
-            logging.error("Failed to insert %s into database: %s", data.get('filename'), e.args[0])
+            logger.error("Failed to insert %i records into database: %s", len(records), e.args[0])
+            self._reset_caches()
+            inserted = {}
         else:
             self._update_db_checksum()
+        return inserted
+
+    def _reset_caches(self):
+        # A rolled back transaction may have taken cached ids with it
+        self.directories = {}
+        self.plugin_ids = {}
+        self.roots = dict(self.dbh.execute('SELECT path, id FROM roots').fetchall())
 
     def _retrieve_checksum(self, filename):
-        logging.debug('_retrieve_checksum( %s )', filename)
+        logger.debug('_retrieve_checksum( %s )', filename)
         checksum = None
 
-        results = self.dbh.execute('SELECT md5 FROM checksums WHERE filename=?', (filename,)).fetchone()
+        directory_id, basename = self._locate(filename, create=False)
+        results = None
+        if(directory_id is not None):
+            results = self.dbh.execute('SELECT md5 FROM checksums WHERE directory_id=? AND basename=?', (directory_id, basename)).fetchone()
 
         if(results is not None):
-            checksum = results[0]
+            checksum = results[0].hex()
         else:
-            logging.debug('_retrieve_checksum( %s ): No checksum found', filename)
+            logger.debug('_retrieve_checksum( %s ): No checksum found', filename)
 
-        logging.debug('_retrieve_checksum( %s ): Returning %s', filename, checksum)
+        logger.debug('_retrieve_checksum( %s ): Returning %s', filename, checksum)
         return checksum
 
-    def _calculate_db_checksum(self):
-        logging.debug('_calculate_db_checksum( %s )', self.db_file)
+    def _retrieve_digests(self, filename):
+        """Return a dict of every digest recorded for filename, or None if it has no record."""
+        logger.debug('_retrieve_digests( %s )', filename)
+        digests = None
+
+        directory_id, basename = self._locate(filename, create=False)
+        results = None
+        if(directory_id is not None):
+            results = self.dbh.execute('SELECT %s FROM checksums WHERE directory_id=? AND basename=?' % ', '.join(self.DIGEST_COLUMNS), (directory_id, basename)).fetchone()
+
+        if(results is not None):
+            digests = {column: value.hex() for column, value in zip(self.DIGEST_COLUMNS, results) if value is not None}
+        else:
+            logger.debug('_retrieve_digests( %s ): No checksum found', filename)
+
+        logger.debug('_retrieve_digests( %s ): Returning %s', filename, digests)
+        return digests
+
+    def _update_digests(self, filename, digests):
+        """Record digests missing from an existing record - never overwrites one."""
+        logger.debug('_update_digests( %s, %s )', filename, digests)
+        directory_id, basename = self._locate(filename, create=False)
+        try:
+            with self.dbh:
+                for column, digest in digests.items():
+                    if(column in self.DIGEST_COLUMNS):
+                        self.dbh.execute('UPDATE checksums SET %s=? WHERE directory_id=? AND basename=? AND %s IS NULL' % (column, column),
+                            (self._digest_blob(digest), directory_id, basename))
+        except (sqlite3.IntegrityError, sqlite3.OperationalError) as e:
+            logger.error("Failed to update %s in database: %s", filename, e.args[0])
+        else:
+            self._update_db_checksum()
+
+    def _replace_digests(self, filename, digests):
+        """Overwrite recorded digests - only for a file shown unchanged by other means."""
+        logger.debug('_replace_digests( %s, %s )', filename, digests)
+        directory_id, basename = self._locate(filename, create=False)
+        try:
+            with self.dbh:
+                for column, digest in digests.items():
+                    if(column in self.DIGEST_COLUMNS):
+                        self.dbh.execute('UPDATE checksums SET %s=? WHERE directory_id=? AND basename=?' % column,
+                            (self._digest_blob(digest), directory_id, basename))
+        except (sqlite3.IntegrityError, sqlite3.OperationalError) as e:
+            logger.error("Failed to update %s in database: %s", filename, e.args[0])
+        else:
+            self._update_db_checksum()
+
+    def _retrieve_file_id(self, filename):
+        logger.debug('_retrieve_file_id( %s )', filename)
+
+        directory_id, basename = self._locate(filename, create=False)
+        if(directory_id is None):
+            return None
+
+        results = self.dbh.execute('SELECT id FROM checksums WHERE directory_id=? AND basename=?', (directory_id, basename)).fetchone()
+        return results[0] if results is not None else None
+
+    def _insert_reject(self, filename, reason, size, mtime_ns):
+        logger.debug('_insert_reject( %s, %s, %i, %i )', filename, reason, size, mtime_ns)
+        try:
+            with self.dbh:
+                directory_id, basename = self._locate(filename)
+                self.dbh.execute('INSERT OR REPLACE INTO rejects(directory_id, basename, size, mtime_ns, reason, recorded) values (?, ?, ?, ?, ?, ?)',
+                    (directory_id, basename, size, mtime_ns, reason, int(time.time())))
+        except (sqlite3.IntegrityError, sqlite3.OperationalError) as e:
+            logger.error("Failed to record rejected %s in database: %s", filename, e.args[0])
+            self._reset_caches()
+        else:
+            self._update_db_checksum()
+
+    def _delete_reject(self, filename):
+        logger.debug('_delete_reject( %s )', filename)
+        directory_id, basename = self._locate(filename, create=False)
+        try:
+            with self.dbh:
+                self.dbh.execute('DELETE FROM rejects WHERE directory_id=? AND basename=?', (directory_id, basename))
+        except (sqlite3.IntegrityError, sqlite3.OperationalError) as e:
+            logger.error("Failed to remove rejected %s from database: %s", filename, e.args[0])
+        else:
+            self._update_db_checksum()
+
+    def _retrieve_rejects(self):
+        """Return {filename: (size, mtime_ns, reason, recorded)} for every rejected file."""
+        logger.debug('_retrieve_rejects()')
+        roots = {root_id: path for path, root_id in self.roots.items()}
+        return {os.path.join(roots.get(root_id), directory, basename): tuple(fingerprint)
+            for root_id, directory, basename, *fingerprint in self.dbh.execute(
+                'SELECT d.root_id, d.path, r.basename, r.size, r.mtime_ns, r.reason, r.recorded FROM rejects r JOIN directories d ON d.id = r.directory_id')}
+
+    def _retrieve_listings(self, path):
+        """Return {relative directory: (mtime_ns, subdirectories, files)} for a registered root,
+or a directory inside one - relative to path."""
+        logger.debug('_retrieve_listings( %s )', path)
+        root, root_id, prefix = self._scope(path)
+        listings = {}
+        for directory, mtime_ns, listing in self.dbh.execute(
+                'SELECT d.path, l.mtime_ns, l.listing FROM listings l JOIN directories d ON d.id = l.directory_id WHERE d.root_id=?', (root_id,)):
+            relative = _within(directory, prefix)
+            if(relative is not None):
+                listings[relative] = (mtime_ns,) + tuple(json.loads(zlib.decompress(listing)))
+        return listings
+
+    def _update_listings(self, path, listings):
+        """Record {relative directory: (mtime_ns, subdirectories, files)} for a registered root,
+or a directory inside one - relative to path, in one transaction."""
+        logger.debug('_update_listings( %s, %i listings )', path, len(listings))
+        root, root_id, prefix = self._scope(path)
+        try:
+            with self.dbh:
+                for directory, (mtime_ns, subdirectories, files) in listings.items():
+                    key = (root_id, os.path.join(prefix, directory) if directory else prefix)
+                    directory_id = self.directories.get(key)
+                    if(directory_id is None):
+                        self.dbh.execute('INSERT OR IGNORE INTO directories(root_id, path) values (?, ?)', key)
+                        directory_id = self.directories[key] = self.dbh.execute('SELECT id FROM directories WHERE root_id=? AND path=?', key).fetchone()[0]
+                    self.dbh.execute('INSERT OR REPLACE INTO listings(directory_id, mtime_ns, listing) values (?, ?, ?)',
+                        (directory_id, mtime_ns, zlib.compress(json.dumps([subdirectories, files]).encode())))
+        except (sqlite3.IntegrityError, sqlite3.OperationalError) as e:
+            logger.error("Failed to record directory listings in database: %s", e.args[0])
+            self._reset_caches()
+        else:
+            self._update_db_checksum()
+
+    def _retrieve_costs(self, path):
+        """Return {filename: (size, total_samples, sample_rate, bits_per_sample, seconds)} for a registered root,
+or a directory inside one."""
+        logger.debug('_retrieve_costs( %s )', path)
+        root, root_id, prefix = self._scope(path)
+        return {os.path.join(root, directory, basename): tuple(hint)
+            for directory, basename, *hint in self.dbh.execute(
+                'SELECT d.path, c.basename, c.size, c.total_samples, c.sample_rate, c.bits_per_sample, c.seconds FROM costs c JOIN directories d ON d.id = c.directory_id WHERE d.root_id=?',
+                (root_id,))
+                    if(_within(directory, prefix) is not None)}
+
+    def _retrieve_segments(self, path):
+        """Return {filename: segments digest} for every record with one under a registered root,
+or a directory inside one."""
+        logger.debug('_retrieve_segments( %s )', path)
+        root, root_id, prefix = self._scope(path)
+        return {os.path.join(root, directory, basename): segments.hex()
+            for directory, basename, segments in self.dbh.execute(
+                'SELECT d.path, c.basename, c.segments FROM checksums c JOIN directories d ON d.id = c.directory_id WHERE d.root_id=? AND c.segments IS NOT NULL',
+                (root_id,))
+                    if(_within(directory, prefix) is not None)}
+
+    def _update_costs(self, costs):
+        """Record {filename: (size, total_samples, sample_rate, bits_per_sample, seconds)} - in one transaction."""
+        logger.debug('_update_costs( %i files )', len(costs))
+        try:
+            with self.dbh:
+                for filename, hint in costs.items():
+                    directory_id, basename = self._locate(filename)
+                    self.dbh.execute('INSERT OR REPLACE INTO costs(directory_id, basename, size, total_samples, sample_rate, bits_per_sample, seconds) values (?, ?, ?, ?, ?, ?, ?)',
+                        (directory_id, basename) + tuple(hint))
+        except (sqlite3.IntegrityError, sqlite3.OperationalError) as e:
+            logger.error("Failed to record cost hints in database: %s", e.args[0])
+            self._reset_caches()
+        else:
+            self._update_db_checksum()
+
+    def _begin_run(self, command):
+        logger.debug('_begin_run( %s )', command)
+        with self.dbh:
+            cursor = self.dbh.execute('INSERT INTO runs(command, started) values (?, ?)', (command, int(time.time())))
+        self._update_db_checksum()
+        return flaccurate.history.Run(cursor.lastrowid, command)
+
+    def _finish_run(self, run):
+        logger.debug('_finish_run( %i )', run.id)
+        counts = run.counts
+        try:
+            with self.dbh:
+                self.dbh.execute('UPDATE runs SET finished=?, verified=?, failed=?, inserted=?, invalid=?, error=? WHERE id=?', (
+                    int(time.time()),
+                    counts[flaccurate.history.VERIFIED],
+                    counts[flaccurate.history.FAILED],
+                    counts[flaccurate.history.INSERTED],
+                    counts[flaccurate.history.INVALID],
+                    counts[flaccurate.history.ERROR],
+                    run.id))
+                self.dbh.executemany('INSERT OR REPLACE INTO run_outcomes(run_id, outcome, bitmap) values (?, ?, ?)',
+                    ((run.id, outcome, bitmap) for outcome, bitmap in run.encoded_bitmaps().items()))
+        except (sqlite3.IntegrityError, sqlite3.OperationalError) as e:
+            logger.error("Failed to record run %i in database: %s", run.id, e.args[0])
+        else:
+            self._update_db_checksum()
+
+    def _retrieve_runs(self, limit=None):
+        logger.debug('_retrieve_runs( %s )', limit)
+        return self.dbh.execute('SELECT id, command, started, finished, verified, failed, inserted, invalid, error FROM runs ORDER BY id DESC LIMIT ?',
+            (limit if limit is not None else -1,)).fetchall()
+
+    def _retrieve_file_history(self, file_id):
+        """Yield (run_id, started, outcome) for a file, most recent run first."""
+        logger.debug('_retrieve_file_history( %i )', file_id)
+        runs = self.dbh.execute('SELECT r.id, r.started, o.outcome, o.bitmap FROM runs r JOIN run_outcomes o ON o.run_id = r.id ORDER BY r.id DESC, o.outcome')
+        for run_id, started, outcome, bitmap in runs:
+            if(flaccurate.history.test_bit(flaccurate.history.decode(bitmap), file_id)):
+                yield run_id, started, outcome
+
+    def _calculate_db_checksum(self, db_file=None):
+        db_file = db_file or self.db_file
+        logger.debug('_calculate_db_checksum( %s )', db_file)
         checksum = None
 
         try:
-            db_fileh = open(self.db_file, 'rb')
+            db_fileh = open(db_file, 'rb')
         except IOError as e:
-            logging.critical('_calculate_db_checksum( %s ): Failed to calculate database checksum %s', self.db_file, e.args[0])
+            logger.critical('_calculate_db_checksum( %s ): Failed to calculate database checksum %s', db_file, e.args[0])
         else:
             hasher = hashlib.md5()
             hasher.update(db_fileh.read())
             checksum = str(hasher.hexdigest())
             db_fileh.close()
 
-        logging.debug('_calculate_db_checksum( %s ): Returning %s', self.db_file, checksum)
+        logger.debug('_calculate_db_checksum( %s ): Returning %s', db_file, checksum)
         return checksum
 
     def _retrieve_db_checksum(self):
-        logging.debug('_retrieve_db_checksum( %s )', self.db_md5_file)
+        logger.debug('_retrieve_db_checksum( %s )', self.db_md5_file)
         checksum = None
 
         try:
             db_md5_fileh = open(self.db_md5_file, 'r')
         except IOError as e:
-            logging.critical('_retrieve_db_checksum( %s ): Failed to retrieve database checksum %s', self.db_md5_file, e.args[0])
+            logger.critical('_retrieve_db_checksum( %s ): Failed to retrieve database checksum %s', self.db_md5_file, e.args[0])
         else:
             md5_file_content = json.load(db_md5_fileh)
             checksum = md5_file_content[self.db_file]['md5']
             db_md5_fileh.close()
 
-        logging.debug('_retrieve_db_checksum( %s ): Returning %s', self.db_md5_file, checksum)
+        logger.debug('_retrieve_db_checksum( %s ): Returning %s', self.db_md5_file, checksum)
         return checksum
 
     def _insert_db_checksum(self, data):
-        logging.debug('_insert_db_checksum( %s ): %s', self.db_md5_file, data)
+        logger.debug('_insert_db_checksum( %s ): %s', self.db_md5_file, data)
 
         try:
             db_md5_fileh = open(self.db_md5_file, 'w')
         except IOError as e:
-            logging.critical('_insert_db_checksum( %s ): Failed to insert database checksum %s', self.db_md5_file, e.args[0])
+            logger.critical('_insert_db_checksum( %s ): Failed to insert database checksum %s', self.db_md5_file, e.args[0])
         else:
             json.dump(data, db_md5_fileh)
             db_md5_fileh.close()
 
+    @contextlib.contextmanager
+    def _batch(self):
+        """Defer updates of the database checksum to the end of the block - one for every write within it."""
+        self.batching += 1
+        try:
+            yield
+        finally:
+            self.batching -= 1
+            if(not self.batching and self.batched):
+                self.batched = False
+                self._update_db_checksum()
+
     def _update_db_checksum(self):
-        logging.debug('_update_db_checksum( %s )', self.db_md5_file)
+        logger.debug('_update_db_checksum( %s )', self.db_md5_file)
+
+        if(self.batching):
+            self.batched = True
+            return
+
+        if(self.staging):
+            # Nothing on disk changed - persisted at the next checkpoint
+            self.staged = True
+            if(time.monotonic() - self.persisted > self.STAGING_CHECKPOINT):
+                self._persist_db()
+            return
 
         # Only update if its changed
         db_checksum_calculated = self._calculate_db_checksum()
         if(db_checksum_calculated != self.checksum):
-            logging.debug('_update_db_checksum( %s ): Database checksum updated %s', self.db_md5_file, db_checksum_calculated)
+            logger.debug('_update_db_checksum( %s ): Database checksum updated %s', self.db_md5_file, db_checksum_calculated)
             self._insert_db_checksum({
                 self.db_file : {
                     'md5' : db_checksum_calculated
                 }
             })
+
+    def _iterate_checksums(self, path):
+        """Yield (directory, basename, md5, filetype) for every record under a
+registered root, or a directory inside one - the directory relative to it.
+
+Ordered by directory path component by component, then basename - the same
+order a top down walk with sorted entries produces (see: sidecar.walk_key()),
+so two streams can be merged in a single pass.  Only the directory list is
+sorted in memory, checksums are read in primary key order per directory.
+"""
+        root, root_id, prefix = self._scope(path)
+        plugins = dict(self.dbh.execute('SELECT id, name FROM plugins').fetchall())
+        directories = [(directory_id, _within(directory, prefix))
+            for directory_id, directory in self.dbh.execute('SELECT id, path FROM directories WHERE root_id=?', (root_id,))]
+        directories = [directory for directory in directories if directory[1] is not None]
+        directories.sort(key=lambda directory: flaccurate.sidecar.walk_key(directory[1]))
+
+        for directory_id, directory in directories:
+            for basename, md5, plugin_id in self.dbh.execute('SELECT basename, md5, plugin_id FROM checksums WHERE directory_id=? ORDER BY basename', (directory_id,)):
+                yield directory, basename, md5.hex(), plugins.get(plugin_id)
+
+    def _iterate_files(self, path=None):
+        """Yield (root, directory, basename, filetype) for every record, or only
+those under the given registered root or directory inside one - the directory
+relative to the root, in no particular order."""
+        roots = {root_id: root for root, root_id in self.roots.items()}
+        plugins = dict(self.dbh.execute('SELECT id, name FROM plugins').fetchall())
+
+        query = 'SELECT directories.root_id, directories.path, checksums.basename, checksums.plugin_id FROM checksums JOIN directories ON directories.id = checksums.directory_id'
+        parameters = ()
+        prefix = ''
+        if(path is not None):
+            root, root_id, prefix = self._scope(path)
+            query += ' WHERE directories.root_id=?'
+            parameters = (root_id,)
+
+        for root_id, directory, basename, plugin_id in self.dbh.execute(query, parameters):
+            if(prefix and _within(directory, prefix) is None):
+                continue
+            yield roots.get(root_id), directory, basename, plugins.get(plugin_id)
+
+    def _iterate_digests(self, path):
+        """Yield (path, filetype, {digest: hex}) for every record under a
+registered root, or a directory inside one, the path relative to it - in no
+particular order."""
+        root, root_id, prefix = self._scope(path)
+        plugins = dict(self.dbh.execute('SELECT id, name FROM plugins').fetchall())
+        query = 'SELECT directories.path, checksums.basename, checksums.plugin_id, %s FROM checksums JOIN directories ON directories.id = checksums.directory_id WHERE directories.root_id=?' % (
+            ', '.join('checksums.' + column for column in self.DIGEST_COLUMNS))
+
+        for directory, basename, plugin_id, *digests in self.dbh.execute(query, (root_id,)):
+            directory = _within(directory, prefix)
+            if(directory is None):
+                continue
+            yield (os.path.join(directory, basename), plugins.get(plugin_id),
+                {column: value.hex() for column, value in zip(self.DIGEST_COLUMNS, digests) if value is not None})
+
+    def _iterate_directory_digests(self, digest):
+        """Yield (root, directory, [(basename, digest), ...]) for every directory
+holding at least one record of the given digest, in walk order."""
+        roots = {root_id: path for path, root_id in self.roots.items()}
+        directories = self.dbh.execute('SELECT id, root_id, path FROM directories').fetchall()
+        directories.sort(key=lambda directory: (flaccurate.sidecar.walk_key(directory[2]), directory[1]))
+
+        for directory_id, root_id, directory in directories:
+            records = self.dbh.execute('SELECT basename, %s FROM checksums WHERE directory_id=? ORDER BY basename' % digest, (directory_id,)).fetchall()
+            if(any(value is not None for basename, value in records)):
+                yield roots.get(root_id), directory, [(basename, value.hex() if value is not None else None) for basename, value in records]
+
+
+def _relative(relative):
+    # An os.path.relpath() as directories are recorded: '' for the directory
+    # itself, None for anything outside it
+    if(relative == os.curdir):
+        return ''
+    if(relative == os.pardir or relative.startswith(os.pardir + os.sep)):
+        return None
+    return relative
+
+
+def _within(directory, prefix):
+    # A recorded directory relative to prefix (see: Database._scope()), None
+    # for anything outside it
+    if(directory == prefix):
+        return ''
+    if(not prefix):
+        return directory
+    if(directory.startswith(prefix + os.sep)):
+        return directory[len(prefix) + len(os.sep):]
+    return None
@@ -1,12 +1,107 @@
 import sys
+import hashlib
+
+import flaccurate.reader
+import flaccurate.merkle
+import flaccurate.accuraterip
 
 import logging
-logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
+
+# Digest algorithms the core can calculate - any combination in a single pass.
+# md5 is always calculated: it is what every existing database record holds.
+DIGESTS = {
+    'md5': hashlib.md5,
+    'sha256': hashlib.sha256,
+    'blake2b': hashlib.blake2b,
+}
+
+# Digests only meaningful over decoded PCM of a particular format, as
+# (accepts stream_info, hasher) - calculated in the same pass when a pcm()
+# plugin reports a stream format the digest accepts
+PCM_DIGESTS = {
+    'accuraterip': (flaccurate.accuraterip.supported, flaccurate.accuraterip.AccurateRipHasher),
+}
+
+# Digests over fixed size segments of the plugin's segment_ranges() rather
+# than the buffers hashed for the rest (see: flaccurate.merkle)
+SEGMENT_DIGESTS = {
+    'segments': flaccurate.merkle.SegmentHasher,
+}
+
+# Decoded PCM is hashed as the plugin yields it - a block of a few thousand
+# samples at a time for flac, each a new bytes object.  With a PCM buffer
+# size set (see: configure()) the blocks are gathered into one preallocated
+# buffer and hashed a buffer full at a time, through memoryviews of it: fewer,
+# larger updates of every hasher, for one more copy of the data.  Which is
+# faster depends on the host and the digests - selfcheck --calibrate measures.
+DEFAULT_PCM_BUFFER_SIZE = 0
+
+_config = {
+    'pcm_buffer_size': DEFAULT_PCM_BUFFER_SIZE,
+}
+
+
+def configure(pcm_buffer_size=None):
+    """Set process wide decoding options.
+
+pcm_buffer_size: bytes of decoded PCM hashed at a time, 0 to hash each block
+                 as the plugin decodes it
+"""
+    logger.debug('dynloader.configure( pcm_buffer_size=%s )', pcm_buffer_size)
+    _config['pcm_buffer_size'] = pcm_buffer_size if pcm_buffer_size is not None else DEFAULT_PCM_BUFFER_SIZE
+
+
+def coalesce(buffers, size):
+    """Yield the data of buffers gathered into memoryviews of one reusable buffer of size bytes.
+
+Each memoryview is only valid until the next is asked for.  A buffer larger
+than size is passed on as it is.
+"""
+    view = memoryview(bytearray(size))
+    filled = 0
+    for buffer in buffers:
+        length = len(buffer)
+        if(filled + length > size):
+            if(filled):
+                yield view[:filled]
+                filled = 0
+            if(length > size):
+                yield buffer
+                continue
+        view[filled:filled + length] = buffer
+        filled += length
+    if(filled):
+        yield view[:filled]
+
 
 class Plugins():
     """The plugin loader class.
 
 On instantiation will enumerate all the plugins available.
+
+Two plugin interfaces are supported, each plugin being wrapped in the adapter
+for the interface it implements - callers only ever see the adapter:
+
+Version 1 (see: LegacyPlugin)
+    md5(filename) - the plugin opens, reads and hashes the file itself
+
+Version 2 (see: StreamingPlugin) - declared with module level API_VERSION = 2
+    The core opens the file (see: flaccurate.reader) and does the hashing,
+    the plugin only describes where the audio is, by implementing one of:
+    audio_ranges(fileobj)    - list of (start, finish) byte offsets of audio data
+    pcm(fileobj, stream_info) - iterable of decoded PCM buffers (signed, little
+                                endian, interleaved).  Before the first buffer the
+                                plugin fills the stream_info dict with:
+                                sample_rate, channels, bits_per_sample - and
+                                total_samples where the format records it
+    Either may raise IOError or ValueError for a file it cannot handle.
+    A pcm() plugin may also implement encoded_ranges(fileobj), the byte ranges
+    of the encoded audio, for segmented digests (see: flaccurate.merkle) - an
+    audio_ranges() plugin's are its audio ranges.
+    A plugin may add digests of its own, calculated over the same buffers as
+    the rest, with a module level PLUGIN_DIGESTS dict of name to hasher
+    class (see: flaccurate.plugins.mp3.FrameIndex).
 """
     PLUGINS_PATH = 'plugins'
 
@@ -15,22 +110,22 @@ On instantiation will enumerate all the plugins available.
         self.debug = self.args.debug
         self.silent = self.args.silent
         self.quiet = self.args.quiet
-        logging.debug('Plugins __init__ %s', vars(self.args))
+        logger.debug('Plugins __init__ %s', vars(self.args))
         
         self.plugins = self._init_plugins()
-        logging.info('Plugins available: %s', ', '.join(self.supported_filetypes()))
+        logger.info('Plugins available: %s', ', '.join(self.supported_filetypes()))
 
     def _init_plugins(self):
-        logging.debug('_init_plugins( %s )', self.PLUGINS_PATH)
+        logger.debug('_init_plugins( %s )', self.PLUGINS_PATH)
         plugins = self._discover_plugins()
 
         for plugin in plugins.keys():
-            logging.debug('Plugin found: %s', plugin)
+            logger.debug('Plugin found: %s', plugin)
         
         return plugins
 
     def _discover_plugins(self):
-        return {module_name.replace('flaccurate.plugins.',''): sys.modules[module_name]
+        return {module_name.replace('flaccurate.plugins.',''): adapt(module_name.replace('flaccurate.plugins.',''), sys.modules[module_name])
                     for module_name in sys.modules.keys()
                         if( self._valid_plugin(module_name))}
 
@@ -45,3 +140,132 @@ On instantiation will enumerate all the plugins available.
 
     def plugin(self,filetype):
         return self.plugins.get(filetype, None)
+
+
+def adapt(name, module):
+    if(getattr(module, 'API_VERSION', 1) >= 2):
+        logger.debug('Plugin %s: streaming interface', name)
+        return StreamingPlugin(name, module)
+    logger.debug('Plugin %s: legacy md5() interface', name)
+    return LegacyPlugin(name, module)
+
+
+class LegacyPlugin():
+    """Adapter for version 1 plugins - delegates straight to the module's md5()."""
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+
+    def md5(self, filename):
+        return self.module.md5(filename)
+
+    def digests(self, filename, algorithms=('md5',), stream_info=None):
+        # Version 1 plugins only know md5 - other digests are left out
+        _md5 = self.md5(filename)
+        if(_md5 is None):
+            return None
+        return {'md5': _md5}
+
+    def segment_ranges(self, fileobj):
+        return None
+
+
+class StreamingPlugin():
+    """Adapter for version 2 plugins - the core owns file access and hashing."""
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+
+    def md5(self, filename):
+        digests = self.digests(filename)
+        return digests.get('md5') if digests is not None else None
+
+    def digests(self, filename, algorithms=('md5',), stream_info=None):
+        """Calculate every requested digest in a single pass over the audio.
+
+Returns a dict of algorithm name to hex digest, or None on failure.
+A stream_info dict passed in is filled with whatever the plugin reports.
+"""
+        logger.debug('plugins.%s.digests( %s, %s )', self.name, filename, algorithms)
+        _digests = None
+
+        hashers = {algorithm: DIGESTS[algorithm]() for algorithm in algorithms if algorithm in DIGESTS}
+        hashers.update((name, hasher()) for name, hasher in getattr(self.module, 'PLUGIN_DIGESTS', {}).items())
+        pcm_algorithms = [algorithm for algorithm in algorithms if algorithm in PCM_DIGESTS]
+        segment_algorithms = [algorithm for algorithm in algorithms if algorithm in SEGMENT_DIGESTS]
+        if(not hasattr(self.module, 'pcm')):
+            # The segment ranges are the audio ranges - hashed in the same pass
+            hashers.update((algorithm, SEGMENT_DIGESTS[algorithm]()) for algorithm in segment_algorithms)
+            segment_algorithms = None
+        if(stream_info is None):
+            stream_info = {}
+        try:
+            with flaccurate.reader.Reader(filename) as fileobj:
+                for buffer in self.buffers(fileobj, stream_info):
+                    if(pcm_algorithms):
+                        # The stream format is only known once the plugin starts yielding
+                        hashers.update(self._pcm_hashers(filename, pcm_algorithms, stream_info))
+                        pcm_algorithms = None
+                    for hasher in hashers.values():
+                        hasher.update(buffer)
+            if(segment_algorithms):
+                # Decoded buffers are no use - the encoded data takes a pass of its own
+                hashers.update(self._segment_hashers(filename, segment_algorithms))
+        except (IOError, ValueError) as err:
+            logger.error('Failed to read file %s: %s', filename, err)
+        else:
+            _digests = {algorithm: str(hasher.hexdigest()) for algorithm, hasher in hashers.items()}
+
+        logger.debug('plugins.%s.digests( %s ): Returning %s', self.name, filename, _digests)
+        return _digests
+
+    def _pcm_hashers(self, filename, algorithms, stream_info):
+        hashers = {}
+        for algorithm in algorithms:
+            supported, hasher = PCM_DIGESTS[algorithm]
+            if(supported(stream_info)):
+                hashers[algorithm] = hasher()
+            else:
+                logger.debug('plugins.%s: %s not applicable to %s (%s)', self.name, algorithm, filename, stream_info)
+        return hashers
+
+    def _segment_hashers(self, filename, algorithms):
+        hashers = {algorithm: SEGMENT_DIGESTS[algorithm]() for algorithm in algorithms}
+        with flaccurate.reader.Reader(filename) as fileobj:
+            ranges = self.segment_ranges(fileobj)
+            if(ranges is None):
+                logger.debug('plugins.%s: segmented digests not applicable to %s', self.name, filename)
+                return {}
+            for start, finish in ranges:
+                for buffer in flaccurate.reader.iter_range(fileobj, start, finish):
+                    for hasher in hashers.values():
+                        hasher.update(buffer)
+        return hashers
+
+    def segment_ranges(self, fileobj):
+        """Byte ranges of an open file segmented digests cover, None when the plugin describes none."""
+        if(hasattr(self.module, 'encoded_ranges')):
+            return self.module.encoded_ranges(fileobj)
+        if(hasattr(self.module, 'audio_ranges')):
+            return self.module.audio_ranges(fileobj)
+        return None
+
+    def check_segments(self, filename, recorded, indexes=None, count=None):
+        """Hash segments of filename again against a recorded segments digest (see: flaccurate.merkle.check)."""
+        with flaccurate.reader.Reader(filename) as fileobj:
+            ranges = self.segment_ranges(fileobj)
+        if(ranges is None):
+            raise ValueError('%s: no segment ranges for %s' % (self.name, filename))
+        return flaccurate.merkle.check(filename, ranges, recorded, indexes, count)
+
+    def buffers(self, fileobj, stream_info=None):
+        """Yield the audio data of an open file, as described by the plugin."""
+        if(hasattr(self.module, 'pcm')):
+            buffers = self.module.pcm(fileobj, stream_info if stream_info is not None else {})
+            if(_config['pcm_buffer_size']):
+                buffers = coalesce(buffers, _config['pcm_buffer_size'])
+            yield from buffers
+        else:
+            for start, finish in self.module.audio_ranges(fileobj):
+                logger.debug('plugins.%s: Audio range %i-%i bytes', self.name, start, finish)
+                yield from flaccurate.reader.iter_range(fileobj, start, finish)
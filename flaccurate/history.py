@@ -0,0 +1,63 @@
+import zlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Per file outcome of a run - each has its own bitmap in run_outcomes,
+# bit N set meaning the file with checksums.id N had that outcome.
+VERIFIED = 0  # checksum matched the database record
+FAILED = 1    # checksum did not match the database record
+INSERTED = 2  # no database record - checksum recorded for the first time
+INVALID = 3   # file failed validation and was skipped
+ERROR = 4     # checksum could not be calculated
+
+OUTCOMES = {
+    VERIFIED: 'verified',
+    FAILED: 'failed',
+    INSERTED: 'inserted',
+    INVALID: 'invalid',
+    ERROR: 'error',
+}
+
+
+class Run():
+    """Accumulates the outcomes of a single run in memory.
+
+Outcomes of files with a database record are kept as one bitmap per outcome,
+indexed by file id.  A bitmap covering 400k files is 50KB before compression,
+and a healthy run is long runs of identical bits, which zlib reduces to
+almost nothing - so a year of daily runs stays in the low megabytes.
+"""
+    def __init__(self, run_id, command):
+        self.id = run_id
+        self.command = command
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+        self.bitmaps = {outcome: bytearray() for outcome in OUTCOMES}
+
+    def record(self, outcome, file_id=None):
+        self.counts[outcome] += 1
+        if(file_id is not None):
+            set_bit(self.bitmaps[outcome], file_id)
+
+    def encoded_bitmaps(self):
+        return {outcome: encode(bitmap) for outcome, bitmap in self.bitmaps.items() if bitmap}
+
+
+def set_bit(bitmap, index):
+    byte, bit = divmod(index, 8)
+    if(byte >= len(bitmap)):
+        bitmap.extend(bytes(byte - len(bitmap) + 1))
+    bitmap[byte] |= 1 << bit
+
+
+def test_bit(bitmap, index):
+    byte, bit = divmod(index, 8)
+    return byte < len(bitmap) and bool(bitmap[byte] & (1 << bit))
+
+
+def encode(bitmap):
+    return zlib.compress(bytes(bitmap), 9)
+
+
+def decode(blob):
+    return zlib.decompress(blob)
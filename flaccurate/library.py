@@ -0,0 +1,190 @@
+import os
+import argparse
+import pathlib
+import itertools
+import collections
+
+import flaccurate.context
+import flaccurate.history
+import flaccurate.processor
+import flaccurate.rules
+import flaccurate.scheduler
+import flaccurate.walker
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Embedding flaccurate (see: Library).
+#
+# A Library is what one run of the command line has - a database, validated
+# once, and the plugins - kept for as long as the caller likes.  The commands
+# take their settings from the command line options; a Library takes the
+# same settings as keyword arguments, named as the options are with - as _
+# (digests='sha256', verify_digest='sha256', io_limit=100, staging=True, ...),
+# anything not given defaulting as it does on the command line.
+#
+# verify() yields a Result as each file completes.  Checksums are calculated
+# on worker threads, everything touching the database happens on the thread
+# iterating - so a Library, like the database it holds, belongs to the thread
+# that created it.
+#
+# The files are processed as curate processes them (see: flaccurate.processor),
+# the commands being the command line's way in.  Like the rest of flaccurate,
+# a Library reports through logging only - configuring it is the caller's
+# business.
+
+# Outcome of a file verify() was asked about which has no database record
+NOT_RECORDED = 'not recorded'
+
+# Files whose database writes share one update of the database checksum
+BATCH = 100
+
+
+class Result(collections.namedtuple('Result', ('filename', 'filetype', 'outcome', 'digests'))):
+    """The outcome of one file: verified, failed, inserted, invalid, error (see:
+flaccurate.history.OUTCOMES) or not recorded - with the digests calculated,
+None when there are none."""
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.outcome in ('verified', 'inserted')
+
+
+def settings(**options):
+    """The settings a command line without options gives, with options in place of the defaults."""
+    args = argparse.Namespace(
+        debug=False, silent=False, quiet=False, usage=False, force=False,
+        database=None, input=None, exclude=None, include=None, rescan=False,
+        schedule=None, workers=None, digests=None, verify_digest=None,
+        io_direct=False, io_limit=None, read_buffer=None, read_ahead=None, pcm_buffer=None, tuning=None,
+        sample=None, time_budget=None, spot_check=None, manifest=None, results=None,
+        socket=None, staging=False, inputs=None, catalog=None,
+    )
+    for name, value in options.items():
+        if(not hasattr(args, name)):
+            raise TypeError('Unknown setting: %s' % name)
+        setattr(args, name, value)
+    return args
+
+
+class Library():
+    """A flaccurate database and plugin registry, for use from Python.
+
+    with flaccurate.Library('music.db', digests='sha256') as library:
+        for result in library.verify(['/music/Incoming/album']):
+            if(not result.ok):
+                ...
+
+Raises RuntimeError when the database cannot be opened, or is not valid -
+force=True creates one that does not exist.  close() (or leaving the with
+block) persists a --staging database.
+
+The command line builds one from its options and context (args, context).
+"""
+    def __init__(self, database=None, args=None, context=None, **options):
+        if(args is None):
+            args = settings(database=database, **options)
+        self.args = args
+        self.context = context or flaccurate.context.Context(args)
+
+        self.processor = flaccurate.processor.Processor(self.args, self.context.plugins, self.context.database)
+        self.run = None
+
+    @property
+    def database(self):
+        return self.processor.db
+
+    @property
+    def plugins(self):
+        return self.processor.plugins
+
+    @property
+    def digests(self):
+        return self.processor.digests
+
+    @property
+    def verify_digest(self):
+        return self.processor.verify_digest
+
+    def close(self):
+        self.context.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def verify(self, paths, record=False, workers=None, batch=BATCH, command=None):
+        """Verify files and directories, yielding a Result as each file completes.
+
+Directories are walked, with their path rules (see: flaccurate.rules), for
+every supported filetype.  Files without a database record are recorded
+when record is set, as curate does - otherwise reported as not recorded.
+
+Checksums are calculated by workers threads (default: one per CPU).  The
+database checksum is updated once every batch files rather than after each.
+The whole call is one run in the history, under command.
+"""
+        processor = self.processor
+        db = processor.db
+        workers = workers or self.args.workers or os.cpu_count() or 1
+        batch = batch or BATCH
+        paths = list(paths)
+
+        if(record):
+            # As curate does for --input
+            for path in paths:
+                if(os.path.isdir(path)):
+                    db._register_root(path)
+
+        self.run = processor.begin_run(command or ('library curate' if record else 'library verify'))
+        results = None
+        try:
+            work = []
+            for filename, filetype in self.expand(paths):
+                if(not record and db._retrieve_file_id(filename) is None):
+                    yield Result(filename, filetype, NOT_RECORDED, None)
+                    continue
+                work.append((filename, filetype))
+
+            # Checksums on the worker threads, the database only ever from here
+            results = flaccurate.scheduler.run_lanes([work], processor.checksum_file, workers, failed=processor.checksum_failed)
+            completed = batch
+            while(completed == batch):
+                completed = 0
+                with db._batch():
+                    for filename, filetype, digests_calculated, outcome in itertools.islice(results, batch):
+                        completed += 1
+                        outcome = processor.process_checksum(filename, filetype, digests_calculated, outcome)
+                        processor.record_outcome(filename, outcome)
+                        yield Result(filename, filetype, flaccurate.history.OUTCOMES[outcome], digests_calculated)
+        finally:
+            # Stopped early - the workers must not wait on results nobody takes
+            if(results is not None):
+                results.close()
+            processor.finish_run()
+
+    def expand(self, paths):
+        """Yield (filename, filetype) for the supported files given, and under the directories given."""
+        filetypes = set(self.plugins.supported_filetypes())
+        for path in paths:
+            if(os.path.isdir(path)):
+                # The rules of the library root holding path, when one does
+                root, root_id, prefix = self.database._scope(path)
+                if(root is None or root == pathlib.Path(root).anchor):
+                    root, prefix = path, ''
+                rules = flaccurate.rules.load(root, self.args.exclude, self.args.include)
+                filenames = (os.path.join(directory, basename)
+                    for directory, files in flaccurate.walker.Walker(path, rules=rules, prefix=prefix).walk()
+                        for basename in files
+                            if(not self.processor.known_reject(os.path.join(directory, basename))))
+            else:
+                filenames = [os.path.abspath(path)]
+
+            for filename in filenames:
+                filetype = os.path.splitext(filename)[1][1:]
+                if(filetype in filetypes):
+                    yield filename, filetype
@@ -0,0 +1,167 @@
+import random
+import struct
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import flaccurate.reader
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Segmented digests - a hash tree over fixed size segments of a file's data.
+#
+# The data is what a plugin's segment ranges describe (see:
+# flaccurate.dynloader.StreamingPlugin.segment_ranges), taken as one stream:
+# the audio range of an mp3, the encoded frames of a flac.  Each segment is
+# hashed on its own, so any segment can be checked without reading the rest of
+# the file - several at once, or a few picked at random - and a mismatch names
+# the segments that changed.  The root of the tree over the segment digests
+# stands for the whole.
+#
+# Recorded as the 'segments' digest: a header (format version, segment size,
+# length of the stream), the root, then the digest of every segment.
+
+SEGMENT_BYTES = 4 * 1024 * 1024
+DIGEST_SIZE = 16
+
+# Segments of one file hashed at once by hash_segments()
+SEGMENT_WORKERS = 4
+
+HEADER = struct.Struct('<BIQ')
+FORMAT_VERSION = 1
+
+
+def leaf():
+    return hashlib.blake2b(digest_size=DIGEST_SIZE, person=b'segment')
+
+
+def node(left, right):
+    return hashlib.blake2b(left + right, digest_size=DIGEST_SIZE, person=b'node').digest()
+
+
+def root(leaves):
+    """Root of the hash tree over leaves - an odd digest out moves up a level as it is."""
+    level = list(leaves) or [leaf().digest()]
+    while(len(level) > 1):
+        level = [node(*level[i:i + 2]) if i + 1 < len(level) else level[i] for i in range(0, len(level), 2)]
+    return level[0]
+
+
+def pack(segment_bytes, length, leaves):
+    return (HEADER.pack(FORMAT_VERSION, segment_bytes, length) + root(leaves) + b''.join(leaves)).hex()
+
+
+def unpack(segments):
+    """Return (segment_bytes, length, root, [leaf, ...]) from a hex segments digest."""
+    data = bytes.fromhex(segments)
+    version, segment_bytes, length = HEADER.unpack_from(data)
+    if(version != FORMAT_VERSION):
+        raise ValueError('Unsupported segments digest version: %i' % version)
+    digests = data[HEADER.size:]
+    return segment_bytes, length, digests[:DIGEST_SIZE], [digests[i:i + DIGEST_SIZE] for i in range(DIGEST_SIZE, len(digests), DIGEST_SIZE)]
+
+
+class SegmentHasher():
+    """hashlib style interface calculating the segments digest of a stream."""
+    name = 'segments'
+
+    def __init__(self, segment_bytes=SEGMENT_BYTES):
+        self.segment_bytes = segment_bytes
+        self.leaves = []
+        self.hasher = leaf()
+        self.filled = 0
+        self.length = 0
+
+    def update(self, buffer):
+        buffer = memoryview(buffer)
+        self.length += len(buffer)
+        while(buffer):
+            take = min(len(buffer), self.segment_bytes - self.filled)
+            self.hasher.update(buffer[:take])
+            self.filled += take
+            buffer = buffer[take:]
+            if(self.filled == self.segment_bytes):
+                self.leaves.append(self.hasher.digest())
+                self.hasher = leaf()
+                self.filled = 0
+
+    def hexdigest(self):
+        leaves = self.leaves + ([self.hasher.digest()] if self.filled else [])
+        return pack(self.segment_bytes, self.length, leaves)
+
+
+def compare(recorded, calculated):
+    """Indexes of the segments differing between two segments digests.
+
+[] when the roots agree, None when the two cannot be compared segment by
+segment - the segment size or the length of the data differ.
+"""
+    recorded_bytes, recorded_length, recorded_root, recorded_leaves = unpack(recorded)
+    calculated_bytes, calculated_length, calculated_root, calculated_leaves = unpack(calculated)
+    if((recorded_bytes, recorded_length) != (calculated_bytes, calculated_length)):
+        return None
+    if(recorded_root == calculated_root):
+        return []
+    return [index for index, (recorded_leaf, calculated_leaf) in enumerate(zip(recorded_leaves, calculated_leaves))
+        if recorded_leaf != calculated_leaf]
+
+
+def file_ranges(ranges, index, segment_bytes):
+    """The (start, finish) byte ranges of the file making up segment index of the stream."""
+    start = index * segment_bytes
+    finish = start + segment_bytes
+    pieces = []
+    offset = 0
+    for range_start, range_finish in ranges:
+        length = range_finish - range_start
+        if(start < offset + length and finish > offset):
+            pieces.append((range_start + max(start - offset, 0), range_start + min(finish - offset, length)))
+        offset += length
+    return pieces
+
+
+def hash_segments(filename, ranges, indexes, segment_bytes, workers=SEGMENT_WORKERS):
+    """Return {index: digest} for the given segments, read from filename on up to workers threads."""
+    logger.debug('merkle.hash_segments( %s, %i segments )', filename, len(indexes))
+
+    def hash_chunk(chunk):
+        # One file handle per thread
+        digests = {}
+        with flaccurate.reader.Reader(filename) as fileobj:
+            for index in chunk:
+                hasher = leaf()
+                for start, finish in file_ranges(ranges, index, segment_bytes):
+                    for buffer in flaccurate.reader.iter_range(fileobj, start, finish):
+                        hasher.update(buffer)
+                digests[index] = hasher.digest()
+        return digests
+
+    indexes = sorted(indexes)
+    workers = max(1, min(workers, len(indexes)))
+    chunks = [indexes[i::workers] for i in range(workers)]
+    digests = {}
+    if(workers == 1):
+        digests.update(hash_chunk(indexes))
+    else:
+        with ThreadPoolExecutor(workers) as executor:
+            for chunk_digests in executor.map(hash_chunk, chunks):
+                digests.update(chunk_digests)
+    return digests
+
+
+def check(filename, ranges, recorded, indexes=None, count=None, workers=SEGMENT_WORKERS):
+    """Hash segments of filename again, returning the indexes of those differing from recorded.
+
+Either the given indexes, or count segments picked at random - every segment
+when neither is given.  Raises ValueError when the data is no longer the
+recorded length.
+"""
+    segment_bytes, length, recorded_root, leaves = unpack(recorded)
+    if(sum(finish - start for start, finish in ranges) != length):
+        raise ValueError('%s: audio data is %i bytes, recorded as %i' % (filename, sum(finish - start for start, finish in ranges), length))
+    if(indexes is None):
+        indexes = range(len(leaves))
+        if(count is not None and count < len(leaves)):
+            indexes = random.sample(indexes, count)
+    digests = hash_segments(filename, ranges, indexes, segment_bytes, workers)
+    return sorted(index for index, digest in digests.items() if digest != leaves[index])
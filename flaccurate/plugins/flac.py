@@ -1,29 +1,95 @@
-import hashlib
+import sys
 import audiotools
+import audiotools.decoders
 import mutagen
 from mutagen.flac import FLAC
 
+import flaccurate.dynloader
+
 import logging
-logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
+
+# Streaming plugin - the core hashes the PCM buffers yielded by pcm()
+# (see: flaccurate.dynloader.Plugins)
+API_VERSION = 2
 
 def md5(filename):
-    logging.debug('plugins.flac.md5( %s )', filename)
+    """Calculate MD5 of the decoded audio data.
+
+    Retained for callers of the version 1 interface."""
+    return flaccurate.dynloader.StreamingPlugin('flac', sys.modules[__name__]).md5(filename)
 
-    _md5 = None  # Default return value if nothing happens
 
+def pcm(flac_fh, stream_info):
+    """Yield the decoded audio as signed little endian PCM - the same
+    representation the STREAMINFO md5 signature is calculated over."""
+    logger.debug('plugins.flac.pcm( %s )', flac_fh.name)
+
+    _skip_id3v2(flac_fh)
+    total_samples = _total_samples(flac_fh)
+    decoder = audiotools.decoders.FlacDecoder(flac_fh)
+    stream_info.update(
+        sample_rate=decoder.sample_rate,
+        channels=decoder.channels,
+        bits_per_sample=decoder.bits_per_sample,
+        total_samples=total_samples
+    )
     try:
-        audio_data = audiotools.open(filename).to_pcm()
-    except (audiotools.UnsupportedFile, IOError) as err:
-        logging.error('Failed to open file %s: %s', filename, err)
-    else:
-        _md5 = _md5_audio_data(audio_data)
+        # One flac frame per read, whatever is asked for - gathering them into
+        # larger buffers is the core's business (see: flaccurate.dynloader.coalesce())
+        framelist = decoder.read(audiotools.FRAMELIST_SIZE)
+        while len(framelist) > 0:
+            yield framelist.to_bytes(False, True)
+            framelist = decoder.read(audiotools.FRAMELIST_SIZE)
+    finally:
+        decoder.close()
+
 
-    logging.debug('plugins.flac.md5( %s ): Returning %s', filename, _md5)
-    return _md5
+def encoded_ranges(flac_fh):
+    """The encoded audio frames - everything after the metadata blocks."""
+    _skip_id3v2(flac_fh)
+    if(flac_fh.read(4) != b'fLaC'):
+        raise ValueError('Not a flac stream: %s' % flac_fh.name)
+    last = False
+    while(not last):
+        header = flac_fh.read(4)
+        if(len(header) < 4):
+            raise ValueError('Truncated metadata block in %s' % flac_fh.name)
+        last = bool(header[0] & 0x80)
+        flac_fh.seek(int.from_bytes(header[1:], 'big'), 1)
+    start = flac_fh.tell()
+    finish = flac_fh.seek(0, 2)
+    logger.debug('plugins.flac.encoded_ranges( %s ): Encoded audio %i-%i bytes', flac_fh.name, start, finish)
+    return [(start, finish)]
+
+
+def _skip_id3v2(flac_fh):
+    # Some taggers prepend an ID3v2 tag to the stream, which the decoder
+    # does not expect - mirrors what audiotools.open() does for FlacAudio
+    header = flac_fh.read(10)
+    offset = 0
+    if(len(header) == 10 and header[:3] == b'ID3'):
+        tagsize = ((header[6] & 0x7f) << 21) | ((header[7] & 0x7f) << 14) | ((header[8] & 0x7f) << 7) | (header[9] & 0x7f)
+        offset = 10 + tagsize + (10 if header[5] & (1 << 4) else 0)  # footer flag
+        logger.debug('plugins.flac._skip_id3v2( %s ): ID3v2 tag found - stream starts at %i bytes', flac_fh.name, offset)
+    flac_fh.seek(offset)
+
+
+def _total_samples(flac_fh):
+    # Straight from the STREAMINFO block, which must come first - the decoder
+    # does not expose it.  0 means unknown, as it does in STREAMINFO itself.
+    # Leaves the file where it found it, ready for the decoder.
+    offset = flac_fh.tell()
+    header = flac_fh.read(42)  # fLaC, metadata block header, 34 byte STREAMINFO
+    flac_fh.seek(offset)
+    if(len(header) < 42 or header[:4] != b'fLaC' or header[4] & 0x7f != 0):
+        return None
+    # 20 bits sample rate, 3 bits channels, 5 bits bits per sample, 36 bits total samples
+    return int.from_bytes(header[18:26], 'big') & 0xFFFFFFFFF or None
 
 
 def streaminfo_md5(filename):
-    logging.debug('plugins.flac.streaminfo_md5( %s )', filename)
+    logger.debug('plugins.flac.streaminfo_md5( %s )', filename)
 
     md5 = None
 
@@ -44,23 +110,7 @@ def streaminfo_md5(filename):
         # string of 32 characters.
         md5 = ("%02x" % audiofile.info.md5_signature).rjust(32, '0')
     except mutagen.MutagenError as err:
-        logging.error('Failed to open file: %s', err)
+        logger.error('Failed to open file: %s', err)
 
-    logging.debug('plugins.flac.streaminfo_md5( %s ): Returning %s', filename, str(md5))
+    logger.debug('plugins.flac.streaminfo_md5( %s ): Returning %s', filename, str(md5))
     return md5
-
-
-def _md5_audio_data(audio_data):
-
-    hasher = hashlib.md5()
-
-    def update_md5(audio_data):
-        hasher.update(audio_data)
-
-    try:
-        audiotools.transfer_framelist_data(audio_data, update_md5)
-    except (IOError, ValueError) as e:
-        logging.error('Failed to _md5_audio_data: %s', e.args[0])
-        return None
-    else:
-        return str(hasher.hexdigest())
@@ -1,77 +1,71 @@
-import os
+import sys
 import struct
 import hashlib
 from collections import namedtuple
 
+import flaccurate.dynloader
+import flaccurate.reader
+
 import logging
-logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 # TODO
 # 1.
 # Add fallback to search through entire file for ID3
 # Inspired by: Perl CPAN module (MPEG::ID3v2Tag)
 # http://search.cpan.org/dist/MPEG-ID3v2Tag/lib/MPEG/ID3v2Tag.pm
+# Audio frames are located by sync word regardless of tags (see: FrameIndex),
+# but the md5 range is still only adjusted for ID3 tags at either end
+
+# Streaming plugin - the core reads and hashes the ranges described by
+# audio_ranges() (see: flaccurate.dynloader.Plugins)
+API_VERSION = 2
 
 def md5(filename):
     """Calculate MD5 for an MP3 excluding ID3v1 and ID3v2 tags if
-    present. See www.id3.org for tag format specifications."""
-    logging.debug('plugins.mp3.md5( %s )', filename)
-    _md5 = None
+    present. See www.id3.org for tag format specifications.
+
+    Retained for callers of the version 1 interface."""
+    return flaccurate.dynloader.StreamingPlugin('mp3', sys.modules[__name__]).md5(filename)
 
-    try:
-        mp3_fh = open(filename, "rb")
-    except FileNotFoundError:
-        logging.error('Failed to open %s: Not found', filename)
-        return _md5
+
+def audio_ranges(mp3_fh):
+    filename = mp3_fh.name
 
     # default starting position is complete file
     audiodata = {
-        'start': mp3_fh.tell(),
-        'finish': os.stat(filename).st_size,
+        'start': 0,
+        'finish': mp3_fh.seek(0, 2),
     }
-    logging.debug('plugins.mp3.md5( %s ): Audio range %i-%i bytes', filename, audiodata.get('start'), audiodata.get('finish'))
+    logger.debug('plugins.mp3.audio_ranges( %s ): Audio range %i-%i bytes', filename, audiodata.get('start'), audiodata.get('finish'))
 
-    logging.debug('plugins.mp3.md5( %s ): Checking for ID3v1 tag', filename)
+    logger.debug('plugins.mp3.audio_ranges( %s ): Checking for ID3v1 tag', filename)
     if(_id3v1(mp3_fh, audiodata)):
-        logging.debug('plugins.mp3.md5( %s ): ID3v1 tag header found - range adjusted %i-%i bytes', filename, audiodata.get('start'), audiodata.get('finish'))
+        logger.debug('plugins.mp3.audio_ranges( %s ): ID3v1 tag header found - range adjusted %i-%i bytes', filename, audiodata.get('start'), audiodata.get('finish'))
     else:
-        logging.debug('plugins.mp3.md5( %s ): No ID3v1 tag found', filename)
+        logger.debug('plugins.mp3.audio_ranges( %s ): No ID3v1 tag found', filename)
 
-    logging.debug('plugins.mp3.md5( %s ): Checking for ID3v1 extended tag', filename)
+    logger.debug('plugins.mp3.audio_ranges( %s ): Checking for ID3v1 extended tag', filename)
     if(_id3v1_extended(mp3_fh, audiodata)):
-        logging.debug('plugins.mp3.md5( %s ): ID3v1 extended tag header found - range adjusted %i-%i bytes', filename, audiodata.get('start'), audiodata.get('finish'))
+        logger.debug('plugins.mp3.audio_ranges( %s ): ID3v1 extended tag header found - range adjusted %i-%i bytes', filename, audiodata.get('start'), audiodata.get('finish'))
     else:
-        logging.debug('plugins.mp3.md5( %s ): No ID3v1 extended tag found', filename)
+        logger.debug('plugins.mp3.audio_ranges( %s ): No ID3v1 extended tag found', filename)
 
-    logging.debug('plugins.mp3.md5( %s ): Checking for ID3v2 tag', filename)
+    logger.debug('plugins.mp3.audio_ranges( %s ): Checking for ID3v2 tag', filename)
     if(_id3v2(mp3_fh, audiodata)):
-        logging.debug('plugins.mp3.md5( %s ): ID3v2 tag found - range adjusted %i-%i bytes', filename, audiodata.get('start'), audiodata.get('finish'))
+        logger.debug('plugins.mp3.audio_ranges( %s ): ID3v2 tag found - range adjusted %i-%i bytes', filename, audiodata.get('start'), audiodata.get('finish'))
     else:
-        logging.debug('plugins.mp3.md5( %s ): No ID3v2 tag found', filename)
-
-    # Calculate MD5 using stuff between tags
-    mp3_fh.seek(audiodata.get('start'))
-    _md5 = _md5_audio_data(
-        mp3_fh.read(audiodata.get('finish') - audiodata.get('start')))
-    mp3_fh.close()
-
-    logging.debug('plugins.mp3.md5( %s ): Returning %s', filename, _md5)
-    return _md5
+        logger.debug('plugins.mp3.audio_ranges( %s ): No ID3v2 tag found', filename)
 
-
-def _md5_audio_data(audio_data):
-
-    hasher = hashlib.md5()
-    hasher.update(audio_data)
-
-    return str(hasher.hexdigest())
+    # Audio is the stuff between tags
+    return [(audiodata.get('start'), audiodata.get('finish'))]
 
 
 def _id3v1(mp3_fh, audiodata):
-    logging.debug('plugins.mp3._id3v1()')
+    logger.debug('plugins.mp3._id3v1()')
     has_id3v1 = False
 
     if(audiodata['finish'] < 128):
-        logging.debug(
+        logger.debug(
             'plugins.mp3._id3v1(): File too small to contain ID3v1 tag')
         return has_id3v1
 
@@ -85,11 +79,11 @@ def _id3v1(mp3_fh, audiodata):
 
 
 def _id3v1_extended(mp3_fh, audiodata):
-    logging.debug('plugins.mp3._id3v1_extended()')
+    logger.debug('plugins.mp3._id3v1_extended()')
     has_id3v1_extended = False
 
     if(audiodata['finish'] < 227):
-        logging.debug('plugins.mp3._id3v1_extended(): File too small to contain ID3v1 extended tag')
+        logger.debug('plugins.mp3._id3v1_extended(): File too small to contain ID3v1 extended tag')
         return has_id3v1_extended
 
     # ID3v1 extended stored in 227 bytes before 128 byte ID3v1 tag:
@@ -104,11 +98,11 @@ def _id3v1_extended(mp3_fh, audiodata):
 
 
 def _id3v2(mp3_fh, audiodata):
-    logging.debug('plugins.mp3._id3v2()')
+    logger.debug('plugins.mp3._id3v2()')
     has_id3v2 = False
 
     if(audiodata.get('finish') < 10):
-        logging.debug('plugins.mp3._id3v2(): File too small to contain ID3v2 tag')
+        logger.debug('plugins.mp3._id3v2(): File too small to contain ID3v2 tag')
         return has_id3v2
 
     mp3_fh.seek(0)  # ID3v2 tag header is in first 10 bytes
@@ -122,7 +116,7 @@ def _id3v2(mp3_fh, audiodata):
     id3v2_header_template = namedtuple('id3v2_header_template', 'id3 majorver minorver flags tagsize_synchsafe')
     id3v2_struct_format = '!3s2BBI'  # !: No padding is added when using non-native size and alignment
     id3v2_struct_format_size = struct.calcsize(id3v2_struct_format)
-    #logging.debug('plugins.mp3.md5(): Calculated size of binary unpacking struct (%s) as: %i', id3v2_struct_format, id3v2_struct_format_size)
+    #logger.debug('plugins.mp3.md5(): Calculated size of binary unpacking struct (%s) as: %i', id3v2_struct_format, id3v2_struct_format_size)
 
     header = id3v2_header_template._make(struct.unpack(id3v2_struct_format, mp3_fh.read(id3v2_struct_format_size)))
     #print(header)
@@ -130,15 +124,15 @@ def _id3v2(mp3_fh, audiodata):
     if(header.id3 == "ID3".encode('utf-8')):
         has_id3v2 = True
         ID3v2 = 'ID3v2.' + str(header.majorver)
-        #logging.debug('plugins.mp3._id3v2(): Version %s found', ID3v2)
+        #logger.debug('plugins.mp3._id3v2(): Version %s found', ID3v2)
 
         tagsize = unsynchsafe( header.tagsize_synchsafe )
-        #logging.debug('plugins.mp3.md5(): %s body size %s bytes', ID3v2, str(tagsize))
+        #logger.debug('plugins.mp3.md5(): %s body size %s bytes', ID3v2, str(tagsize))
 
         # Flat bit 4 means footer is present (10 bytes)
         footer = header.flags & (1 << 4)
         if footer:
-            #logging.debug('plugins.mp3._id3v2(): %s footer found +10 bytes', ID3v2)
+            #logger.debug('plugins.mp3._id3v2(): %s footer found +10 bytes', ID3v2)
             tagsize += 10
 
         # Seek to end of ID3v2 tag
@@ -158,3 +152,205 @@ def unsynchsafe(num):
         out |= num & mask
         mask >>= 8
     return out
+
+
+# MPEG audio frame index
+#
+# The md5 covers everything between the ID3 tags - which includes APE tags,
+# Lyrics3 blocks and any trailing junk, so editing those fails verification
+# although not a single audio frame changed.  The md5 cannot change without
+# failing every existing record, so alongside it the frames are indexed, in
+# the same pass: the extent from the first to the last valid MPEG frame, and
+# a digest of each group of frames.  On an md5 mismatch the indexes tell
+# apart changes outside the audio frames from damage within them - and which
+# groups are damaged, so only those need reading again.
+#
+# The index is the 'frames' digest (see: PLUGIN_DIGESTS) - offsets in it are
+# relative to the start of audio_ranges(), so they survive an ID3v2 tag
+# changing size.
+
+# MPEG version / layer from the frame header, see: http://www.mp3-tech.org/programmer/frame_header.html
+MPEG1, MPEG2, MPEG25 = 3, 2, 0
+LAYER1, LAYER2, LAYER3 = 3, 2, 1
+
+BITRATES = {  # kbps by bitrate index 1-14
+    (MPEG1, LAYER1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (MPEG1, LAYER2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (MPEG1, LAYER3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (MPEG2, LAYER1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (MPEG2, LAYER2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (MPEG2, LAYER3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+SAMPLE_RATES = {MPEG1: (44100, 48000, 32000), MPEG2: (22050, 24000, 16000), MPEG25: (11025, 12000, 8000)}
+
+# Frames are grouped into runs of at least this many bytes - around 8 groups
+# for a typical track, keeping the index small
+GROUP_BYTES = 512 * 1024
+
+INDEX_HEADER = struct.Struct('<BIIII')  # version, group bytes, first frame, end of last frame, frames
+INDEX_GROUP = struct.Struct('<II8s')    # start, length, truncated md5
+INDEX_VERSION = 1
+
+
+def frame_length(header):
+    """Length in bytes of the MPEG audio frame with this 4 byte header, None if it is not one."""
+    if(len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0):
+        return None
+
+    version = (header[1] >> 3) & 3
+    layer = (header[1] >> 1) & 3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 3
+    padding = (header[2] >> 1) & 1
+    # Reserved values, and free format (bitrate index 0) which cannot be followed
+    if(version == 1 or layer == 0 or bitrate_index in (0, 15) or sample_rate_index == 3):
+        return None
+
+    bitrate = BITRATES[(MPEG1 if version == MPEG1 else MPEG2, layer)][bitrate_index - 1] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    if(layer == LAYER1):
+        return (12 * bitrate // sample_rate + padding) * 4
+    if(layer == LAYER3 and version != MPEG1):
+        return 72 * bitrate // sample_rate + padding
+    return 144 * bitrate // sample_rate + padding
+
+
+class FrameIndex():
+    """hashlib style interface building the frame index from the audio range.
+
+Fed the same buffers as the md5.  A frame is only accepted where the header
+of the next frame follows it (or the data ends), so sync words inside tags and
+junk are not mistaken for audio.  After junk in the middle the scan finds sync
+again - the extent runs from the first frame to the last.
+"""
+    name = 'frames'
+
+    def __init__(self):
+        self.window = bytearray()
+        self.offset = 0          # of window[0] within the audio range
+        self.next_frame = None   # expected offset of the next frame, None while searching
+        self.first = None
+        self.end = 0
+        self.frames = 0
+        self.groups = []
+        self.group = None        # (start, hasher) of the group being built
+        self.group_length = 0
+
+    def update(self, buffer):
+        self.window += buffer
+        self._scan(final=False)
+
+    def _scan(self, final):
+        window = self.window
+        position = 0
+        while(True):
+            header = window[position:position + 4]
+            if(len(header) < 4 and not final):
+                break  # wait for the rest of the header
+            length = frame_length(header)
+
+            if(length is not None):
+                following = window[position + length:position + length + 4]
+                if(len(following) < 4 and not final):
+                    break  # wait for the header confirming this frame
+                if(position + length > len(window)):
+                    length = None  # truncated - not part of the audio
+                elif(self.next_frame is None and following and frame_length(following) is None):
+                    length = None  # a sync word in junk, not followed by another frame
+
+            if(length is None):
+                # Search on for the next sync word
+                self.next_frame = None
+                position = window.find(0xFF, position + 1)
+                if(position < 0):
+                    position = len(window)
+                    break
+                continue
+
+            self._frame(self.offset + position, window[position:position + length])
+            position += length
+            self.next_frame = self.offset + position
+
+        # Keep only what has not been scanned yet
+        del window[:position]
+        self.offset += position
+
+    def _frame(self, start, data):
+        if(self.first is None):
+            self.first = start
+        if(self.group is None or start != self.end):
+            # A new group at the start, and after any gap in the frames
+            self._close_group()
+            self.group = (start, hashlib.md5())
+        self.group[1].update(data)
+        self.group_length += len(data)
+        self.end = start + len(data)
+        self.frames += 1
+        if(self.group_length >= GROUP_BYTES):
+            self._close_group()
+
+    def _close_group(self):
+        if(self.group is not None):
+            start, hasher = self.group
+            self.groups.append((start, self.group_length, hasher.digest()[:8]))
+        self.group = None
+        self.group_length = 0
+
+    def digest(self):
+        self._scan(final=True)
+        self._close_group()
+        return INDEX_HEADER.pack(INDEX_VERSION, GROUP_BYTES, self.first or 0, self.end, self.frames) + \
+            b''.join(INDEX_GROUP.pack(*group) for group in self.groups)
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+
+# Calculated alongside the md5 for every mp3 (see: flaccurate.dynloader.StreamingPlugin)
+PLUGIN_DIGESTS = {'frames': FrameIndex}
+
+
+def unpack_index(index):
+    """Return ((first, end, frames), [(start, length, digest), ...]) from a hex frame index."""
+    data = bytes.fromhex(index)
+    version, group_bytes, first, end, frames = INDEX_HEADER.unpack_from(data)
+    groups = [INDEX_GROUP.unpack_from(data, offset) for offset in range(INDEX_HEADER.size, len(data), INDEX_GROUP.size)]
+    return (first, end, frames), groups
+
+
+def compare_index(recorded, calculated):
+    """Groups of the recorded frame index which differ from the calculated one.
+
+[] when every frame is unchanged.  None when the two cannot be compared
+group by group - frames were added, removed or resized.  Groups are returned
+at their offsets in the calculated index, that is where they are now.
+"""
+    (recorded_first, recorded_end, recorded_frames), recorded_groups = unpack_index(recorded)
+    (calculated_first, calculated_end, calculated_frames), calculated_groups = unpack_index(calculated)
+    # Junk before the first frame may have changed - compare from the first frame on
+    if(recorded_frames != calculated_frames or recorded_end - recorded_first != calculated_end - calculated_first or
+            [(start - recorded_first, length) for start, length, digest in recorded_groups] !=
+            [(start - calculated_first, length) for start, length, digest in calculated_groups]):
+        return None
+    return [(calculated_start, length, recorded_digest)
+        for (recorded_start, length, recorded_digest), (calculated_start, length, calculated_digest) in zip(recorded_groups, calculated_groups)
+            if recorded_digest != calculated_digest]
+
+
+def recheck_index(filename, groups):
+    """Read just the given frame groups (from compare_index()) again.
+
+Returns (offset in the file, length) of each group still differing from its
+recorded digest.
+"""
+    logger.debug('plugins.mp3.recheck_index( %s, %i groups )', filename, len(groups))
+    differing = []
+    with flaccurate.reader.Reader(filename) as mp3_fh:
+        base = audio_ranges(mp3_fh)[0][0]
+        for start, length, digest in groups:
+            hasher = hashlib.md5()
+            for buffer in flaccurate.reader.iter_range(mp3_fh, base + start, base + start + length):
+                hasher.update(buffer)
+            if(hasher.digest()[:8] != digest):
+                differing.append((base + start, length))
+    return differing
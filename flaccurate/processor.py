@@ -0,0 +1,347 @@
+import os
+import sys
+import time
+
+import filetype as filemagic
+import filetype.utils
+
+import flaccurate
+import flaccurate.dynloader
+import flaccurate.history
+import flaccurate.merkle
+import flaccurate.profiler
+import flaccurate.reader
+import flaccurate.tuning
+
+import logging
+logger = logging.getLogger(__name__)
+
+# The file processing of curate, serve and flaccurate.Library: checksum a
+# file, and verify it against its database record or record it.
+#
+# Each file is processed in two halves (see: process_file()) - checksum_file()
+# does the file I/O and never touches the database, so it can run on worker
+# threads (see: flaccurate.scheduler.run_lanes()), process_checksum() the
+# database work, on the thread the database belongs to.  The outcome of every
+# file is recorded against the run begun with begin_run() (see:
+# flaccurate.history).
+
+
+class Processor():
+    """Checksums files and verifies or records them - see the top of this module.
+
+args are the curate settings (see: flaccurate.library.settings()), plugins
+the plugin registry and db the database - None to checksum and verify
+against digests from elsewhere (see: Curate.process_manifest()), never
+recording anything.
+
+Creating one applies the I/O settings, completed from the host's tuning
+file, to every plugin's file access (see: flaccurate.reader).  Raises
+flaccurate.Usage for a digest which is not supported.
+"""
+    def __init__(self, args, plugins, db=None):
+        self.args = args
+        self.plugins = plugins
+        self.db = db
+        self.digests, self.verify_digest = self._init_digests()
+
+        # Settings not given are taken from the host's calibration (see: selfcheck --calibrate)
+        flaccurate.tuning.apply(self.args)
+
+        # Applies to every plugin's file access (see: flaccurate.reader)
+        flaccurate.reader.configure(
+            direct=self.args.io_direct,
+            bandwidth=self.args.io_limit * 1024 * 1024 if self.args.io_limit else None,
+            buffer_size=self.args.read_buffer * 1024 if self.args.read_buffer else None,
+            read_ahead=self.args.read_ahead
+        )
+        flaccurate.dynloader.configure(
+            pcm_buffer_size=self.args.pcm_buffer * 1024 if getattr(self.args, 'pcm_buffer', None) is not None else None
+        )
+
+        # Files rejected by an earlier run are skipped until they change
+        self.rejects = self.db._retrieve_rejects() if self.db is not None else {}
+        self.rejects_skipped = 0
+
+        # Cost hints measured while processing, recorded by finish_run()
+        self.measured = {}
+        # Segment digests of files to spot check rather than checksum (see: --spot-check)
+        self.segments = {}
+        self.history = None
+
+    def begin_run(self, command):
+        self.history = self.db._begin_run(command)
+        return self.history
+
+    def finish_run(self):
+        if(self.measured):
+            self.db._update_costs(self.measured)
+            self.measured = {}
+        self.db._finish_run(self.history)
+
+    def _init_digests(self):
+        # md5 is always calculated - every existing record has one
+        digests = ['md5']
+        if(self.args.digests is not None):
+            digests += [digest.strip() for digest in self.args.digests.split(',')]
+
+        verify_digest = self.args.verify_digest or 'md5'
+        digests.append(verify_digest)
+
+        available = list(flaccurate.dynloader.DIGESTS) + list(flaccurate.dynloader.PCM_DIGESTS) + list(flaccurate.dynloader.SEGMENT_DIGESTS)
+        for digest in digests:
+            if(digest not in available):
+                raise flaccurate.Usage('Unsupported digest: %s - choose from: %s' % (digest, ', '.join(available)))
+        if(verify_digest not in flaccurate.dynloader.DIGESTS):
+            raise flaccurate.Usage('Unsupported verification digest: %s - choose from: %s' % (verify_digest, ', '.join(flaccurate.dynloader.DIGESTS)))
+
+        digests = list(dict.fromkeys(digests))  # de-duplicate, preserving order
+        logger.info('Calculating digests: %s - verifying with: %s', ', '.join(digests), verify_digest)
+        return digests, verify_digest
+
+    def _calculate_checksum(self, filename, filetype, stream_info=None):
+        logger.debug('_calculate_checksum( %s, %s )', filename, filetype)
+        return self.plugins.plugin(filetype).digests(filename, self.digests, stream_info)
+
+    def known_reject(self, filename):
+        fingerprint = self.rejects.get(os.path.abspath(filename))
+        if(fingerprint is None):
+            return False
+
+        size, mtime_ns, reason, recorded = fingerprint
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False  # let processing report it
+        if((stat.st_size, stat.st_mtime_ns) != (size, mtime_ns)):
+            logger.debug('known_reject( %s ): Changed since rejected - retrying', filename)
+            return False
+
+        logger.debug('known_reject( %s ): Skipping unchanged reject (%s)', filename, reason)
+        self.rejects_skipped += 1
+        return True
+
+    def _reject(self, filename, filetype, outcome):
+        # Only files never recorded - a recorded file that can no
+        # longer be read is damage, and must keep being reported
+        if(self.db._retrieve_file_id(filename) is not None):
+            return
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return
+
+        if(stat.st_size == 0):
+            reason = 'empty'
+        elif(outcome == flaccurate.history.INVALID):
+            reason = 'not a valid %s file' % filetype
+        else:
+            reason = 'undecodable'
+        self.db._insert_reject(filename, reason, stat.st_size, stat.st_mtime_ns)
+
+    def _valid_file(self, filename, filetype):
+        logger.debug('_valid_file( %s, %s )', filename, filetype)
+        # Delegate file validation to the filetype module.
+        # Aliased to filemagic on import - already using a variable
+        # called filetype throughout.
+
+        # The filetype module does file magic checking in pure python,
+        # so no deps or bindings on libmagic or anything else.
+        # Interface is a bit clunky, considered duplicating its validation
+        # logic in each plugin, but placing the one very awkward call here
+        # means it will apply to every supported filetype (read: plugin)
+        # without any additional work.
+        #
+        # 1. Retrieve a filemagic object of the type we want
+        # to validate against.  Bit of a nightmare, as the function:
+        # get_type() compares the "filetype" argument passed in,
+        # against an enumerated list of filetypes, using is().
+        # is() does not play nicely if the filetype argument takes the form
+        # of a key from a dictionary - never matching against what looks like
+        # identical strings.  Need to jump through an intern() hoop to get the
+        # "correct string" for comparison.
+        # 2. Using the filemagic object returned from step one above, via:
+        # get_type() - call it's instance method: match() passing in the
+        # appropriate bytes from the file being tested - this is where the
+        # the magic happens..
+        # The public API is at least helpful here, providing a utility function:
+        # get_signature_bytes(filename)
+        # Return from match() is Boolean, so just pass it back to caller.
+        return filemagic.get_type(None,sys.intern(filetype)).match( filemagic.utils.get_signature_bytes( filename ) )
+
+    def process_file(self, filename, filetype):
+        logger.debug('process_file( %s, %s )', filename, filetype)
+        return self.process_checksum(*self.checksum_file(filename, filetype))
+
+    def checksum_file(self, filename, filetype):
+        # File I/O half of process_file() - never touches the database,
+        # so it is safe to run on scheduler worker threads.
+        # Returns the digests, or the outcome explaining why there are none.
+        logger.debug('checksum_file( %s, %s )', filename, filetype)
+
+        if(not os.path.isfile(filename)):
+            # Only possible for files taken from the database (see: Curate.process_sample())
+            logger.error('%s: %s - Missing', filetype, filename)
+            return filename, filetype, None, flaccurate.history.ERROR
+
+        with flaccurate.profiler.stage('validate', filetype):
+            valid = self._valid_file(filename, filetype)
+        if(not valid):
+            logger.info('Skipping invalid %s: %s', filetype, filename)
+            return filename, filetype, None, flaccurate.history.INVALID
+
+        segments = self.segments.get(os.path.abspath(filename))
+        if( segments is not None ):
+            with flaccurate.profiler.stage('spot check', filetype):
+                return filename, filetype, None, self._spot_check(filename, filetype, segments)
+
+        stream_info = {}
+        started = time.monotonic()
+        with flaccurate.profiler.stage('checksum', filetype):
+            digests_calculated = self._calculate_checksum( filename, filetype, stream_info )
+        if( digests_calculated is None ):
+            logger.error('%s: %s - Failed to calculate checksum', filetype, filename)
+            return filename, filetype, None, flaccurate.history.ERROR
+
+        # Cost hints for the next run's scheduling (see: flaccurate.scheduler.CostModel)
+        self.measured[os.path.abspath(filename)] = (os.path.getsize(filename),
+            stream_info.get('total_samples'), stream_info.get('sample_rate'), stream_info.get('bits_per_sample'),
+            time.monotonic() - started)
+
+        return filename, filetype, digests_calculated, None
+
+    def checksum_failed(self, filename, filetype):
+        # In place of a checksum_file() which raised - so the file still has
+        # an outcome (see: flaccurate.scheduler.run_lanes())
+        return filename, filetype, None, flaccurate.history.ERROR
+
+    def process_checksum(self, filename, filetype, digests_calculated, outcome):
+        # Database half of process_file()
+        with flaccurate.profiler.stage('database', filetype):
+            return self._record_checksum(filename, filetype, digests_calculated, outcome)
+
+    def _record_checksum(self, filename, filetype, digests_calculated, outcome):
+        logger.debug('_record_checksum( %s, %s, %s, %s )', filename, filetype, digests_calculated, outcome)
+
+        if( outcome is not None ):
+            if( outcome == flaccurate.history.ERROR ):
+                outcome = self.check_undecoded(filename, filetype, self.db._retrieve_digests( filename ))
+            if( outcome in (flaccurate.history.INVALID, flaccurate.history.ERROR) ):
+                self._reject(filename, filetype, outcome)
+            return outcome
+
+        if( os.path.abspath(filename) in self.rejects ):
+            # Changed since it was rejected, and can now be read
+            self.db._delete_reject(filename)
+
+        digests_record = self.db._retrieve_digests( filename )
+
+        if( digests_record is not None ):
+            outcome = self.verify(filename, filetype, digests_calculated, digests_record)
+            if( outcome == flaccurate.history.VERIFIED ):
+                # Only a verified file may have its newly enabled digests recorded
+                missing = {name: value for name, value in digests_calculated.items() if name not in digests_record}
+                if( missing ):
+                    self.db._update_digests( filename, missing )
+                # Verified by its frame index, the rest of the file having changed
+                changed = {name: value for name, value in digests_calculated.items() if digests_record.get(name, value) != value}
+                if( changed ):
+                    self.db._replace_digests( filename, changed )
+            return outcome
+        else:
+            logger.debug('process_checksum( %s, %s ): Inserting checksum (%s)', filename, filetype, digests_calculated)
+            self.db._insert_checksum(dict(digests_calculated,
+                filename=filename,
+                filetype=filetype
+            ))
+            return flaccurate.history.INSERTED
+
+    def verify(self, filename, filetype, digests_calculated, digests_record):
+        # Verify with the authoritative digest once the record has one,
+        # until then with md5 - which every record has
+        digest = self.verify_digest
+        if( digest not in digests_record or digest not in digests_calculated ):
+            digest = 'md5'
+
+        if( digests_calculated[digest] == digests_record[digest] ):
+            logger.debug('verify( %s, %s ): Checksum verified (%s %s)', filename, filetype, digest, digests_calculated[digest])
+            return flaccurate.history.VERIFIED
+        elif( 'frames' in digests_record and 'frames' in digests_calculated ):
+            return self._verify_frames(filename, filetype, digests_calculated['frames'], digests_record['frames'])
+        elif( 'segments' in digests_record and 'segments' in digests_calculated ):
+            return self._verify_segments(filename, filetype, digests_calculated['segments'], digests_record['segments'])
+        else:
+            logger.warning('%s: %s - Failed %s checksum (Current: %s Previous: %s)', filetype, filename, digest, digests_calculated[digest], digests_record[digest])
+            return flaccurate.history.FAILED
+
+    def _verify_frames(self, filename, filetype, frames_calculated, frames_record):
+        # Narrow a mismatch down with the frame index (see: flaccurate.plugins.mp3)
+        module = self.plugins.plugin(filetype).module
+        groups = module.compare_index(frames_record, frames_calculated)
+        if( groups is None ):
+            logger.warning('%s: %s - Failed checksum (audio frames added, removed or resized)', filetype, filename)
+            return flaccurate.history.FAILED
+        if( not groups ):
+            logger.warning('%s: %s - Audio frames unchanged, only data outside them differs - updating record', filetype, filename)
+            return flaccurate.history.VERIFIED
+
+        # Read the differing groups again to rule out a bad read
+        try:
+            differing = module.recheck_index(filename, groups)
+        except (IOError, ValueError) as e:
+            logger.error('%s: %s - Failed to re-read: %s', filetype, filename, e)
+            return flaccurate.history.ERROR
+        if( not differing ):
+            logger.error('%s: %s - Checksum differed but the differing frames re-read unchanged - unreliable read', filetype, filename)
+            return flaccurate.history.ERROR
+        logger.warning('%s: %s - Failed checksum (audio frames differ at bytes %s)', filetype, filename,
+            ', '.join('%i-%i' % (offset, offset + length) for offset, length in differing))
+        return flaccurate.history.FAILED
+
+    def _verify_segments(self, filename, filetype, segments_calculated, segments_record):
+        # Narrow a mismatch down to the changed segments (see: flaccurate.merkle)
+        indexes = flaccurate.merkle.compare(segments_record, segments_calculated)
+        if( not indexes ):
+            # Resized, or the audio hashed differently with the data unchanged
+            logger.warning('%s: %s - Failed checksum (%s)', filetype, filename,
+                'audio data resized' if indexes is None else 'segments unchanged')
+            return flaccurate.history.FAILED
+        return self._check_segments(filename, filetype, segments_record, indexes=indexes)
+
+    def check_undecoded(self, filename, filetype, digests_record):
+        # Damage inside an encoded frame fails decoding (flac frame CRCs)
+        # before any digest is compared - the recorded segments tell whether
+        # the audio data changed, or the file could not be read as it was
+        if( digests_record is None or 'segments' not in digests_record or not os.path.isfile(filename) ):
+            return flaccurate.history.ERROR
+        if( self._check_segments(filename, filetype, digests_record['segments']) == flaccurate.history.FAILED ):
+            return flaccurate.history.FAILED
+        logger.error('%s: %s - Segments unchanged, but the file could not be checksummed', filetype, filename)
+        return flaccurate.history.ERROR
+
+    def _spot_check(self, filename, filetype, segments):
+        # In place of the digests - runs on worker threads like checksum_file()
+        count = self.args.spot_check or None
+        logger.debug('_spot_check( %s, %s, %s segments )', filename, filetype, count or 'all')
+        return self._check_segments(filename, filetype, segments, count=count)
+
+    def _check_segments(self, filename, filetype, segments, indexes=None, count=None):
+        try:
+            differing = self.plugins.plugin(filetype).check_segments(filename, segments, indexes, count)
+        except (IOError, ValueError) as e:
+            logger.warning('%s: %s - Failed segment check: %s', filetype, filename, e)
+            return flaccurate.history.FAILED
+        if( not differing ):
+            if( indexes is not None ):
+                logger.error('%s: %s - Checksum differed but the differing segments re-read unchanged - unreliable read', filetype, filename)
+                return flaccurate.history.ERROR
+            return flaccurate.history.VERIFIED
+        segment_bytes = flaccurate.merkle.unpack(segments)[0]
+        logger.warning('%s: %s - Failed checksum (segments %s of %i bytes differ)', filetype, filename,
+            ', '.join(str(index) for index in differing), segment_bytes)
+        return flaccurate.history.FAILED
+
+    def record_outcome(self, filename, outcome):
+        # Files without a database record only count towards the run totals
+        self.history.record(outcome, self.db._retrieve_file_id(filename))
+
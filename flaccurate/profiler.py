@@ -0,0 +1,207 @@
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+from collections import Counter
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Profiling of a whole command (see: --profile).
+#
+# sample         a background thread records the stack of every busy thread
+#                SAMPLE_INTERVAL apart - a few percent overhead, fit for
+#                production runs, and covers the scheduler's worker threads.
+#                Written as collapsed stacks (<output>.collapsed) - one
+#                'frame;frame;... count' line per stack, as read by
+#                flamegraph.pl, speedscope and the like.
+# deterministic  cProfile, every call of the main thread counted - exact, but
+#                slows processing down several times.  Written as pstats
+#                (<output>.pstats); run with the default --schedule glob so
+#                files are processed on the main thread.
+#
+# Either way the time spent in each stage of processing is accounted per
+# plugin (see: stage()) and summarised with the hot spots in <output>.txt.
+# --profile-memory adds tracemalloc: the most memory each stage took on top
+# of what was in use when it started (exact with a single worker, as threads
+# share the measurement), overall peak, and the allocations still held at the
+# end grouped by plugin and by source line.
+
+SAMPLE_INTERVAL = 0.005
+MODES = ('sample', 'deterministic')
+DEFAULT_OUTPUT = 'flaccurate-profile'
+
+# How many functions / allocation sites the report lists
+REPORT_TOP = 25
+
+_active = None
+_no_stage = contextlib.nullcontext()
+
+
+def stage(name, plugin=None):
+    """Context manager accounting the time within it to a processing stage.
+
+Costs next to nothing while no profile is running.
+"""
+    if(_active is None):
+        return _no_stage
+    return _active.stage(name, plugin)
+
+
+class Profiler():
+    """Profiles everything run within it - see the top of this module."""
+    def __init__(self, mode='sample', memory=False, output=None):
+        if(mode not in MODES):
+            raise ValueError('Unknown profile mode: %s' % mode)
+        self.mode = mode
+        self.memory = memory
+        self.output = output or DEFAULT_OUTPUT
+        self.stages = {}    # (stage, plugin): [calls, seconds, longest, most memory]
+        self.current = {}   # thread id: label of the stage it is in
+        self.samples = Counter()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def __enter__(self):
+        global _active
+        if(self.memory):
+            tracemalloc.start()
+        if(self.mode == 'deterministic'):
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.sampler = threading.Thread(target=self._sample, name='flaccurate-profiler', daemon=True)
+            self.sampler.start()
+        self.started = time.perf_counter()
+        _active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        _active = None
+        self.elapsed = time.perf_counter() - self.started
+        if(self.mode == 'deterministic'):
+            self.profile.disable()
+        else:
+            self.stopping.set()
+            self.sampler.join()
+        if(self.memory):
+            self.snapshot = tracemalloc.take_snapshot()
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.write()
+        return False
+
+    @contextlib.contextmanager
+    def stage(self, name, plugin=None):
+        thread = threading.get_ident()
+        previous = self.current.get(thread)
+        self.current[thread] = '%s:%s' % (name, plugin) if plugin else name
+        if(self.memory):
+            tracemalloc.reset_peak()
+            in_use = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            memory = tracemalloc.get_traced_memory()[1] - in_use if self.memory else 0
+            if(previous is None):
+                del self.current[thread]
+            else:
+                self.current[thread] = previous
+            with self.lock:
+                accounted = self.stages.setdefault((name, plugin), [0, 0.0, 0.0, 0])
+                accounted[0] += 1
+                accounted[1] += seconds
+                accounted[2] = max(accounted[2], seconds)
+                accounted[3] = max(accounted[3], memory)
+
+    def _sample(self):
+        # Threads outside any stage are idle workers, or this one - only the
+        # main thread is sampled regardless
+        main = threading.main_thread().ident
+        sampler = threading.get_ident()
+        while(not self.stopping.wait(SAMPLE_INTERVAL)):
+            for thread, frame in sys._current_frames().items():
+                label = self.current.get(thread)
+                if(thread == sampler or (label is None and thread != main)):
+                    continue
+                stack = []
+                while(frame is not None):
+                    stack.append('%s:%s' % (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                    frame = frame.f_back
+                stack.append(label or 'other')
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self):
+        report = [
+            'flaccurate profile: %s, %.1fs' % (self.mode, self.elapsed),
+            '',
+            '%-12s %-8s %8s %10s %10s %10s %10s' % ('stage', 'plugin', 'calls', 'total s', 'mean ms', 'max ms', 'max MB'),
+        ]
+        for (name, plugin), (calls, seconds, longest, memory) in sorted(self.stages.items(), key=lambda item: item[1][1], reverse=True):
+            report.append('%-12s %-8s %8i %10.2f %10.2f %10.2f %10s' % (name, plugin or '-', calls, seconds, 1000 * seconds / calls, 1000 * longest,
+                '%.1f' % (memory / (1024 * 1024)) if self.memory else '-'))
+
+        if(self.mode == 'deterministic'):
+            filename = self.output + '.pstats'
+            self.profile.dump_stats(filename)
+            report += ['', 'Hot spots (internal time):']
+            report += [line for line in self._pstats_lines() if line.strip()]
+        else:
+            filename = self.output + '.collapsed'
+            with open(filename, 'w') as fileh:
+                for stack, count in sorted(self.samples.items()):
+                    fileh.write('%s %i\n' % (stack, count))
+            report += ['', 'Hot spots (%i samples, %gms apart - share of samples with the function running):' % (sum(self.samples.values()), 1000 * SAMPLE_INTERVAL)]
+            report += self._sample_lines()
+
+        if(self.memory):
+            report += ['', 'Memory: peak %.1f MB traced' % (self.peak / (1024 * 1024)), '', 'Held at the end, by plugin:']
+            report += self._memory_lines()
+
+        with open(self.output + '.txt', 'w') as fileh:
+            fileh.write('\n'.join(report) + '\n')
+        logger.info('Profile written to %s.txt and %s', self.output, filename)
+
+    def _pstats_lines(self):
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).strip_dirs().sort_stats('tottime').print_stats(REPORT_TOP)
+        return stream.getvalue().splitlines()
+
+    def _sample_lines(self):
+        total = sum(self.samples.values()) or 1
+        leaves = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(';')
+            leaves['%-20s %s' % (frames[0], frames[-1])] += count
+        return ['%6.1f%%  %s' % (100.0 * count / total, leaf) for leaf, count in leaves.most_common(REPORT_TOP)]
+
+    def _memory_lines(self):
+        statistics = self.snapshot.statistics('lineno')
+        plugins = Counter()
+        for statistic in statistics:
+            plugins[_owner(statistic.traceback[0].filename)] += statistic.size
+        lines = ['%10.1f KB  %s' % (size / 1024, owner) for owner, size in plugins.most_common()]
+        lines += ['', 'Held at the end, by line:']
+        lines += ['%10.1f KB  %s:%i' % (statistic.size / 1024, statistic.traceback[0].filename, statistic.traceback[0].lineno)
+            for statistic in statistics[:REPORT_TOP]]
+        return lines
+
+
+def _owner(filename):
+    # Which plugin, or library, a source file belongs to
+    parts = filename.split(os.sep)
+    if('plugins' in parts and 'flaccurate' in parts):
+        return 'plugin ' + os.path.splitext(parts[-1])[0]
+    if('site-packages' in parts):
+        return parts[parts.index('site-packages') + 1].split('.')[0]
+    if('flaccurate' in parts):
+        return 'flaccurate'
+    return 'other'
@@ -0,0 +1,222 @@
+import io
+import os
+import mmap
+import time
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Shared file reader used by every plugin, so page cache behaviour and I/O
+# limits are decided in one place rather than per plugin.
+#
+# 1. posix_fadvise(SEQUENTIAL) on open - ask the kernel for aggressive read-ahead
+# 2. posix_fadvise(DONTNEED) on close - drop the file from the page cache, a full
+#    curate streams the whole library through it and would otherwise evict
+#    everything else on the machine
+# 3. Optional O_DIRECT - bypass the page cache entirely, reading through a page
+#    aligned buffer in multiples of DIRECT_ALIGNMENT
+# 4. Optional bandwidth cap - shared by every Reader in the process
+# 5. Optional read-ahead depth - posix_fadvise(WILLNEED) kept that many
+#    buffers ahead of the position, for storage the kernel's own read-ahead
+#    does not keep busy (see: flaccurate.tuning)
+
+DIRECT_ALIGNMENT = 4096
+DIRECT_BUFFER_SIZE = 1024 * 1024  # must be a multiple of DIRECT_ALIGNMENT
+
+_config = {
+    'direct': False,
+    'throttle': None,
+    'buffer_size': 1024 * 1024,
+    'read_ahead': 0,
+}
+DEFAULT_BUFFER_SIZE = _config['buffer_size']
+
+
+def configure(direct=False, bandwidth=None, buffer_size=None, read_ahead=None):
+    """Set process wide reader options.
+
+direct:      use O_DIRECT where the platform and filesystem support it
+bandwidth:   cap on the combined read rate of every Reader in bytes per second
+buffer_size: bytes read at a time by iter_range()
+read_ahead:  buffers to ask the kernel to read ahead of the position, 0 to
+             leave it to the kernel
+"""
+    logger.debug('reader.configure( direct=%s, bandwidth=%s, buffer_size=%s, read_ahead=%s )', direct, bandwidth, buffer_size, read_ahead)
+    _config['direct'] = direct and hasattr(os, 'O_DIRECT')
+    _config['throttle'] = Throttle(bandwidth) if bandwidth else None
+    _config['buffer_size'] = buffer_size or DEFAULT_BUFFER_SIZE
+    _config['read_ahead'] = read_ahead or 0
+
+    if(direct and not _config['direct']):
+        logger.warning('O_DIRECT is not supported on this platform - using buffered reads')
+
+
+class Throttle():
+    """Token bucket limiting the combined read rate across threads."""
+    def __init__(self, rate):
+        self.rate = rate
+        self.allowance = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+        with self.lock:
+            now = time.monotonic()
+            # Allow at most one second worth of burst
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= size
+            delay = -self.allowance / self.rate if self.allowance < 0 else 0
+
+        if(delay > 0):
+            time.sleep(delay)
+
+
+class Reader(io.RawIOBase):
+    """Read only, seekable file object with page cache hints applied.
+
+Raises the same exceptions as the builtin open() (FileNotFoundError etc.)
+"""
+    def __init__(self, filename):
+        super().__init__()
+        self.name = filename
+        self.throttle = _config['throttle']
+        self.direct = False
+        self.position = 0
+        self.advised = 0
+        self.read_ahead = _config['read_ahead'] * _config['buffer_size'] if hasattr(os, 'posix_fadvise') else 0
+        self.fd = None
+
+        self.fd = os.open(filename, os.O_RDONLY)
+        if(_config['direct']):
+            self._enable_direct()
+
+        self.size = os.fstat(self.fd).st_size
+        self._advise('POSIX_FADV_SEQUENTIAL')
+
+    def _enable_direct(self):
+        try:
+            fd = os.open(self.name, os.O_RDONLY | os.O_DIRECT)
+        except OSError as e:
+            # Not every filesystem supports O_DIRECT (tmpfs, some FUSE/network filesystems)
+            logger.debug('reader.Reader( %s ): O_DIRECT unavailable: %s', self.name, e)
+            return
+
+        os.close(self.fd)
+        self.fd = fd
+        self.direct = True
+        # Anonymous mmap is always page aligned, satisfying O_DIRECT buffer alignment
+        self.buffer = mmap.mmap(-1, DIRECT_BUFFER_SIZE)
+        self.buffer_offset = 0
+        self.buffer_length = 0
+
+    def _advise(self, advice):
+        if(hasattr(os, 'posix_fadvise')):
+            try:
+                os.posix_fadvise(self.fd, 0, 0, getattr(os, advice))
+            except OSError as e:
+                logger.debug('reader.Reader( %s ): %s failed: %s', self.name, advice, e)
+
+    def _read_ahead(self):
+        # Renewed each time half the window has been read
+        try:
+            os.posix_fadvise(self.fd, self.position, self.read_ahead, os.POSIX_FADV_WILLNEED)
+        except OSError as e:
+            logger.debug('reader.Reader( %s ): POSIX_FADV_WILLNEED failed: %s', self.name, e)
+        self.advised = self.position + self.read_ahead
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if(whence == io.SEEK_SET):
+            position = offset
+        elif(whence == io.SEEK_CUR):
+            position = self.position + offset
+        elif(whence == io.SEEK_END):
+            position = self.size + offset
+        else:
+            raise ValueError('Invalid whence (%r)' % whence)
+
+        if(position < 0):
+            raise OSError(22, 'Invalid argument')
+        self.position = position
+        return position
+
+    def readinto(self, b):
+        if(self.direct):
+            count = self._readinto_direct(b)
+        else:
+            if(self.read_ahead and self.position + self.read_ahead // 2 >= self.advised):
+                self._read_ahead()
+            count = os.preadv(self.fd, [b], self.position)
+
+        self.position += count
+        if(self.throttle is not None and count):
+            self.throttle.consume(count)
+        return count
+
+    def _readinto_direct(self, b):
+        # Serve from the aligned buffer, refilling it from an aligned offset when
+        # the requested position falls outside it
+        start = self.position - self.buffer_offset
+        if(start < 0 or start >= self.buffer_length):
+            self.buffer_offset = self.position - (self.position % DIRECT_ALIGNMENT)
+            self.buffer_length = os.preadv(self.fd, [self.buffer], self.buffer_offset)
+            start = self.position - self.buffer_offset
+            if(start >= self.buffer_length):
+                return 0  # EOF
+
+        count = min(len(b), self.buffer_length - start)
+        b[:count] = self.buffer[start:start + count]
+        return count
+
+    def read(self, size=-1):
+        # Unlike RawIOBase.read() keep reading until size bytes or EOF -
+        # plugins expect file semantics, not a single short read
+        if(size is None or size < 0):
+            size = max(self.size - self.position, 0)
+
+        data = bytearray(size)
+        view = memoryview(data)
+        total = 0
+        while(total < size):
+            count = self.readinto(view[total:])
+            if(not count):
+                break
+            total += count
+        del view
+        del data[total:]
+        return bytes(data)
+
+    def close(self):
+        if(not self.closed and self.fd is not None):
+            self._advise('POSIX_FADV_DONTNEED')
+            os.close(self.fd)
+            if(self.direct):
+                self.buffer.close()
+        super().close()
+
+
+def iter_range(fileobj, start, finish):
+    """Yield the bytes of fileobj between start and finish in buffer sized pieces.
+
+The same buffer is reused for every piece - each must be consumed (hashed)
+before asking for the next.
+"""
+    buffer = memoryview(bytearray(_config['buffer_size']))
+    fileobj.seek(start)
+    remaining = finish - start
+    while(remaining > 0):
+        count = fileobj.readinto(buffer[:min(remaining, len(buffer))])
+        if(not count):
+            raise IOError('Unexpected end of file at %i bytes reading %s' % (fileobj.tell(), fileobj.name))
+        remaining -= count
+        yield buffer[:count]
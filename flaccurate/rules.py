@@ -0,0 +1,116 @@
+import os
+import re
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Include / exclude rules for the library walk, in gitignore syntax:
+#
+#   @eaDir/          a directory of that name anywhere - trailing / matches
+#                    directories only
+#   Samples/*.mp3    anchored to the library root by the / inside it - a
+#                    leading / anchors a single name
+#   **/Scans         ** matches any number of directories
+#   *.part           * and ? match within a name, [...] a set of characters
+#   !keep.flac       re-include something an earlier rule excluded
+#
+# The last rule matching a path decides.  An excluded directory is pruned -
+# never read, nor anything below it - so, as with git, nothing below it can be
+# included again.
+#
+# Rules come from IGNORE_FILE at the library root, then --exclude, then
+# --include - each --include being a rule with ! in front.
+
+IGNORE_FILE = '.flaccurate-ignore'
+
+
+def translate(pattern):
+    """Regular expression matching the paths, relative to the root, a (non negated) pattern matches."""
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+
+    expression = ''
+    i = 0
+    while(i < len(pattern)):
+        if(pattern.startswith('**/', i)):
+            expression += '(?:.*/)?'
+            i += 3
+        elif(pattern.startswith('**', i)):
+            expression += '.*'
+            i += 2
+        elif(pattern[i] == '*'):
+            expression += '[^/]*'
+            i += 1
+        elif(pattern[i] == '?'):
+            expression += '[^/]'
+            i += 1
+        elif(pattern[i] == '[' and ']' in pattern[i + 2:]):
+            end = pattern.index(']', i + 2)
+            characters = pattern[i + 1:end]
+            if(characters.startswith('!')):
+                characters = '^' + characters[1:]
+            expression += '[' + characters.replace('\\', '\\\\') + ']'
+            i = end + 1
+        else:
+            expression += re.escape(pattern[i])
+            i += 1
+
+    if(not anchored):
+        expression = '(?:.*/)?' + expression
+    return re.compile(expression)
+
+
+class Rules():
+    """Compiled include / exclude rules - see the top of this module for the syntax."""
+    def __init__(self, patterns):
+        self.rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if(not pattern or pattern.startswith('#')):
+                continue
+            include = pattern.startswith('!')
+            pattern = pattern[1:] if include else pattern
+            directory_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if(pattern):
+                self.rules.append((translate(pattern), include, directory_only))
+        # Searched from the last rule back - the first match decides
+        self.rules.reverse()
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def excluded(self, relative, is_directory=False):
+        """Whether the path relative to the library root is excluded by the rules themselves."""
+        for expression, include, directory_only in self.rules:
+            if(directory_only and not is_directory):
+                continue
+            if(expression.fullmatch(relative)):
+                return not include
+        return False
+
+    def pruned(self, relative, is_directory=False):
+        """Whether a path relative to the library root is left out of the walk - itself or any directory above it excluded."""
+        parts = relative.split(os.sep)
+        for depth in range(1, len(parts)):
+            if(self.excluded('/'.join(parts[:depth]), True)):
+                return True
+        return self.excluded('/'.join(parts), is_directory)
+
+
+def load(root, exclude=None, include=None):
+    """Rules for the library at root: IGNORE_FILE there, then the exclude and include patterns."""
+    patterns = []
+    ignore_file = os.path.join(root, IGNORE_FILE)
+    try:
+        with open(ignore_file) as fileh:
+            patterns += fileh.read().splitlines()
+        logger.info('Path rules read from %s', ignore_file)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning('Failed to read %s: %s', ignore_file, e)
+
+    patterns += exclude or []
+    patterns += ['!' + pattern for pattern in include or []]
+    return Rules(patterns)
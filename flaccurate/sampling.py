@@ -0,0 +1,87 @@
+import math
+import random
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Stratified random sampling of database records for curate --sample.
+#
+# Files are grouped into strata (top level directory, format, size class) and
+# the sample is allocated across strata in proportion to their size, so a
+# small sample still covers every part of the library that is large enough to
+# deserve a share.  Every file in a stratum is equally likely to be drawn, and
+# with proportional allocation the pooled failure rate is an unbiased estimate
+# of the library wide rate.
+
+# Size classes by order of magnitude - roughly: short tracks / whole mp3
+# albums / flac tracks / long flac mixes and single file albums
+SIZE_CLASSES = (1024 * 1024, 16 * 1024 * 1024, 128 * 1024 * 1024)
+
+# 95% confidence
+Z_95 = 1.959964
+
+
+def size_class(size):
+    """Index into SIZE_CLASSES of the first class size fits, None when unknown."""
+    if(size is None):
+        return None
+    for i, limit in enumerate(SIZE_CLASSES):
+        if(size < limit):
+            return i
+    return len(SIZE_CLASSES)
+
+
+def stratify(items, key):
+    """Group items into {stratum: [item, ...]} by key(item)."""
+    strata = {}
+    for item in items:
+        strata.setdefault(key(item), []).append(item)
+    return strata
+
+
+def allocate(sizes, n):
+    """Split a sample of n across strata of the given {stratum: size}.
+
+Proportional allocation by largest remainder - the shares always sum to
+min(n, total) and no stratum is allocated more than it holds.
+"""
+    total = sum(sizes.values())
+    if(n >= total):
+        return dict(sizes)
+
+    shares = {stratum: n * size / total for stratum, size in sizes.items()}
+    allocation = {stratum: int(share) for stratum, share in shares.items()}
+    remainders = sorted(shares, key=lambda stratum: shares[stratum] - allocation[stratum], reverse=True)
+    for stratum in remainders[:n - sum(allocation.values())]:
+        allocation[stratum] += 1
+    return allocation
+
+
+def draw(strata, n, rng=random):
+    """Draw a stratified sample of n items from {stratum: [item, ...]}.
+
+The sample is returned shuffled, so that a run cut short (by a time budget)
+has still checked a spread of every stratum rather than the first few in full.
+"""
+    allocation = allocate({stratum: len(items) for stratum, items in strata.items()}, n)
+    sample = []
+    for stratum, count in allocation.items():
+        sample += rng.sample(strata[stratum], count)
+    rng.shuffle(sample)
+    return sample
+
+
+def wilson_interval(failures, n, z=Z_95):
+    """Wilson score interval (low, high) for a proportion of failures out of n.
+
+Unlike the normal approximation it stays inside [0, 1] and gives a useful
+upper bound when no failures at all are seen, which is the usual case.
+"""
+    if(n == 0):
+        return 0.0, 1.0
+
+    p = failures / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    spread = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, centre - spread), min(1.0, centre + spread)
@@ -0,0 +1,245 @@
+import os
+import queue
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows - layout ordering falls back to inode
+    fcntl = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Linux FIEMAP ioctl - see: linux/fiemap.h
+# struct fiemap is a 32 byte header followed by fm_extent_count 56 byte extents
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = '=QQIIII'     # fm_start fm_length fm_flags fm_mapped_extents fm_extent_count fm_reserved
+FIEMAP_EXTENT = '=QQQ2QI3I'   # fe_logical fe_physical fe_length fe_reserved64[2] fe_flags fe_reserved[3]
+FIEMAP_MAX_OFFSET = 0xFFFFFFFFFFFFFFFF
+
+# Seconds a worker waits on a full result queue before checking whether the
+# consumer has stopped (see: run_lanes())
+STOP_POLL = 0.1
+
+
+def physical_offset(filename):
+    """Physical byte offset of the first extent of filename, or None.
+
+None when FIEMAP is unsupported (non Linux, network filesystems, some FUSE
+filesystems) or the file has no extents (empty or inline data).
+"""
+    if(fcntl is None):
+        return None
+
+    request = bytearray(struct.pack(FIEMAP_HEADER, 0, FIEMAP_MAX_OFFSET, 0, 0, 1, 0) + bytes(struct.calcsize(FIEMAP_EXTENT)))
+    try:
+        with open(filename, 'rb') as fileh:
+            fcntl.ioctl(fileh.fileno(), FS_IOC_FIEMAP, request, True)
+    except OSError as e:
+        logger.debug('scheduler.physical_offset( %s ): FIEMAP unavailable: %s', filename, e)
+        return None
+
+    mapped_extents = struct.unpack_from(FIEMAP_HEADER, request)[3]
+    if(mapped_extents == 0):
+        return None
+    return struct.unpack_from(FIEMAP_EXTENT, request, struct.calcsize(FIEMAP_HEADER))[1]
+
+
+def device_lanes(work):
+    """Split (filename, filetype) work into one lane per device (st_dev).
+
+Each lane is ordered by the physical offset of the file's first extent where
+FIEMAP reports one, otherwise by inode number - which on most filesystems
+correlates with allocation order - so a lane approximates a sequential sweep
+of its device.
+"""
+    lanes = {}
+    for filename, filetype in work:
+        try:
+            stat = os.stat(filename)
+        except OSError as e:
+            # Leave it to the plugin to report - it will fail the same way
+            logger.debug('scheduler.device_lanes(): Failed to stat %s: %s', filename, e)
+            lanes.setdefault(None, []).append(((-1, 0), filename, filetype))
+            continue
+
+        offset = physical_offset(filename)
+        layout = (offset if offset is not None else -1, stat.st_ino)
+        lanes.setdefault(stat.st_dev, []).append((layout, filename, filetype))
+
+    for device, lane in lanes.items():
+        logger.info('Scheduled %i files on device %s', len(lane), device)
+
+    return [[(filename, filetype) for layout, filename, filetype in sorted(lane)] for lane in lanes.values()]
+
+
+def run_lanes(lanes, worker, workers_per_lane=1, queue_size=64, failed=None):
+    """Run worker(*item) for every item in every lane, yielding results as they complete.
+
+Each lane gets its own thread(s) - workers_per_lane threads pull from the same
+lane in order.  Results are handed back to the calling thread, which is the
+only one touching the database.  The bounded queue stops the workers from
+racing ahead of a slow consumer.
+
+An item the worker raises on is logged, and failed(*item) yielded in place
+of its result - nothing when failed is None.
+
+Closing the generator (or it being garbage collected) before the end stops
+the workers - each finishes the item in hand, and takes no other.
+"""
+    results = queue.Queue(queue_size)
+    finished = object()
+    stopped = threading.Event()
+
+    def put(result):
+        # Nothing takes results once the consumer has stopped
+        while(not stopped.is_set()):
+            try:
+                results.put(result, timeout=STOP_POLL)
+                return
+            except queue.Full:
+                pass
+
+    def drain(items, lock):
+        try:
+            while(not stopped.is_set()):
+                with lock:
+                    item = next(items, None)
+                if(item is None):
+                    break
+                try:
+                    result = worker(*item)
+                except Exception:
+                    # One bad file must not take the rest of the lane with it
+                    logger.exception('scheduler.run_lanes(): Worker failed on %s', item)
+                    if(failed is None):
+                        continue
+                    result = failed(*item)
+                put(result)
+        finally:
+            put(finished)
+
+    threads = []
+    for lane in lanes:
+        items = iter(lane)
+        lock = threading.Lock()
+        for i in range(workers_per_lane):
+            threads.append(threading.Thread(target=drain, args=(items, lock), name='run_lanes-%i' % len(threads), daemon=True))
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        remaining = len(threads)
+        while(remaining):
+            result = results.get()
+            if(result is finished):
+                remaining -= 1
+            else:
+                yield result
+    finally:
+        stopped.set()
+
+
+class CostModel():
+    """Estimated processing time of files, from cost hints recorded by earlier runs.
+
+hints: {filename: (size, total_samples, sample_rate, bits_per_sample, seconds)}
+(see: Database._retrieve_costs())
+
+Decoding costs in proportion to the audio decoded rather than to the bytes
+read, so a file with STREAMINFO hints is estimated from its decoded PCM
+bytes, at the decode rate measured across every file of its filetype with
+them.  Any other file measured before is expected to take that long again.
+Anything else is estimated from its size, at the byte rate measured across
+its filetype - across every file when there is none, DEFAULT_RATE before
+there is any measured file at all.
+"""
+    DEFAULT_RATE = 32 * 1024 * 1024  # bytes per second
+
+    def __init__(self, hints):
+        self.hints = hints
+        pcm, measured = {}, {}
+        for filename, (size, total_samples, sample_rate, bits_per_sample, seconds) in hints.items():
+            if(not seconds):
+                continue
+            filetype = _filetype(filename)
+            if(total_samples and bits_per_sample):
+                pcm.setdefault(filetype, []).append((_pcm_bytes(total_samples, bits_per_sample), seconds))
+            if(size):
+                measured.setdefault(filetype, []).append((size, seconds))
+
+        self.decode_rates = {filetype: _rate(costs) for filetype, costs in pcm.items()}
+        self.rates = {filetype: _rate(costs) for filetype, costs in measured.items()}
+        self.rate = _rate([cost for costs in measured.values() for cost in costs]) or self.DEFAULT_RATE
+
+    def estimate(self, filename, filetype=None):
+        filetype = filetype or _filetype(filename)
+        hint = self.hints.get(filename)
+        if(hint is not None):
+            size, total_samples, sample_rate, bits_per_sample, seconds = hint
+            decode_rate = self.decode_rates.get(filetype)
+            if(total_samples and bits_per_sample and decode_rate):
+                return _pcm_bytes(total_samples, bits_per_sample) / decode_rate
+            if(seconds):
+                return seconds
+        else:
+            size = None
+
+        if(size is None):
+            try:
+                size = os.stat(filename).st_size
+            except OSError:
+                size = 0
+        return size / (self.rates.get(filetype) or self.rate)
+
+
+def _filetype(filename):
+    return os.path.splitext(filename)[1][1:]
+
+
+def _pcm_bytes(total_samples, bits_per_sample):
+    # Per channel - the channel count is not among the hints
+    return total_samples * bits_per_sample // 8
+
+
+def _rate(costs):
+    # Amount per second over (amount, seconds) - None without any
+    seconds = sum(seconds for amount, seconds in costs)
+    return sum(amount for amount, seconds in costs) / seconds if seconds else None
+
+
+def longest_first(work, model):
+    """Order (filename, filetype) work by estimated time, longest first,
+as [(estimate, filename, filetype), ...].
+
+Longest processing time first: the big files start while there is still
+plenty of other work to run alongside them, rather than one of them being
+picked up last and leaving every other worker idle while it finishes.
+"""
+    return sorted(((model.estimate(filename, filetype), filename, filetype) for filename, filetype in work), reverse=True)
+
+
+class Progress():
+    """Estimated time remaining of planned work spread over a number of workers.
+
+The estimates are corrected by how long the work completed so far actually
+took against its estimate - they are rarely right for this run's conditions
+(cold or warm cache, other load, --io-limit), but are consistently wrong.
+"""
+    def __init__(self, estimates, workers):
+        self.remaining = sum(estimates)
+        self.workers = workers
+        self.started = time.monotonic()
+        self.completed = 0.0
+
+    def update(self, estimate):
+        self.remaining -= estimate
+        self.completed += estimate
+
+    def eta(self):
+        elapsed = time.monotonic() - self.started
+        correction = elapsed / (self.completed / self.workers) if self.completed else 1.0
+        return max(self.remaining, 0) / self.workers * correction
@@ -0,0 +1,138 @@
+import os
+import json
+import socket
+
+import flaccurate.database
+import flaccurate.history
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Local service protocol (see: flaccurate.commands.serve)
+#
+# A Unix domain socket, one JSON object per line in each direction.  The
+# client sends a single request and reads responses until one with "done":
+#
+#   {"action": "curate", "paths": [...]}   verify recorded files, record new ones
+#   {"action": "verify", "paths": [...]}   verify recorded files only
+#   {"action": "status"}                   report the service configuration
+#   {"action": "shutdown"}                 stop the service
+#
+# Paths are absolute files or directories.  For curate and verify every file
+# produces {"filename": ..., "filetype": ..., "outcome": ...} as soon as it is
+# processed, followed by {"done": true, "counts": {outcome: count}, "settings":
+# {...}} - the settings being the service's own (see: status).  A request that
+# cannot be served gets {"done": true, "error": "..."}.
+#
+# A request carries paths only: the service processes them with the options
+# it was started with.
+
+# curate options a request cannot carry, with their defaults - a curate given
+# any of them does the work itself rather than have them ignored
+LOCAL_OPTIONS = {
+    'digests': None, 'verify_digest': None, 'schedule': 'glob', 'rescan': False, 'exclude': None, 'include': None,
+    'spot_check': None, 'time_budget': None, 'sample': None, 'staging': False, 'workers': None, 'tuning': None,
+    'io_direct': False, 'io_limit': None, 'read_buffer': None, 'read_ahead': None, 'pcm_buffer': None,
+    'profile': None, 'profile_memory': False, 'profile_output': None,
+}
+
+
+def socket_path(args):
+    """The service socket for the database in use: --socket, or alongside the database file."""
+    if(args.socket is not None):
+        return args.socket
+    return (args.database or flaccurate.database.Database.DEFAULT_DB_FILE) + '.sock'
+
+
+def send(stream, message):
+    stream.write((json.dumps(message) + '\n').encode())
+    stream.flush()
+
+
+def receive(stream):
+    """Yield each message read from stream until it closes."""
+    for line in stream:
+        if(line.strip()):
+            yield json.loads(line)
+
+
+def connect(path):
+    """Connected socket to a running service, or None when there is none."""
+    if(not os.path.exists(path)):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        # A socket file left behind by a service that did not shut down cleanly
+        sock.close()
+        return None
+    return sock
+
+
+def request(path, message):
+    """Send message to the service, yielding its responses up to and including "done".
+
+Returns without yielding anything when no service is running.
+"""
+    sock = connect(path)
+    if(sock is None):
+        return
+
+    with sock, sock.makefile('rwb') as stream:
+        send(stream, message)
+        for response in receive(stream):
+            yield response
+            if(response.get('done')):
+                break
+
+
+def local_options(args):
+    """The LOCAL_OPTIONS given in args, as their command line names."""
+    return ['--' + option.replace('_', '-') for option, default in LOCAL_OPTIONS.items()
+        if(getattr(args, option, None) is not None and getattr(args, option) != default)]
+
+
+def curate(args):
+    """Have a running service curate --input on our behalf.
+
+Returns the run totals ({outcome: count}, see: flaccurate.history.OUTCOMES).
+None when there is no service to ask, args hold options it would not honour
+(see: LOCAL_OPTIONS), or the service did not complete the request - the
+caller then does the work itself.
+"""
+    path = socket_path(args)
+    options = local_options(args)
+    if(options):
+        if(os.path.exists(path)):
+            logger.info('Not using flaccurate service %s: it does not take %s', path, ', '.join(options))
+        return None
+    responses = request(path, {'action': 'curate', 'paths': [os.path.abspath(args.input)]})
+
+    served = False
+    counts = None
+    for response in responses:
+        if(not served):
+            logger.info('Using flaccurate service: %s', path)
+            served = True
+
+        if('filename' in response):
+            if(response['outcome'] == 'verified' or response['outcome'] == 'inserted'):
+                logger.info('%s: %s - %s', response['filetype'], response['filename'], response['outcome'])
+            else:
+                logger.warning('%s: %s - %s', response['filetype'], response['filename'], response['outcome'])
+        elif('error' in response):
+            logger.error('Service failed to curate %s: %s - curating here instead', args.input, response['error'])
+            return None
+        elif(response.get('done')):
+            settings = response.get('settings') or {}
+            logger.info('Service settings: database: %s digests: %s verifying with: %s workers: %s',
+                settings.get('database'), ', '.join(settings.get('digests') or []), settings.get('verify_digest'), settings.get('workers'))
+            logger.info('Processed %i files - %s', sum(response['counts'].values()),
+                ' '.join('%s: %i' % outcome for outcome in response['counts'].items()))
+            counts = {outcome: response['counts'].get(name, 0) for outcome, name in flaccurate.history.OUTCOMES.items()}
+
+    if(served and counts is None):
+        logger.error('Service stopped before completing the curate of %s - curating here instead', args.input)
+    return counts
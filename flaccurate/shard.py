@@ -0,0 +1,94 @@
+import os
+import json
+import heapq
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Work shards - verification of one library split across several hosts,
+# everything passing through plain files (see: flaccurate.commands.shard).
+#
+# A manifest is JSON lines: a header, then one [path, filetype, {digest: hex}]
+# entry per file, the path relative to the library root and the digests those
+# recorded at export time.  Everything a worker needs is in the manifest - it
+# opens no database, and the library root may be mounted elsewhere.
+#
+# A results file is JSON lines: a header naming the manifest it answers,
+# then one {"path", "filetype", "outcome", "digests", "cost"} per file.
+
+FORMAT_VERSION = 1
+METHODS = ('path', 'directory', 'bytes')
+
+
+def split(entries, shards, by='bytes', size=None):
+    """Split entries ([path, filetype, digests]) into shards lists of entries.
+
+path:      contiguous runs of sorted paths, equal in number of files
+directory: whole directories, balanced by number of files
+bytes:     individual files, balanced by size - size(path) returning the
+           size in bytes (or None when unknown, counted as 0)
+"""
+    if(by not in METHODS):
+        raise ValueError('Unknown shard method: %s' % by)
+    entries = sorted(entries, key=lambda entry: entry[0])
+
+    if(by == 'path'):
+        step, remainder = divmod(len(entries), shards)
+        bounds = [i * step + min(i, remainder) for i in range(shards + 1)]
+        return [entries[bounds[i]:bounds[i + 1]] for i in range(shards)]
+
+    if(by == 'directory'):
+        groups = {}
+        for entry in entries:
+            groups.setdefault(os.path.dirname(entry[0]), []).append(entry)
+        items = [(len(group), group) for group in groups.values()]
+    else:
+        items = [((size(entry[0]) if size is not None else None) or 0, [entry]) for entry in entries]
+
+    # Largest first, each onto the lightest shard so far
+    result = [[] for i in range(shards)]
+    heap = [(0, i) for i in range(shards)]
+    for weight, group in sorted(items, key=lambda item: item[0], reverse=True):
+        load, i = heapq.heappop(heap)
+        result[i] += group
+        heapq.heappush(heap, (load + weight, i))
+
+    return [sorted(shard, key=lambda entry: entry[0]) for shard in result]
+
+
+def write_lines(filename, header, lines):
+    # Written under a temporary name and renamed, so a reader never sees half a file
+    partial = filename + '.partial'
+    with open(partial, 'w') as fileh:
+        fileh.write(json.dumps(dict(header, version=FORMAT_VERSION)) + '\n')
+        for line in lines:
+            fileh.write(json.dumps(line) + '\n')
+    os.replace(partial, filename)
+
+
+def read_lines(filename):
+    """Return (header, iterator of lines) - raises ValueError for anything unreadable."""
+    fileh = open(filename)
+    try:
+        header = json.loads(fileh.readline() or 'null')
+    except ValueError:
+        header = None
+    if(not isinstance(header, dict) or header.get('version') != FORMAT_VERSION):
+        fileh.close()
+        raise ValueError('Not a version %i shard file: %s' % (FORMAT_VERSION, filename))
+
+    def lines():
+        with fileh:
+            for line in fileh:
+                if(line.strip()):
+                    yield json.loads(line)
+
+    return header, lines()
+
+
+def manifest_filename(directory, export, shard, shards):
+    return os.path.join(directory, 'shard-%s-%03d-of-%03d.manifest' % (export, shard, shards))
+
+
+def results_filename(manifest):
+    return os.path.splitext(manifest)[0] + '.results'
@@ -0,0 +1,143 @@
+import os
+import hashlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Checksum sidecar files found alongside audio files:
+# .md5 - md5sum format, one "<md5>  <filename>" (or "<md5> *<filename>") per line
+# .ffp - FLAC fingerprint format, one "<filename>:<md5>" per line, where the md5
+#        is the STREAMINFO signature - identical to the flac plugin audio md5
+#
+# Only .ffp is written (see: write_sidecar()): md5sum -c checks the md5 of the
+# whole file, which the database does not record.
+SIDECAR_EXTENSIONS = ('.md5', '.ffp')
+
+# Bytes read at a time by file_md5()
+BLOCK_SIZE = 1024 * 1024
+
+
+def walk_key(directory):
+    """Sort key for a directory path relative to a library root.
+
+Compares path components rather than raw strings, so 'a/b' sorts directly
+after 'a' (as a top down walk visits it) rather than after 'a-b'.
+"""
+    if(not directory):
+        return ()
+    return tuple(directory.split(os.sep))
+
+
+def parse_md5(line):
+    md5, _, filename = line.partition(' ')
+    return filename.lstrip(' *'), md5
+
+
+def parse_ffp(line):
+    filename, _, md5 = line.rpartition(':')
+    return filename, md5
+
+
+PARSERS = {
+    '.md5': parse_md5,
+    '.ffp': parse_ffp,
+}
+
+
+def format_ffp(basename, md5):
+    return '%s:%s' % (basename, md5)
+
+
+FORMATTERS = {
+    '.ffp': format_ffp,
+}
+
+
+def file_md5(filename):
+    """The md5 of the whole file, as md5sum calculates it."""
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fileh:
+        for block in iter(lambda: fileh.read(BLOCK_SIZE), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def write_sidecar(filename, entries, replace=False):
+    """Write [(basename, md5), ...] to a sidecar file, in the format its extension names.
+
+Written under a temporary name and renamed over the file.  Returns True when
+written, False when the file already holds exactly these entries, and None
+when it holds something else and replace is not set - left as it was.
+"""
+    logger.debug('sidecar.write_sidecar( %s )', filename)
+    formatter = FORMATTERS[os.path.splitext(filename)[1].lower()]
+    content = ''.join(formatter(basename, md5) + '\n' for basename, md5 in entries)
+
+    try:
+        with open(filename, 'r', errors='surrogateescape') as sidecar_fh:
+            existing = sidecar_fh.read()
+    except FileNotFoundError:
+        existing = None
+    if(existing == content):
+        return False
+    if(existing is not None and not replace):
+        return None
+
+    partial = filename + '.partial'
+    with open(partial, 'w', errors='surrogateescape') as sidecar_fh:
+        sidecar_fh.write(content)
+    os.replace(partial, filename)
+    return True
+
+
+def read_sidecar(filename):
+    """Yield (basename, md5) for each entry in a sidecar file."""
+    logger.debug('sidecar.read_sidecar( %s )', filename)
+    parser = PARSERS[os.path.splitext(filename)[1].lower()]
+
+    try:
+        sidecar_fh = open(filename, 'r', errors='surrogateescape')
+    except IOError as e:
+        logger.error('Failed to open sidecar %s: %s', filename, e.args[1])
+        return
+
+    with sidecar_fh:
+        for line in sidecar_fh:
+            line = line.rstrip('\r\n')
+            if(not line or line.startswith((';', '#'))):
+                continue
+            basename, md5 = parser(line)
+            if(not basename or len(md5) != 32):
+                logger.warning('Skipping malformed line in %s: %s', filename, line)
+                continue
+            yield basename, md5.lower()
+
+
+def walk(root):
+    """Yield (directory, basename, md5, extension) for every sidecar entry under root,
+extension being that of the sidecar file holding it.
+
+Entries come out in the same order as Database._iterate_checksums() - only
+one directory worth of entries is held in memory at a time.
+"""
+    logger.debug('sidecar.walk( %s )', root)
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()  # os.walk honours in place modification for the descent order
+        directory = os.path.relpath(dirpath, root)
+        if(directory == os.curdir):
+            directory = ''
+
+        entries = {}
+        for filename in filenames:
+            if(not filename.lower().endswith(SIDECAR_EXTENSIONS)):
+                continue
+            for basename, md5 in read_sidecar(os.path.join(dirpath, filename)):
+                # Entries pointing into other directories would break the walk order
+                if(os.sep in basename or '/' in basename):
+                    logger.warning('Skipping sidecar entry outside its directory: %s: %s', os.path.join(dirpath, filename), basename)
+                    continue
+                entries[basename] = md5, os.path.splitext(filename)[1].lower()
+
+        for basename in sorted(entries):
+            yield (directory, basename) + entries[basename]
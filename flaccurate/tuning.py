@@ -0,0 +1,225 @@
+import os
+import json
+import math
+import time
+import hashlib
+
+import flaccurate.dynloader
+import flaccurate.reader
+import flaccurate.walker
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Host calibration (see: selfcheck --calibrate) and the settings derived from it.
+#
+# Three rates are measured, in bytes of file per second:
+#   read    sequential reads of the library storage (--input), at each of
+#           BUFFER_SIZES, with the page cache dropped for the files read first
+#   decode  flac decoding and hashing on one core, at each of PCM_BUFFER_SIZES
+#           - the bundled test data, or flac files from --input when it is not
+#           there
+#   md5     hashing alone, from memory - all an mp3 costs besides reading it
+#
+# From them: as many workers as it takes one core's worth of processing to
+# keep up with the storage (no more than there are cores), the smallest read
+# and PCM buffers within BUFFER_MARGIN of the fastest, and a read-ahead depth
+# covering READ_AHEAD_SECONDS of each worker's share of the storage throughput.
+#
+# The tuning file is JSON; curate fills in --workers, --read-buffer,
+# --read-ahead and --pcm-buffer from it whenever they are not given.  The
+# workers are a pool's across the whole storage - with --schedule device,
+# where --workers is the threads per device, it is left alone.
+
+DEFAULT_FILE = os.path.join(os.path.expanduser('~'), '.config', 'flaccurate', 'tuning.json')
+
+BUFFER_SIZES = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+PCM_BUFFER_SIZES = (0, 256 * 1024, 1024 * 1024)
+BUFFER_MARGIN = 0.05
+READ_BYTES = 64 * 1024 * 1024        # read per buffer size
+DECODE_SECONDS = 2.0                 # decoded per PCM buffer size
+HASH_BYTES = 256 * 1024 * 1024
+READ_AHEAD_SECONDS = 0.1
+MAX_READ_AHEAD = 64
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'test-data', 'good-data')
+
+# Tuning file keys and the arguments they fill in
+SETTINGS = ('workers', 'read_buffer', 'read_ahead', 'pcm_buffer')
+
+
+def tuning_file(args):
+    return args.tuning or DEFAULT_FILE
+
+
+def _files(root, extensions):
+    # Largest first - fewer opens per byte read
+    files = []
+    for directory, basenames in flaccurate.walker.Walker(root).walk():
+        for basename in basenames:
+            if(os.path.splitext(basename)[1][1:] in extensions):
+                filename = os.path.join(directory, basename)
+                files.append((os.path.getsize(filename), filename))
+    return [filename for size, filename in sorted(files, reverse=True)]
+
+
+def _drop_cache(filename):
+    if(hasattr(os, 'posix_fadvise')):
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def measure_read(filenames, buffer_sizes=BUFFER_SIZES, read_bytes=READ_BYTES):
+    """Return {buffer size: bytes per second} reading filenames sequentially.
+
+Each buffer size reads different files (or parts of them), so none is
+served from what another left in the page cache.
+"""
+    rates = {}
+    pending = [(filename, 0) for filename in filenames]
+    for buffer_size in buffer_sizes:
+        buffer = memoryview(bytearray(buffer_size))
+        total = 0
+        started = time.perf_counter()
+        while(pending and total < read_bytes):
+            filename, offset = pending.pop(0)
+            _drop_cache(filename)
+            with flaccurate.reader.Reader(filename) as fileobj:
+                fileobj.seek(offset)
+                while(total < read_bytes):
+                    count = fileobj.readinto(buffer)
+                    if(not count):
+                        break
+                    total += count
+                if(fileobj.tell() < fileobj.size):
+                    pending.insert(0, (filename, fileobj.tell()))
+        elapsed = time.perf_counter() - started
+        if(total):
+            rates[buffer_size] = total / elapsed
+            logger.info('Read: %i KB buffers - %.1f MB/s (%i MB)', buffer_size // 1024, rates[buffer_size] / (1024 * 1024), total // (1024 * 1024))
+    return rates
+
+
+def measure_decode(plugin, filenames, pcm_buffer_sizes=PCM_BUFFER_SIZES, seconds=DECODE_SECONDS):
+    """Return {PCM buffer size: bytes of file per second} a plugin decodes and hashes on one core, {} without files."""
+    rates = {}
+    try:
+        for pcm_buffer_size in pcm_buffer_sizes:
+            flaccurate.dynloader.configure(pcm_buffer_size=pcm_buffer_size)
+            total = 0
+            started = time.perf_counter()
+            for filename in filenames:
+                if(plugin.digests(filename, ('md5',)) is None):
+                    continue
+                total += os.path.getsize(filename)
+                if(time.perf_counter() - started > seconds):
+                    break
+            if(not total):
+                break
+            rates[pcm_buffer_size] = total / (time.perf_counter() - started)
+            logger.info('Decode: %s - %.1f MB/s per core', '%i KB PCM buffers' % (pcm_buffer_size // 1024) if pcm_buffer_size else 'PCM hashed as decoded',
+                rates[pcm_buffer_size] / (1024 * 1024))
+    finally:
+        flaccurate.dynloader.configure()
+    return rates
+
+
+def smallest_within_margin(rates):
+    """The smallest size with a rate within BUFFER_MARGIN of the fastest."""
+    fastest = max(rates.values())
+    return min(size for size, rate in rates.items() if rate >= fastest * (1 - BUFFER_MARGIN))
+
+
+def measure_md5(size=HASH_BYTES):
+    buffer = bytes(flaccurate.reader.DEFAULT_BUFFER_SIZE)
+    hasher = hashlib.md5()
+    started = time.perf_counter()
+    for i in range(size // len(buffer)):
+        hasher.update(buffer)
+    rate = size / (time.perf_counter() - started)
+    logger.info('MD5: %.1f MB/s per core', rate / (1024 * 1024))
+    return rate
+
+
+def recommend(read_rates, decode_rate, md5_rate, cpus):
+    """The settings for the measured rates - see the top of this module."""
+    per_worker = decode_rate or md5_rate
+    if(not read_rates):
+        return {'workers': cpus, 'read_buffer': flaccurate.reader.DEFAULT_BUFFER_SIZE // 1024, 'read_ahead': 0}
+
+    buffer_size = smallest_within_margin(read_rates)
+    read_rate = read_rates[buffer_size]
+    workers = max(1, min(cpus, math.ceil(read_rate / per_worker)))
+    read_ahead = max(1, min(MAX_READ_AHEAD, round(read_rate / workers * READ_AHEAD_SECONDS / buffer_size)))
+    return {'workers': workers, 'read_buffer': buffer_size // 1024, 'read_ahead': read_ahead}
+
+
+def calibrate(root, plugins):
+    """Measure this host (and the storage at root, if given), returning the tuning to save."""
+    cpus = os.cpu_count() or 1
+    read_rates = measure_read(_files(root, set(plugins.supported_filetypes()))) if root is not None else {}
+
+    decode_rates = {}
+    plugin = plugins.plugin('flac')
+    if(plugin is not None):
+        flac_files = _files(TEST_DATA, {'flac'}) if os.path.isdir(TEST_DATA) else []
+        if(not flac_files and root is not None):
+            flac_files = _files(root, {'flac'})
+        if(flac_files):
+            # Unmeasured - the first size measured would otherwise pay for a cold cache
+            plugin.digests(flac_files[-1], ('md5',))
+        decode_rates = measure_decode(plugin, flac_files)
+
+    pcm_buffer_size = smallest_within_margin(decode_rates) if decode_rates else flaccurate.dynloader.DEFAULT_PCM_BUFFER_SIZE
+    tuning = recommend(read_rates, decode_rates.get(pcm_buffer_size), measure_md5(), cpus)
+    tuning['pcm_buffer'] = pcm_buffer_size // 1024
+    tuning['measured'] = {
+        'host': os.uname().nodename,
+        'calibrated': int(time.time()),
+        'input': os.path.abspath(root) if root is not None else None,
+        'cpus': cpus,
+        'read': {str(size): round(rate) for size, rate in read_rates.items()},
+        'decode': {str(size): round(rate) for size, rate in decode_rates.items()},
+    }
+    return tuning
+
+
+def save(filename, tuning):
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    partial = filename + '.partial'
+    with open(partial, 'w') as fileh:
+        json.dump(tuning, fileh, indent=2)
+    os.replace(partial, filename)
+
+
+def load(filename):
+    """The saved tuning, None when there is none or it cannot be read."""
+    try:
+        with open(filename) as fileh:
+            tuning = json.load(fileh)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning('Ignoring tuning file %s: %s', filename, e)
+        return None
+    return tuning if isinstance(tuning, dict) else None
+
+
+def apply(args):
+    """Fill in the settings not given on the command line from the tuning file."""
+    filename = tuning_file(args)
+    tuning = load(filename)
+    if(tuning is None):
+        return
+    applied = []
+    for setting in SETTINGS:
+        if(setting == 'workers' and getattr(args, 'schedule', None) == 'device'):
+            continue
+        if(getattr(args, setting, None) is None and isinstance(tuning.get(setting), int)):
+            setattr(args, setting, tuning[setting])
+            applied.append('%s=%i' % (setting, tuning[setting]))
+    if(applied):
+        logger.info('Tuning from %s: %s', filename, ' '.join(applied))
@@ -0,0 +1,115 @@
+import os
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Library walk with a directory snapshot cache.
+#
+# Adding, removing or renaming an entry updates the mtime of the directory
+# holding it, so a directory whose mtime matches the one recorded with its
+# listing can reuse that listing instead of being read again.  Every directory
+# still costs a stat(), but only changed directories cost a readdir() - which
+# on network filesystems is where a walk of a large library spends its time.
+#
+# Modifying a file's contents does not touch its directory's mtime, but the
+# walk only decides which files exist - not whether they changed.
+
+# A directory modified this close to being listed may be modified again within
+# the same mtime tick without the mtime changing - such listings are not kept
+RACY_NS = 2 * 1000 * 1000 * 1000
+
+
+class Walker():
+    """Walks a library root top down, in sorted order, yielding (directory, files).
+
+listings:  {relative directory: (mtime_ns, subdirectories, files)} from a
+           previous walk (see: Database._retrieve_listings())
+rescan:    ignore listings and read every directory
+rules:     include / exclude rules (see: flaccurate.rules) - excluded
+           directories are pruned, never read
+prefix:    root relative to the library root the rules are for, when it is
+           a directory inside one - '' for the library root itself
+
+Listings read during the walk are collected in changed, ready to be recorded.
+Like glob, hidden (dot) files and directories are ignored.  Symbolic links to
+directories are not followed.
+"""
+    def __init__(self, root, listings=None, rescan=False, rules=None, prefix=''):
+        self.root = os.path.abspath(root)
+        self.listings = listings or {}
+        self.rescan = rescan
+        self.rules = rules
+        self.prefix = prefix
+        self.changed = {}
+        self.current = {}  # listings known to be up to date during this run
+        self.scanned = 0
+        self.reused = 0
+        self.pruned = set()  # excluded directories left unread
+
+    def walk(self):
+        if(self.rules and self.prefix and self.rules.pruned(self.prefix, True)):
+            # The whole root is inside an excluded directory
+            self.pruned.add('')
+            return
+
+        pending = ['']
+        while(pending):
+            relative = pending.pop()
+            listing = self._listing(relative)
+            if(listing is None):
+                continue
+            subdirectories, files = listing
+            if(self.rules):
+                # Listings are kept as read, so changing the rules needs no rescan
+                pruned = [subdirectory for subdirectory in subdirectories if self.rules.excluded(os.path.join(self.prefix, relative, subdirectory), True)]
+                self.pruned.update(os.path.join(relative, subdirectory) for subdirectory in pruned)
+                subdirectories = [subdirectory for subdirectory in subdirectories if subdirectory not in pruned]
+                files = [basename for basename in files if not self.rules.excluded(os.path.join(self.prefix, relative, basename))]
+            yield os.path.join(self.root, relative) if relative else self.root, files
+            pending.extend(os.path.join(relative, subdirectory) for subdirectory in reversed(subdirectories))
+
+    def _listing(self, relative):
+        listing = self.current.get(relative)
+        if(listing is not None):
+            return listing
+
+        directory = os.path.join(self.root, relative)
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError as e:
+            logger.warning('Failed to read directory %s: %s', directory, e)
+            return None
+
+        cached = self.listings.get(relative)
+        if(not self.rescan and cached is not None and cached[0] == mtime_ns):
+            self.reused += 1
+            listing = cached[1:]
+        else:
+            listing = self._scan(directory)
+            if(listing is None):
+                return None
+            self.scanned += 1
+            if(time.time_ns() - mtime_ns > RACY_NS):
+                self.changed[relative] = self.listings[relative] = (mtime_ns,) + listing
+
+        self.current[relative] = listing
+        return listing
+
+    def _scan(self, directory):
+        logger.debug('Walker._scan( %s )', directory)
+        subdirectories = []
+        files = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if(entry.name.startswith('.')):
+                        continue
+                    if(entry.is_dir(follow_symlinks=False)):
+                        subdirectories.append(entry.name)
+                    elif(entry.is_file()):
+                        files.append(entry.name)
+        except OSError as e:
+            logger.warning('Failed to read directory %s: %s', directory, e)
+            return None
+        return sorted(subdirectories), sorted(files)
@@ -0,0 +1,39 @@
+import random
+
+import pytest
+import audiotools.pcm
+from audiotools._accuraterip import Checksum
+
+import flaccurate.accuraterip
+
+numpy = pytest.importorskip('numpy')
+
+
+@pytest.mark.parametrize("total_samples", [100, 3000, 7000, 44100])
+def test_crcs(total_samples):
+    random.seed(total_samples)
+    framelist = audiotools.pcm.from_list([random.randint(-32768, 32767) for i in range(total_samples * 2)], 2, 16, True)
+    pcm = framelist.to_bytes(False, True)
+
+    hasher = flaccurate.accuraterip.AccurateRipHasher()
+    # Uneven buffers, not aligned to whole samples
+    for start in range(0, len(pcm), 4099):
+        hasher.update(pcm[start:start + 4099])
+    samples, crcs = flaccurate.accuraterip.unpack(hasher.digest())
+    assert(samples == total_samples)
+
+    for variant, is_first, is_last in [('middle', False, False), ('first', True, False), ('last', False, True), ('only', True, True)]:
+        checksum = Checksum(total_pcm_frames=total_samples, sample_rate=44100, is_first=is_first, is_last=is_last, pcm_frame_range=1)
+        checksum.update(framelist)
+        assert(crcs[variant] == (checksum.checksums_v1()[0], checksum.checksum_v2()))
+
+
+def test_parse_response():
+    ids = (0x0001, 0x0002, 0x03000102)
+    data = (flaccurate.accuraterip.RESPONSE_HEADER.pack(2, *ids) +
+            flaccurate.accuraterip.RESPONSE_TRACK.pack(10, 0x1111, 0) +
+            flaccurate.accuraterip.RESPONSE_TRACK.pack(10, 0x2222, 0) +
+            flaccurate.accuraterip.RESPONSE_HEADER.pack(2, 9, 9, 9) +
+            flaccurate.accuraterip.RESPONSE_TRACK.pack(3, 0x3333, 0) +
+            flaccurate.accuraterip.RESPONSE_TRACK.pack(3, 0x4444, 0))
+    assert(flaccurate.accuraterip.parse_response(data, ids) == {1: [(10, 0x1111, 0)], 2: [(10, 0x2222, 0)]})
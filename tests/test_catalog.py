@@ -0,0 +1,34 @@
+import os
+
+import pytest
+import flaccurate.catalog
+import flaccurate.history
+
+
+def test_shard_database(tmp_path):
+    filename = str(tmp_path / 'music.json')
+    catalog = flaccurate.catalog.load(filename)
+    assert(catalog == {'version': flaccurate.catalog.FORMAT_VERSION, 'roots': {}})
+
+    assert(flaccurate.catalog.shard_database(filename, catalog, '/mnt/a music') == str(tmp_path / 'music-mnt-a-music.db'))
+    assert(flaccurate.catalog.shard_database(filename, catalog, '/mnt/a-music') == str(tmp_path / 'music-mnt-a-music-2.db'))
+    assert(flaccurate.catalog.shard_database(filename, catalog, '/mnt/a music') == str(tmp_path / 'music-mnt-a-music.db'))
+
+    flaccurate.catalog.record_run(catalog, '/mnt/a music', {flaccurate.history.VERIFIED: 3, flaccurate.history.FAILED: 1})
+    flaccurate.catalog.save(filename, catalog)
+    loaded = flaccurate.catalog.load(filename)
+    assert(loaded == catalog)
+    assert(loaded['roots']['/mnt/a music']['run']['counts'] == {'verified': 3, 'failed': 1})
+
+
+def test_unsupported_version(tmp_path):
+    filename = str(tmp_path / 'music.json')
+    flaccurate.catalog.save(filename, {'version': 99, 'roots': {}})
+    with pytest.raises(ValueError):
+        flaccurate.catalog.load(filename)
+
+
+def test_device_lanes(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    assert(flaccurate.catalog.device_lanes([str(tmp_path / 'b'), str(tmp_path / 'a')]) == [[str(tmp_path / 'b'), str(tmp_path / 'a')]])
@@ -0,0 +1,15 @@
+import argparse
+
+import pytest
+import flaccurate
+
+
+def test_context_shared(tmp_path):
+    args = argparse.Namespace(debug=False, silent=False, quiet=False, force=True, database=str(tmp_path / 'context.db'))
+    context = flaccurate.Context(args)
+    assert(context._database is None)
+
+    database = context.database
+    assert(context.database is database)
+    assert(context.plugins is context.plugins)
+    assert(set(context.plugins.supported_filetypes()) == {'flac', 'mp3'})
@@ -0,0 +1,191 @@
+import os
+import json
+import shutil
+import logging
+
+import audiotools
+import audiotools.pcm
+
+import pytest
+
+import flaccurate
+import flaccurate.catalog
+import flaccurate.history
+import flaccurate.library
+import flaccurate.commands.curate
+
+
+MP3 = 'tests/test-data/good-data/mp3/id3v23.mp3'
+
+
+def _curate(database, path, **options):
+    args = flaccurate.library.settings(database=database, input=path, inputs=[path], force=True, **options)
+    curate = flaccurate.commands.curate.Curate(args)
+    try:
+        curate.run()
+    finally:
+        curate.context.close()
+    return curate.history.counts
+
+
+class _Tone(audiotools.PCMReader):
+    # Three seconds of 16 bit stereo, for encoding a flac
+    def __init__(self):
+        audiotools.PCMReader.__init__(self, 44100, 2, 0x3, 16)
+        self.framelist = audiotools.pcm.from_list([(i * 37) % 20000 - 10000 for i in range(44100 * 3) for channel in range(2)], 2, 16, True)
+
+    def read(self, pcm_frames):
+        framelist, self.framelist = self.framelist.split(pcm_frames)
+        return framelist
+
+    def close(self):
+        pass
+
+
+def _library(tmp_path):
+    music = tmp_path / 'music'
+    for album in ('a', 'b'):
+        (music / album).mkdir(parents=True)
+        for track in ('01.mp3', '02.mp3'):
+            shutil.copy(MP3, str(music / album / track))
+    return music
+
+
+def test_subdirectory(tmp_path):
+    music = _library(tmp_path)
+    database = str(tmp_path / 'library.db')
+
+    assert(_curate(database, str(music))[flaccurate.history.INSERTED] == 4)
+    # Part of the root already recorded - verified, not recorded again under a root of its own
+    counts = _curate(database, str(music / 'a'))
+    assert((counts[flaccurate.history.VERIFIED], counts[flaccurate.history.INSERTED]) == (2, 0))
+
+    db = flaccurate.Database(flaccurate.library.settings(database=database))
+    assert(list(db.roots) == [str(music)])
+    assert(db.dbh.execute('SELECT count(*) FROM checksums').fetchone()[0] == 4)
+
+
+def test_subdirectory_rules(tmp_path):
+    music = _library(tmp_path)
+    database = str(tmp_path / 'library.db')
+    (music / '.flaccurate-ignore').write_text('@eaDir/\n/a/Scans/\n')
+    for directory in ('@eaDir', 'Scans'):
+        (music / 'a' / directory).mkdir()
+        shutil.copy(MP3, str(music / 'a' / directory / 'thumb.mp3'))
+    assert(_curate(database, str(music))[flaccurate.history.INSERTED] == 4)
+
+    # The root's rules, anchored patterns relative to the root
+    counts = _curate(database, str(music / 'a'))
+    assert((counts[flaccurate.history.VERIFIED], counts[flaccurate.history.INSERTED]) == (2, 0))
+    # Inside an excluded directory - nothing to do
+    assert(sum(_curate(database, str(music / 'a' / 'Scans')).values()) == 0)
+
+
+def test_flac_segments(tmp_path, caplog):
+    music = tmp_path / 'music'
+    music.mkdir()
+    filename = str(music / '01.flac')
+    audiotools.FlacAudio.from_pcm(filename, _Tone(), total_pcm_frames=44100 * 3)
+    database = str(tmp_path / 'library.db')
+    assert(_curate(database, str(music), digests='segments')[flaccurate.history.INSERTED] == 1)
+
+    # Damage inside a frame fails decoding - the segments report it all the same
+    with open(filename, 'r+b') as fileh:
+        fileh.seek(os.path.getsize(filename) // 2)
+        byte = fileh.read(1)
+        fileh.seek(-1, 1)
+        fileh.write(bytes([byte[0] ^ 0xff]))
+    caplog.clear()
+    counts = _curate(database, str(music), digests='segments')
+    assert(counts[flaccurate.history.FAILED] == 1)
+    assert('segments 0 of ' in caplog.text)
+
+
+def test_outer_root(tmp_path):
+    music = _library(tmp_path)
+    database = str(tmp_path / 'library.db')
+
+    assert(_curate(database, str(music / 'a'))[flaccurate.history.INSERTED] == 2)
+    # The earlier root becomes part of the new one, its records kept
+    counts = _curate(database, str(music))
+    assert((counts[flaccurate.history.VERIFIED], counts[flaccurate.history.INSERTED]) == (2, 2))
+
+    db = flaccurate.Database(flaccurate.library.settings(database=database))
+    assert(list(db.roots) == [str(music)])
+    assert(db.dbh.execute('SELECT count(*) FROM checksums').fetchone()[0] == 4)
+
+
+def test_verify_digest(tmp_path, caplog):
+    music = _library(tmp_path)
+    database = str(tmp_path / 'library.db')
+    _curate(database, str(music))
+    caplog.set_level(logging.DEBUG)
+
+    # No record of sha256 yet - verified with md5, and sha256 recorded then
+    caplog.clear()
+    counts = _curate(database, str(music), digests='sha256', verify_digest='sha256')
+    assert(counts[flaccurate.history.VERIFIED] == 4)
+    assert(caplog.text.count('Checksum verified (md5 ') == 4)
+    db = flaccurate.Database(flaccurate.library.settings(database=database))
+    assert({'md5', 'sha256'} <= set(db._retrieve_digests(str(music / 'a/01.mp3'))))
+
+    # From then on verified with sha256
+    caplog.clear()
+    counts = _curate(database, str(music), verify_digest='sha256')
+    assert(counts[flaccurate.history.VERIFIED] == 4)
+    assert(caplog.text.count('Checksum verified (sha256 ') == 4)
+
+
+def test_new_digest_after_verify(tmp_path):
+    music = _library(tmp_path)
+    database = str(tmp_path / 'library.db')
+    _curate(database, str(music))
+
+    with open(str(music / 'b/02.mp3'), 'r+b') as fileh:
+        fileh.seek(-1024, 2)
+        fileh.write(b'\xff' * 16)
+    counts = _curate(database, str(music), digests='blake2b')
+    assert((counts[flaccurate.history.VERIFIED], counts[flaccurate.history.FAILED]) == (3, 1))
+
+    # Only what md5 verified has the new digest recorded
+    db = flaccurate.Database(flaccurate.library.settings(database=database))
+    assert('blake2b' in db._retrieve_digests(str(music / 'b/01.mp3')))
+    assert('blake2b' not in db._retrieve_digests(str(music / 'b/02.mp3')))
+
+
+def test_sample_subdirectory(tmp_path):
+    music = _library(tmp_path)
+    database = str(tmp_path / 'library.db')
+    _curate(database, str(music))
+
+    # Drawn from the records of the root holding it
+    counts = _curate(database, str(music / 'b'), sample=10)
+    assert((counts[flaccurate.history.VERIFIED], sum(counts.values())) == (2, 2))
+
+
+def test_catalog_failed_root(tmp_path):
+    music = _library(tmp_path)
+    catalog_file = str(tmp_path / 'catalog.json')
+    args = flaccurate.library.settings(catalog=catalog_file, inputs=[str(music / 'a'), str(music / 'b')], force=True)
+    args.input = args.inputs[0]
+    flaccurate.commands.curate.Curate(args).run()
+
+    # A shard failing validation fails its root alone - reported, recorded and exiting non-zero
+    catalog = flaccurate.catalog.load(catalog_file)
+    shard = flaccurate.catalog.shard_database(catalog_file, catalog, str(music / 'b'))
+    with open(shard + '.md5', 'w') as fileh:
+        json.dump({shard: {'md5': '0' * 32}}, fileh)
+    with pytest.raises(SystemExit) as exit:
+        flaccurate.commands.curate.Curate(args).run()
+    assert(exit.value.code == 1)
+
+    catalog = flaccurate.catalog.load(catalog_file)
+    assert(catalog['roots'][str(music / 'a')]['run']['counts']['verified'] == 2)
+    assert('failed' not in catalog['roots'][str(music / 'a')])
+    assert('failed' in catalog['roots'][str(music / 'b')])
+
+
+def test_duration():
+    assert(flaccurate.commands.curate._duration(59.9) == '00:00:59')
+    # Runs over a day long are not wrapped around
+    assert(flaccurate.commands.curate._duration(30 * 3600 + 61) == '30:01:01')
@@ -0,0 +1,183 @@
+import json
+import sqlite3
+import hashlib
+import argparse
+
+import pytest
+import flaccurate
+
+
+def _args(database):
+    return argparse.Namespace(debug=False, silent=False, quiet=False, force=True, database=database)
+
+
+def _v1_database(path, rows):
+    dbh = sqlite3.connect(path)
+    dbh.execute("CREATE TABLE checksums(filename text PRIMARY KEY, md5 text NOT NULL, filetype text NOT NULL)")
+    dbh.executemany("INSERT INTO checksums(filename, md5, filetype) values (?, ?, ?)", rows)
+    dbh.commit()
+    dbh.close()
+
+    with open(path, 'rb') as db_fileh:
+        md5 = hashlib.md5(db_fileh.read()).hexdigest()
+    with open(path + '.md5', 'w') as db_md5_fileh:
+        json.dump({path: {'md5': md5}}, db_md5_fileh)
+
+
+def test_new_database(tmp_path):
+    db = flaccurate.Database(_args(str(tmp_path / 'new.db')))
+    assert(db.dbh.execute('PRAGMA user_version').fetchone()[0] == db.SCHEMA_VERSION)
+
+    db._register_root(str(tmp_path / 'music'))
+    db._insert_checksum({
+        'filename': str(tmp_path / 'music/album/01.flac'),
+        'md5': '7828ad7e6a08d9e9fc4264e0c0db48db',
+        'filetype': 'flac'
+    })
+    assert(db._retrieve_checksum(str(tmp_path / 'music/album/01.flac')) == '7828ad7e6a08d9e9fc4264e0c0db48db')
+    assert(db._retrieve_checksum(str(tmp_path / 'music/album/02.flac')) == None)
+    assert(db.dbh.execute('SELECT path FROM directories').fetchall() == [('album',)])
+
+
+def test_migrate_v1(tmp_path):
+    db_file = str(tmp_path / 'v1.db')
+    _v1_database(db_file, [
+        (str(tmp_path / 'music/a/01.flac'), '7828ad7e6a08d9e9fc4264e0c0db48db', 'flac'),
+        (str(tmp_path / 'music/b/01.mp3'), '8d2772f663ce6cd424a36b37cc6d9c5f', 'mp3'),
+    ])
+
+    db = flaccurate.Database(_args(db_file))
+    assert(db.dbh.execute('PRAGMA user_version').fetchone()[0] == db.SCHEMA_VERSION)
+    assert(list(db.roots) == [str(tmp_path / 'music')])
+    assert(db._retrieve_checksum(str(tmp_path / 'music/a/01.flac')) == '7828ad7e6a08d9e9fc4264e0c0db48db')
+    assert(db._retrieve_checksum(str(tmp_path / 'music/b/01.mp3')) == '8d2772f663ce6cd424a36b37cc6d9c5f')
+    assert(db.dbh.execute("SELECT count(*) FROM sqlite_master WHERE name='checksums_v1'").fetchone()[0] == 0)
+
+
+def test_migrate_v4(tmp_path, monkeypatch):
+    db_file = str(tmp_path / 'v3.db')
+    _v1_database(db_file, [(str(tmp_path / 'music/a/01.flac'), '7828ad7e6a08d9e9fc4264e0c0db48db', 'flac')])
+    monkeypatch.setattr(flaccurate.Database, 'SCHEMA_VERSION', 3)
+    db = flaccurate.Database(_args(db_file))
+    assert(db.dbh.execute('PRAGMA user_version').fetchone()[0] == 3)
+    db.dbh.close()
+    monkeypatch.undo()
+
+    # Records from before additional digests have md5 alone, until a run records the others
+    db = flaccurate.Database(_args(db_file))
+    columns = [column[1] for column in db.dbh.execute('PRAGMA table_info(checksums)')]
+    assert({'sha256', 'blake2b'} <= set(columns))
+    assert(db._retrieve_digests(str(tmp_path / 'music/a/01.flac')) == {'md5': '7828ad7e6a08d9e9fc4264e0c0db48db'})
+
+    sha256 = hashlib.sha256(b'audio').hexdigest()
+    db._update_digests(str(tmp_path / 'music/a/01.flac'), {'sha256': sha256, 'md5': '0' * 32})
+    assert(db._retrieve_digests(str(tmp_path / 'music/a/01.flac')) == {'md5': '7828ad7e6a08d9e9fc4264e0c0db48db', 'sha256': sha256})
+
+
+def test_insert_checksums(tmp_path):
+    db = flaccurate.Database(_args(str(tmp_path / 'batch.db')))
+    db._register_root(str(tmp_path / 'music'))
+    db._insert_checksum({'filename': str(tmp_path / 'music/a/01.flac'), 'md5': '7828ad7e6a08d9e9fc4264e0c0db48db', 'filetype': 'flac'})
+
+    inserted = db._insert_checksums([
+        {'filename': str(tmp_path / 'music/a/01.flac'), 'md5': '071e0893b187bf7f9e3ad6e14fc7e589', 'filetype': 'flac'},
+        {'filename': str(tmp_path / 'music/a/02.flac'), 'md5': '071e0893b187bf7f9e3ad6e14fc7e589', 'filetype': 'flac'},
+        {'filename': str(tmp_path / 'music/b/01.mp3'), 'md5': '8d2772f663ce6cd424a36b37cc6d9c5f', 'filetype': 'mp3'},
+    ])
+    assert(inserted == {str(tmp_path / 'music/a/02.flac'): 2, str(tmp_path / 'music/b/01.mp3'): 3})
+    assert(db._retrieve_checksum(str(tmp_path / 'music/a/01.flac')) == '7828ad7e6a08d9e9fc4264e0c0db48db')
+    assert(db._retrieve_file_id(str(tmp_path / 'music/b/01.mp3')) == 3)
+
+    # Left out, as INSERT OR IGNORE leaves out anything breaking a constraint
+    assert(db._insert_checksums([
+        {'filename': str(tmp_path / 'music/c/01.flac'), 'md5': None, 'filetype': 'flac'},
+        {'filename': str(tmp_path / 'music/c/02.flac'), 'md5': '7828ad7e6a08d9e9fc4264e0c0db48db', 'filetype': 'flac'},
+    ]) == {str(tmp_path / 'music/c/02.flac'): 4})
+    assert(db._retrieve_checksum(str(tmp_path / 'music/c/01.flac')) == None)
+
+
+def test_batch(tmp_path, monkeypatch):
+    db = flaccurate.Database(_args(str(tmp_path / 'batch.db')))
+    db._register_root(str(tmp_path / 'music'))
+    updates = []
+    monkeypatch.setattr(db, '_calculate_db_checksum', lambda: updates.append(1))
+
+    with db._batch():
+        for i in range(3):
+            db._insert_checksum({'filename': str(tmp_path / ('music/%i.flac' % i)), 'md5': '7828ad7e6a08d9e9fc4264e0c0db48db', 'filetype': 'flac'})
+        assert(updates == [])
+    assert(updates == [1])
+
+
+def test_iterate_checksums(tmp_path):
+    db = flaccurate.Database(_args(str(tmp_path / 'roots.db')))
+    for root in ('music', 'backup'):
+        db._register_root(str(tmp_path / root))
+        for filename in ('a-b/01.flac', 'a/b/01.flac', 'a/01.flac'):
+            db._insert_checksum({'filename': str(tmp_path / root / filename), 'md5': '7828ad7e6a08d9e9fc4264e0c0db48db', 'filetype': 'flac'})
+
+    # One root at a time, in walk order
+    assert([(directory, basename) for directory, basename, md5, filetype in db._iterate_checksums(str(tmp_path / 'music'))] == [
+        ('a', '01.flac'), ('a/b', '01.flac'), ('a-b', '01.flac')])
+    assert([(directory, basename) for directory, basename, md5, filetype in db._iterate_checksums(str(tmp_path / 'backup/a'))] == [
+        ('', '01.flac'), ('b', '01.flac')])
+
+
+def test_rejects(tmp_path):
+    db = flaccurate.Database(_args(str(tmp_path / 'rejects.db')))
+    db._register_root(str(tmp_path / 'music'))
+
+    filename = str(tmp_path / 'music/album/partial.flac')
+    db._insert_reject(filename, 'undecodable', 1024, 1000)
+    db._insert_reject(filename, 'empty', 0, 2000)
+    assert(db._retrieve_rejects() == {filename: (0, 2000, 'empty', db._retrieve_rejects()[filename][3])})
+
+    db._delete_reject(filename)
+    assert(db._retrieve_rejects() == {})
+
+
+def test_listings(tmp_path):
+    db = flaccurate.Database(_args(str(tmp_path / 'listings.db')))
+    root = str(tmp_path / 'music')
+    db._register_root(root)
+
+    listings = {'': (1, ['album'], []), 'album': (2, [], ['01.flac', '02.flac'])}
+    db._update_listings(root, listings)
+    assert(db._retrieve_listings(root) == listings)
+
+    # A directory inside the root is part of it, not a root of its own
+    assert(db._register_root(root + '/album') == db.roots[root])
+    assert(db._retrieve_listings(root + '/album') == {'': listings['album']})
+
+
+def test_staging(tmp_path, monkeypatch):
+    db_file = str(tmp_path / 'staged.db')
+    args = _args(db_file)
+    args.staging = True
+    db = flaccurate.Database(args)
+    db._register_root(str(tmp_path / 'music'))
+    db._insert_checksum({
+        'filename': str(tmp_path / 'music/album/01.flac'),
+        'md5': '7828ad7e6a08d9e9fc4264e0c0db48db',
+        'filetype': 'flac'
+    })
+    # Nothing written until persisted
+    assert(not (tmp_path / 'staged.db').exists())
+    assert(not (tmp_path / 'staged.db.md5').exists())
+
+    db._close()
+    db = flaccurate.Database(_args(db_file))
+    assert(db._retrieve_checksum(str(tmp_path / 'music/album/01.flac')) == '7828ad7e6a08d9e9fc4264e0c0db48db')
+
+    # Checkpoints persist while staging
+    monkeypatch.setattr(flaccurate.Database, 'STAGING_CHECKPOINT', 0)
+    db = flaccurate.Database(args)
+    db._insert_checksum({
+        'filename': str(tmp_path / 'music/album/02.flac'),
+        'md5': '8d2772f663ce6cd424a36b37cc6d9c5f',
+        'filetype': 'flac'
+    })
+    assert(not db.staged)
+    db = flaccurate.Database(_args(db_file))
+    assert(db._retrieve_checksum(str(tmp_path / 'music/album/02.flac')) == '8d2772f663ce6cd424a36b37cc6d9c5f')
+    assert(not (tmp_path / 'staged.db.staging').exists())
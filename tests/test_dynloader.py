@@ -0,0 +1,68 @@
+import types
+import hashlib
+
+import pytest
+import flaccurate.dynloader
+
+
+def test_legacy_plugin():
+    module = types.SimpleNamespace(md5=lambda filename: 'legacy:' + filename)
+    plugin = flaccurate.dynloader.adapt('legacy', module)
+    assert(isinstance(plugin, flaccurate.dynloader.LegacyPlugin))
+    assert(plugin.md5('moo') == 'legacy:moo')
+
+
+def test_streaming_plugin_ranges(tmp_path):
+    audio_file = tmp_path / 'audio.raw'
+    audio_file.write_bytes(b'HEADER' + b'audio data' + b'TRAILER')
+
+    module = types.SimpleNamespace(API_VERSION=2, audio_ranges=lambda fileobj: [(6, 16)])
+    plugin = flaccurate.dynloader.adapt('raw', module)
+    assert(isinstance(plugin, flaccurate.dynloader.StreamingPlugin))
+    assert(plugin.md5(str(audio_file)) == hashlib.md5(b'audio data').hexdigest())
+    assert(plugin.md5(str(tmp_path / 'moo')) == None)
+
+
+def test_streaming_plugin_digests(tmp_path):
+    audio_file = tmp_path / 'audio.raw'
+    audio_file.write_bytes(b'HEADER' + b'audio data' + b'TRAILER')
+
+    # Every digest over the same audio, in the one pass
+    module = types.SimpleNamespace(API_VERSION=2, audio_ranges=lambda fileobj: [(6, 16)])
+    plugin = flaccurate.dynloader.adapt('raw', module)
+    assert(plugin.digests(str(audio_file), ('md5', 'sha256', 'blake2b')) == {
+        'md5': hashlib.md5(b'audio data').hexdigest(),
+        'sha256': hashlib.sha256(b'audio data').hexdigest(),
+        'blake2b': hashlib.blake2b(b'audio data').hexdigest(),
+    })
+    assert(plugin.digests(str(audio_file)) == {'md5': hashlib.md5(b'audio data').hexdigest()})
+
+
+def test_streaming_plugin_pcm(tmp_path):
+    audio_file = tmp_path / 'audio.raw'
+    audio_file.write_bytes(b'')
+
+    module = types.SimpleNamespace(API_VERSION=2, pcm=lambda fileobj, stream_info: iter([b'pcm ', b'data']))
+    plugin = flaccurate.dynloader.adapt('raw', module)
+    assert(plugin.md5(str(audio_file)) == hashlib.md5(b'pcm data').hexdigest())
+
+
+def test_coalesce():
+    buffers = [b'ab', b'cde', b'f', b'ghijklm', b'n']
+    gathered = [bytes(buffer) for buffer in flaccurate.dynloader.coalesce(iter(buffers), 4)]
+    assert(gathered == [b'ab', b'cdef', b'ghijklm', b'n'])
+
+
+def test_streaming_plugin_pcm_buffer(tmp_path):
+    audio_file = tmp_path / 'audio.raw'
+    audio_file.write_bytes(b'')
+
+    blocks = [bytes([i]) * 100 for i in range(10)]
+    module = types.SimpleNamespace(API_VERSION=2, pcm=lambda fileobj, stream_info: iter(blocks))
+    plugin = flaccurate.dynloader.adapt('raw', module)
+    flaccurate.dynloader.configure(pcm_buffer_size=256)
+    try:
+        digests = plugin.digests(str(audio_file), ('md5', 'sha256'))
+    finally:
+        flaccurate.dynloader.configure()
+    assert(digests == {'md5': hashlib.md5(b''.join(blocks)).hexdigest(), 'sha256': hashlib.sha256(b''.join(blocks)).hexdigest()})
@@ -0,0 +1,20 @@
+import pytest
+import flaccurate.history
+
+
+def test_run_bitmaps():
+    run = flaccurate.history.Run(1, 'curate')
+    run.record(flaccurate.history.VERIFIED, 1)
+    run.record(flaccurate.history.VERIFIED, 400000)
+    run.record(flaccurate.history.FAILED, 2)
+    run.record(flaccurate.history.INVALID)
+
+    assert(run.counts[flaccurate.history.VERIFIED] == 2)
+    assert(run.counts[flaccurate.history.INVALID] == 1)
+
+    bitmaps = run.encoded_bitmaps()
+    assert(set(bitmaps) == {flaccurate.history.VERIFIED, flaccurate.history.FAILED})
+
+    verified = flaccurate.history.decode(bitmaps[flaccurate.history.VERIFIED])
+    assert(len(bitmaps[flaccurate.history.VERIFIED]) < 200)
+    assert([flaccurate.history.test_bit(verified, i) for i in (0, 1, 2, 400000, 400001, 10**7)] == [False, True, False, True, False, False])
@@ -0,0 +1,78 @@
+import os
+import time
+import shutil
+import logging
+import threading
+
+import pytest
+import flaccurate
+import flaccurate.library
+
+
+MP3 = 'tests/test-data/good-data/mp3/id3v23.mp3'
+
+
+def test_settings():
+    args = flaccurate.library.settings(digests='sha256', workers=2)
+    assert((args.digests, args.workers, args.database) == ('sha256', 2, None))
+    with pytest.raises(TypeError):
+        flaccurate.library.settings(no_such_option=True)
+
+
+def test_missing_database(tmp_path):
+    with pytest.raises(RuntimeError):
+        flaccurate.Library(str(tmp_path / 'missing.db'))
+
+
+def test_logging(tmp_path, monkeypatch):
+    # Configuring logging is the embedding application's business alone
+    root = logging.getLogger()
+    monkeypatch.setattr(root, 'handlers', [])
+    level = root.level
+    with flaccurate.Library(str(tmp_path / 'library.db'), force=True) as library:
+        list(library.verify([str(tmp_path)]))
+    assert((root.handlers, root.level) == ([], level))
+
+
+def test_verify(tmp_path):
+    music = tmp_path / 'music'
+    (music / 'album').mkdir(parents=True)
+    shutil.copy(MP3, str(music / 'album/01.mp3'))
+    shutil.copy(MP3, str(music / 'album/02.mp3'))
+
+    with flaccurate.Library(str(tmp_path / 'library.db'), force=True) as library:
+        assert([result.outcome for result in library.verify([str(music)])] == ['not recorded', 'not recorded'])
+
+        results = sorted(library.verify([str(music)], record=True, workers=2, batch=1))
+        assert([(result.filename, result.outcome) for result in results] == [
+            (str(music / 'album/01.mp3'), 'inserted'), (str(music / 'album/02.mp3'), 'inserted')])
+        assert(results[0].digests['md5'] == results[1].digests['md5'])
+
+        with open(str(music / 'album/02.mp3'), 'r+b') as fileh:
+            fileh.seek(-1024, 2)
+            fileh.write(b'\xff' * 16)
+        results = sorted(library.verify([str(music / 'album/01.mp3'), str(music / 'album/02.mp3')]))
+        assert([result.ok for result in results] == [True, False])
+        assert(library.run.counts[flaccurate.history.FAILED] == 1)
+
+        assert([run[1] for run in library.database._retrieve_runs()] == ['library verify', 'library curate', 'library verify'])
+
+
+def test_verify_stopped(tmp_path):
+    music = tmp_path / 'music'
+    music.mkdir()
+    shutil.copy(MP3, str(tmp_path / 'track.mp3'))
+    for track in range(80):
+        os.link(str(tmp_path / 'track.mp3'), str(music / ('%02i.mp3' % track)))
+
+    with flaccurate.Library(str(tmp_path / 'library.db'), force=True) as library:
+        # More files than the result queue holds - the worker waits on it once full
+        results = library.verify([str(music)], record=True, workers=1)
+        next(results)
+        results.close()
+
+        deadline = time.monotonic() + 10
+        while(any(thread.name.startswith('run_lanes-') for thread in threading.enumerate()) and time.monotonic() < deadline):
+            time.sleep(0.05)
+        assert(not any(thread.name.startswith('run_lanes-') for thread in threading.enumerate()))
+        assert(library.run.counts[flaccurate.history.INSERTED] == 1)
@@ -0,0 +1,68 @@
+import types
+
+import pytest
+import flaccurate.dynloader
+import flaccurate.merkle
+
+
+def _segments(data, segment_bytes=10, chunk=7):
+    hasher = flaccurate.merkle.SegmentHasher(segment_bytes)
+    for offset in range(0, len(data), chunk):
+        hasher.update(data[offset:offset + chunk])
+    return hasher.hexdigest()
+
+
+def test_segment_hasher():
+    data = bytes(range(95))
+    segments = _segments(data)
+    segment_bytes, length, root, leaves = flaccurate.merkle.unpack(segments)
+    assert((segment_bytes, length, len(leaves)) == (10, 95, 10))
+    assert(root == flaccurate.merkle.root(leaves))
+    # Independent of how the data arrives
+    assert(_segments(data, chunk=1) == segments)
+    assert(_segments(data, chunk=95) == segments)
+
+
+def test_compare():
+    data = bytearray(range(95))
+    segments = _segments(bytes(data))
+    assert(flaccurate.merkle.compare(segments, segments) == [])
+
+    data[42] ^= 0xFF
+    data[90] ^= 0xFF
+    assert(flaccurate.merkle.compare(segments, _segments(bytes(data))) == [4, 9])
+    assert(flaccurate.merkle.compare(segments, _segments(bytes(data[:-1]))) is None)
+
+
+def test_file_ranges():
+    ranges = [(100, 105), (200, 220)]
+    assert(flaccurate.merkle.file_ranges(ranges, 0, 10) == [(100, 105), (200, 205)])
+    assert(flaccurate.merkle.file_ranges(ranges, 1, 10) == [(205, 215)])
+    assert(flaccurate.merkle.file_ranges(ranges, 2, 10) == [(215, 220)])
+
+
+def test_check(tmp_path):
+    audio_file = tmp_path / 'audio.raw'
+    audio = bytes(range(256)) * 40
+    audio_file.write_bytes(b'HEADER' + audio + b'TRAILER')
+
+    module = types.SimpleNamespace(API_VERSION=2, audio_ranges=lambda fileobj: [(6, fileobj.seek(0, 2) - 7)])
+    plugin = flaccurate.dynloader.adapt('raw', module)
+    segments = plugin.digests(str(audio_file), ('md5', 'segments'))['segments']
+    assert(segments == _segments(audio, flaccurate.merkle.SEGMENT_BYTES))
+    assert(plugin.check_segments(str(audio_file), segments) == [])
+
+    # Small segments, so there are several to check in parallel or at random
+    segments = _segments(audio, 1000)
+    assert(plugin.check_segments(str(audio_file), segments) == [])
+    assert(plugin.check_segments(str(audio_file), segments, count=3) == [])
+
+    damaged = bytearray(audio)
+    damaged[5500] ^= 0xFF
+    audio_file.write_bytes(b'HEADER' + damaged + b'TRAILER')
+    assert(plugin.check_segments(str(audio_file), segments) == [5])
+    assert(plugin.check_segments(str(audio_file), segments, indexes=[0, 1]) == [])
+
+    audio_file.write_bytes(b'HEADER' + audio[:-1] + b'TRAILER')
+    with pytest.raises(ValueError):
+        plugin.check_segments(str(audio_file), segments)
@@ -25,3 +25,58 @@ def test_invalid():
 )
 def test_valid(input_file, output_md5):
     assert(plugins.mp3.md5(input_file) == output_md5)
+
+
+def _frame_index(data, chunk=4096):
+    index = plugins.mp3.FrameIndex()
+    for offset in range(0, len(data), chunk):
+        index.update(data[offset:offset + chunk])
+    return index.hexdigest()
+
+
+def _audio(input_file):
+    with open(input_file, 'rb') as mp3_fh:
+        (start, finish), = plugins.mp3.audio_ranges(mp3_fh)
+        mp3_fh.seek(start)
+        return mp3_fh.read(finish - start)
+
+
+def test_frame_index():
+    data = _audio('tests/test-data/good-data/mp3/id3v24.mp3')
+    index = _frame_index(data)
+    (first, end, frames), groups = plugins.mp3.unpack_index(index)
+    assert((first, end) == (0, len(data)))
+    assert(frames > 0 and len(groups) > 1)
+    # Independent of how the data arrives
+    assert(_frame_index(data, 1000) == index)
+    assert(_frame_index(data, len(data)) == index)
+
+
+@pytest.mark.parametrize("input_file", [
+     'tests/test-data/good-data/mp3/id3v1.mp3',
+     'tests/test-data/good-data/mp3/id3v23.mp3',
+     ]
+)
+def test_frame_index_same_audio(input_file):
+    assert(_frame_index(_audio(input_file)) == _frame_index(_audio('tests/test-data/good-data/mp3/id3v24_empty.mp3')))
+
+
+def test_compare_index():
+    data = _audio('tests/test-data/good-data/mp3/id3v24.mp3')
+    index = _frame_index(data)
+
+    # Junk around the frames leaves them all unchanged
+    assert(plugins.mp3.compare_index(index, _frame_index(b'junk' + data + b'APETAGEX' + bytes(100))) == [])
+
+    # Damage within a frame (past its header) is narrowed down to its group
+    (first, end, frames), recorded_groups = plugins.mp3.unpack_index(index)
+    offset = recorded_groups[2][0] + 10
+    damaged = bytearray(data)
+    damaged[offset] ^= 0x01
+    groups = plugins.mp3.compare_index(index, _frame_index(bytes(damaged)))
+    assert(len(groups) == 1)
+    start, length, digest = groups[0]
+    assert(start <= offset < start + length)
+
+    # Frames removed cannot be compared group by group
+    assert(plugins.mp3.compare_index(index, _frame_index(data[:recorded_groups[1][0]])) is None)
@@ -0,0 +1,41 @@
+import pstats
+
+import pytest
+import flaccurate.profiler
+
+
+def _work():
+    with flaccurate.profiler.stage('checksum', 'flac'):
+        return sum(i * i for i in range(200000))
+
+
+def test_stage_inactive():
+    assert(flaccurate.profiler._active is None)
+    with flaccurate.profiler.stage('checksum', 'flac'):
+        pass
+
+
+@pytest.mark.parametrize("mode, profile_file", [
+     ('sample', 'profile.collapsed'),
+     ('deterministic', 'profile.pstats'),
+     ]
+)
+def test_profiler(tmp_path, mode, profile_file):
+    output = str(tmp_path / 'profile')
+    with flaccurate.profiler.Profiler(mode, memory=True, output=output) as profiler:
+        for i in range(3):
+            _work()
+    assert(flaccurate.profiler._active is None)
+
+    calls, seconds, longest, memory = profiler.stages[('checksum', 'flac')]
+    assert(calls == 3 and seconds >= longest > 0)
+    report = (tmp_path / 'profile.txt').read_text()
+    assert('checksum     flac' in report)
+    assert('Memory: peak' in report)
+    assert((tmp_path / profile_file).exists())
+    if(mode == 'deterministic'):
+        assert(pstats.Stats(str(tmp_path / profile_file)).total_calls > 0)
+    else:
+        for line in (tmp_path / profile_file).read_text().splitlines():
+            stack, count = line.rsplit(' ', 1)
+            assert(int(count) > 0)
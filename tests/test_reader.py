@@ -0,0 +1,64 @@
+import os
+import types
+
+import pytest
+import flaccurate.reader
+
+
+@pytest.fixture
+def audio_file(tmp_path):
+    # Not a multiple of the alignment, and larger than the O_DIRECT buffer
+    data = bytes(range(256)) * ((flaccurate.reader.DIRECT_BUFFER_SIZE + 5000) // 256)
+    filename = tmp_path / 'audio.raw'
+    filename.write_bytes(data)
+    yield str(filename), data
+    flaccurate.reader.configure()
+
+
+def test_throttle(monkeypatch):
+    clock = types.SimpleNamespace(now=100.0, slept=[])
+    monkeypatch.setattr(flaccurate.reader.time, 'monotonic', lambda: clock.now)
+    monkeypatch.setattr(flaccurate.reader.time, 'sleep', clock.slept.append)
+
+    throttle = flaccurate.reader.Throttle(1000)
+    throttle.consume(1000)
+    throttle.consume(500)
+    assert(clock.slept == [0.5])
+
+    # Refilled at the rate, but never beyond one second worth
+    clock.now += 10
+    throttle.consume(1000)
+    throttle.consume(250)
+    assert(clock.slept == [0.5, 0.25])
+
+
+def test_direct(audio_file, monkeypatch):
+    filename, data = audio_file
+    # The aligned buffer handling, on filesystems without O_DIRECT too
+    monkeypatch.setattr(os, 'O_DIRECT', 0, raising=False)
+    flaccurate.reader.configure(direct=True)
+
+    with flaccurate.reader.Reader(filename) as reader:
+        assert(reader.direct)
+        assert(reader.read(10) == data[:10])
+        # Unaligned, and across the end of the buffer
+        reader.seek(flaccurate.reader.DIRECT_BUFFER_SIZE - 3000)
+        assert(reader.read(6000) == data[flaccurate.reader.DIRECT_BUFFER_SIZE - 3000:flaccurate.reader.DIRECT_BUFFER_SIZE + 3000])
+        assert(b''.join(bytes(piece) for piece in flaccurate.reader.iter_range(reader, 5000, len(data))) == data[5000:])
+        assert(reader.read() == b'')
+
+
+def test_read_ahead(audio_file, monkeypatch):
+    filename, data = audio_file
+    advice = []
+    monkeypatch.setattr(os, 'posix_fadvise', lambda fd, offset, length, kind: advice.append((offset, length, kind)), raising=False)
+    flaccurate.reader.configure(buffer_size=65536, read_ahead=4)
+
+    with flaccurate.reader.Reader(filename) as reader:
+        for piece in flaccurate.reader.iter_range(reader, 0, len(data)):
+            pass
+
+    # Renewed every half window, after the hint for the whole file on open
+    assert(advice[0] == (0, 0, os.POSIX_FADV_SEQUENTIAL))
+    assert(advice[1:-1] == [(offset, 4 * 65536, os.POSIX_FADV_WILLNEED) for offset in range(0, len(data), 2 * 65536)])
+    assert(advice[-1] == (0, 0, os.POSIX_FADV_DONTNEED))
@@ -0,0 +1,31 @@
+import pytest
+import flaccurate.rules
+
+
+@pytest.mark.parametrize("pattern, path, is_directory, excluded", [
+     ('@eaDir/', '@eaDir', True, True),
+     ('@eaDir/', 'a/b/@eaDir', True, True),
+     ('@eaDir/', 'a/@eaDir', False, False),
+     ('*.part', 'a/b/01.part', False, True),
+     ('*.part', 'a/b/01.flac', False, False),
+     ('/Incoming', 'Incoming', True, True),
+     ('/Incoming', 'a/Incoming', True, False),
+     ('a/*.flac', 'a/01.flac', False, True),
+     ('a/*.flac', 'a/b/01.flac', False, False),
+     ('a/**/*.flac', 'a/b/c/01.flac', False, True),
+     ('**/Samples', 'x/y/Samples', True, True),
+     ('0?.flac', '01.flac', False, True),
+     ('0[!1].flac', '01.flac', False, False),
+     ('0[!1].flac', '02.flac', False, True),
+     ]
+)
+def test_pattern(pattern, path, is_directory, excluded):
+    assert(flaccurate.rules.Rules([pattern]).excluded(path, is_directory) == excluded)
+
+
+def test_last_rule_decides():
+    rules = flaccurate.rules.Rules(['# comment', '', '*.flac', '!keep/*.flac', 'keep/bad.flac'])
+    assert(rules.excluded('a/01.flac'))
+    assert(not rules.excluded('keep/01.flac'))
+    assert(rules.excluded('keep/bad.flac'))
+    assert(not flaccurate.rules.Rules(['# comment']))
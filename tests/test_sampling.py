@@ -0,0 +1,34 @@
+import random
+
+import pytest
+import flaccurate.sampling
+
+
+def test_allocate_proportional():
+    allocation = flaccurate.sampling.allocate({'a': 700, 'b': 200, 'c': 99, 'd': 1}, 10)
+    assert(sum(allocation.values()) == 10)
+    assert(allocation['a'] == 7 and allocation['b'] == 2)
+
+    # A sample larger than the library takes everything
+    assert(flaccurate.sampling.allocate({'a': 3, 'b': 2}, 10) == {'a': 3, 'b': 2})
+
+
+def test_draw_stratified():
+    strata = flaccurate.sampling.stratify(range(1000), lambda i: i % 4)
+    sample = flaccurate.sampling.draw(strata, 100, random.Random(1))
+    assert(len(sample) == len(set(sample)) == 100)
+    assert(all(sum(1 for i in sample if i % 4 == stratum) == 25 for stratum in range(4)))
+
+
+def test_wilson_interval():
+    low, high = flaccurate.sampling.wilson_interval(0, 100)
+    assert(low == 0.0 and 0.03 < high < 0.04)
+
+    low, high = flaccurate.sampling.wilson_interval(10, 100)
+    assert(0.05 < low < 0.1 < high < 0.18)
+
+    assert(flaccurate.sampling.wilson_interval(0, 0) == (0.0, 1.0))
+
+
+def test_size_class():
+    assert([flaccurate.sampling.size_class(size) for size in (None, 0, 2 * 1024 * 1024, 10 ** 9)] == [None, 0, 1, 3])
@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+
+import pytest
+import flaccurate.scheduler
+
+
+def test_longest_first(tmp_path):
+    unmeasured = tmp_path / 'new.flac'
+    unmeasured.write_bytes(bytes(3000))
+
+    model = flaccurate.scheduler.CostModel({
+        'a.flac': (1000, 44100, 44100, 16, 1.0),
+        'b.flac': (4000, 176400, 44100, 16, 4.0),
+        'c.mp3': (2000, None, None, None, None),
+    })
+    assert(model.rate == 1000)
+
+    planned = flaccurate.scheduler.longest_first([('a.flac', 'flac'), ('c.mp3', 'mp3'), (str(unmeasured), 'flac'), ('b.flac', 'flac')], model)
+    assert([filename for estimate, filename, filetype in planned] == ['b.flac', str(unmeasured), 'c.mp3', 'a.flac'])
+    assert([estimate for estimate, filename, filetype in planned] == [4.0, 3.0, 2.0, 1.0])
+
+
+def test_cost_model(tmp_path):
+    for name in ('new.flac', 'new.mp3', 'new.ogg'):
+        (tmp_path / name).write_bytes(bytes(3000))
+
+    model = flaccurate.scheduler.CostModel({
+        'a.flac': (1000, 44100, 44100, 16, 1.0),
+        'b.flac': (1000, 132300, 44100, 16, 3.0),
+        'c.mp3': (4000, None, None, None, 1.0),
+        'd.flac': (2000, 441000, 44100, 16, None),
+    })
+    assert((model.decode_rates, model.rates, model.rate) == ({'flac': 88200}, {'flac': 500, 'mp3': 4000}, 1200))
+
+    # Decoded PCM bytes over the filetype's decode rate, measured or not
+    assert([model.estimate(filename) for filename in ('a.flac', 'b.flac', 'c.mp3', 'd.flac')] == [1.0, 3.0, 1.0, 10.0])
+    # Size over the filetype's byte rate - the rate across every file without one
+    assert([model.estimate(str(tmp_path / name)) for name in ('new.flac', 'new.mp3', 'new.ogg')] == [6.0, 0.75, 2.5])
+
+
+def test_progress():
+    progress = flaccurate.scheduler.Progress([4.0, 2.0, 2.0], 2)
+    assert(progress.eta() == 4.0)
+
+    # Work taking twice as long as estimated doubles the estimate of what is left
+    progress.started -= 4.0
+    progress.update(4.0)
+    assert(3.9 < progress.eta() < 4.1)
+
+
+def _lane_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith('run_lanes-')]
+
+
+def _wait_for_lanes(timeout=10):
+    deadline = time.monotonic() + timeout
+    while(_lane_threads() and time.monotonic() < deadline):
+        time.sleep(0.05)
+    return _lane_threads()
+
+
+def test_run_lanes_stopped():
+    # Workers blocked on the full queue give up once the consumer closes it
+    results = flaccurate.scheduler.run_lanes([[(i,) for i in range(100)]] * 2, lambda i: i, queue_size=1)
+    next(results)
+    results.close()
+    assert(_wait_for_lanes() == [])
+
+
+def test_run_lanes():
+    def worker(name, number):
+        if(number == 3):
+            raise ValueError('unreadable')
+        return name, number * number
+
+    lanes = [[('a', number) for number in range(5)], [('b', number) for number in range(5)]]
+    results = list(flaccurate.scheduler.run_lanes(lanes, worker))
+    # In order within a lane, failures left out
+    assert([result for result in results if result[0] == 'a'] == [('a', 0), ('a', 1), ('a', 4), ('a', 16)])
+    assert(len(results) == 8)
+
+    results = flaccurate.scheduler.run_lanes(lanes, worker, workers_per_lane=3, failed=lambda name, number: (name, None))
+    assert(sorted(results, key=str) == sorted([(name, number * number) for name in 'ab' for number in (0, 1, 2, 4)] + [('a', None), ('b', None)], key=str))
+
+
+def test_device_lanes(tmp_path):
+    for name in ('b.flac', 'a.flac', 'c.mp3'):
+        (tmp_path / name).write_bytes(bytes(8192))
+    files = [(str(tmp_path / name), name[-4:].lstrip('.')) for name in ('b.flac', 'a.flac', 'c.mp3')]
+    missing = (str(tmp_path / 'missing.flac'), 'flac')
+
+    lanes = flaccurate.scheduler.device_lanes(files + [missing])
+    # One device, with a lane of its own for what cannot be stat'd
+    assert(len(lanes) == 2)
+    assert(sorted(lanes[0]) == sorted(files))
+    assert(lanes[1] == [missing])
+
+    # In on-disk order: physical offset where known, otherwise inode
+    def layout(item):
+        offset = flaccurate.scheduler.physical_offset(item[0])
+        return (offset if offset is not None else -1, os.stat(item[0]).st_ino)
+    assert(lanes[0] == sorted(files, key=layout))
+
+
+def test_physical_offset(tmp_path, monkeypatch):
+    (tmp_path / 'empty.flac').write_bytes(b'')
+    (tmp_path / 'data.flac').write_bytes(bytes(65536))
+    os.sync()
+
+    # No extents, no such file
+    assert(flaccurate.scheduler.physical_offset(str(tmp_path / 'empty.flac')) is None)
+    assert(flaccurate.scheduler.physical_offset(str(tmp_path / 'missing.flac')) is None)
+
+    # FIEMAP is not available everywhere - tmpfs for one
+    offset = flaccurate.scheduler.physical_offset(str(tmp_path / 'data.flac'))
+    assert(offset is None or offset >= 0)
+
+    monkeypatch.setattr(flaccurate.scheduler, 'fcntl', None)
+    assert(flaccurate.scheduler.physical_offset(str(tmp_path / 'data.flac')) is None)
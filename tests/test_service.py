@@ -0,0 +1,71 @@
+import socket
+import argparse
+import threading
+
+import pytest
+import flaccurate.service
+
+
+def test_socket_path():
+    assert(flaccurate.service.socket_path(argparse.Namespace(socket=None, database=None)) == 'flaccurate.db.sock')
+    assert(flaccurate.service.socket_path(argparse.Namespace(socket=None, database='x.db')) == 'x.db.sock')
+    assert(flaccurate.service.socket_path(argparse.Namespace(socket='/run/f.sock', database='x.db')) == '/run/f.sock')
+
+
+def test_no_service(tmp_path):
+    assert(list(flaccurate.service.request(str(tmp_path / 'missing.sock'), {'action': 'status'})) == [])
+
+    # A socket file nobody is listening on
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(tmp_path / 'stale.sock'))
+    stale.close()
+    assert(list(flaccurate.service.request(str(tmp_path / 'stale.sock'), {'action': 'status'})) == [])
+
+
+def test_request(tmp_path):
+    path = str(tmp_path / 'service.sock')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+
+    def serve():
+        connection, address = server.accept()
+        with connection, connection.makefile('rwb') as stream:
+            message = next(flaccurate.service.receive(stream))
+            for filename in message['paths']:
+                flaccurate.service.send(stream, {'filename': filename, 'filetype': 'flac', 'outcome': 'verified'})
+            flaccurate.service.send(stream, {'done': True, 'counts': {'verified': len(message['paths'])}})
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    responses = list(flaccurate.service.request(path, {'action': 'verify', 'paths': ['/a.flac', '/b.flac']}))
+    thread.join()
+    server.close()
+
+    assert([response.get('filename') for response in responses] == ['/a.flac', '/b.flac', None])
+    assert(responses[-1] == {'done': True, 'counts': {'verified': 2}})
+
+
+def test_local_options():
+    args = argparse.Namespace(digests=None, schedule='glob', rescan=False, spot_check=0, io_direct=True)
+    assert(flaccurate.service.local_options(args) == ['--spot-check', '--io-direct'])
+    # A profile of the work is only had from doing it here
+    args = argparse.Namespace(profile='sample', profile_memory=False)
+    assert(flaccurate.service.local_options(args) == ['--profile'])
+    args = argparse.Namespace(socket=None, database=None, input='/music', schedule='glob', rescan=False)
+    assert(flaccurate.service.local_options(args) == [])
+
+
+def test_curate_local_options(tmp_path):
+    # Never asks a service which would ignore the options given
+    path = str(tmp_path / 'service.sock')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    server.settimeout(0.1)
+
+    args = argparse.Namespace(socket=path, database=None, input='/music', digests='sha256')
+    assert(flaccurate.service.curate(args) is None)
+    with pytest.raises(socket.timeout):
+        server.accept()
+    server.close()
@@ -0,0 +1,37 @@
+import pytest
+import flaccurate.shard
+
+
+ENTRIES = [['a/01.flac', 'flac', {}], ['a/02.flac', 'flac', {}], ['b/01.mp3', 'mp3', {}], ['c/01.flac', 'flac', {}], ['c/02.flac', 'flac', {}]]
+SIZES = {'a/01.flac': 10, 'a/02.flac': 10, 'b/01.mp3': 5, 'c/01.flac': 30, 'c/02.flac': 1}
+
+
+def _paths(shards):
+    return [[entry[0] for entry in shard] for shard in shards]
+
+
+def test_split_path():
+    assert(_paths(flaccurate.shard.split(ENTRIES, 2, 'path')) == [['a/01.flac', 'a/02.flac', 'b/01.mp3'], ['c/01.flac', 'c/02.flac']])
+
+
+def test_split_directory():
+    # Directories are never split - the three of them go two and one
+    assert(_paths(flaccurate.shard.split(ENTRIES, 2, 'directory')) == [['a/01.flac', 'a/02.flac', 'b/01.mp3'], ['c/01.flac', 'c/02.flac']])
+
+
+def test_split_bytes():
+    shards = _paths(flaccurate.shard.split(ENTRIES, 2, 'bytes', SIZES.get))
+    assert(sorted(sum(SIZES[path] for path in shard) for shard in shards) == [26, 30])
+
+
+def test_lines(tmp_path):
+    filename = flaccurate.shard.manifest_filename(str(tmp_path), 'abc', 1, 2)
+    flaccurate.shard.write_lines(filename, {'export': 'abc'}, iter(ENTRIES))
+    header, lines = flaccurate.shard.read_lines(filename)
+    assert(header == {'export': 'abc', 'version': flaccurate.shard.FORMAT_VERSION})
+    assert(list(lines) == ENTRIES)
+    assert(flaccurate.shard.results_filename(filename) == str(tmp_path / 'shard-abc-001-of-002.results'))
+
+    (tmp_path / 'junk').write_text('hello\n')
+    with pytest.raises(ValueError):
+        flaccurate.shard.read_lines(str(tmp_path / 'junk'))
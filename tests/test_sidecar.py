@@ -0,0 +1,91 @@
+import shutil
+import hashlib
+import logging
+
+import pytest
+import flaccurate.library
+import flaccurate.sidecar
+import flaccurate.commands.sidecar
+import flaccurate.commands.compare
+import flaccurate.commands.curate
+
+
+def test_walk_key():
+    directories = ['a-b', 'a/b', '', 'a', 'b']
+    assert(sorted(directories, key=flaccurate.sidecar.walk_key) == ['', 'a', 'a/b', 'a-b', 'b'])
+
+
+def test_walk(tmp_path):
+    (tmp_path / 'a/b').mkdir(parents=True)
+    (tmp_path / 'a-b').mkdir()
+    (tmp_path / 'a/b/b.ffp').write_text('02.flac:071E0893B187BF7F9E3AD6E14FC7E589\n01.flac:7828ad7e6a08d9e9fc4264e0c0db48db\n')
+    (tmp_path / 'a-b/a-b.md5').write_text('; comment\n8d2772f663ce6cd424a36b37cc6d9c5f *01.mp3\nnot a checksum\n')
+
+    assert(list(flaccurate.sidecar.walk(str(tmp_path))) == [
+        ('a/b', '01.flac', '7828ad7e6a08d9e9fc4264e0c0db48db', '.ffp'),
+        ('a/b', '02.flac', '071e0893b187bf7f9e3ad6e14fc7e589', '.ffp'),
+        ('a-b', '01.mp3', '8d2772f663ce6cd424a36b37cc6d9c5f', '.md5'),
+    ])
+
+
+def test_write_sidecar(tmp_path):
+    filename = str(tmp_path / 'album.ffp')
+    entries = [('01.flac', '7828ad7e6a08d9e9fc4264e0c0db48db'), ('02.flac', '071e0893b187bf7f9e3ad6e14fc7e589')]
+
+    assert(flaccurate.sidecar.write_sidecar(filename, entries) == True)
+    assert(list(flaccurate.sidecar.read_sidecar(filename)) == entries)
+    assert(flaccurate.sidecar.write_sidecar(filename, entries) == False)
+    assert(flaccurate.sidecar.write_sidecar(filename, entries[:1]) == None)
+    assert(flaccurate.sidecar.write_sidecar(filename, entries[:1], replace=True) == True)
+    assert(list(flaccurate.sidecar.read_sidecar(filename)) == entries[:1])
+
+    # Audio md5s in md5sum format would fail md5sum -c
+    with pytest.raises(KeyError):
+        flaccurate.sidecar.write_sidecar(str(tmp_path / 'album.md5'), entries)
+
+
+def test_file_md5(tmp_path):
+    filename = tmp_path / '01.mp3'
+    filename.write_bytes(b'\xff' * (flaccurate.sidecar.BLOCK_SIZE + 1))
+    assert(flaccurate.sidecar.file_md5(str(filename)) == hashlib.md5(filename.read_bytes()).hexdigest())
+
+
+def test_import(tmp_path):
+    (tmp_path / 'album').mkdir()
+    for track in ('01.mp3', '02.mp3'):
+        shutil.copy('tests/test-data/good-data/mp3/id3v23.mp3', str(tmp_path / 'album' / track))
+    # md5sum of one file, and what is not the md5 of the other
+    (tmp_path / 'album/album.md5').write_text('%s *01.mp3\n%s *02.mp3\n' % (
+        flaccurate.sidecar.file_md5(str(tmp_path / 'album/01.mp3')), '0' * 32))
+
+    args = flaccurate.library.settings(database=str(tmp_path / 'library.db'), input=str(tmp_path / 'album'), force=True)
+    args.sidecar_action = 'import'
+    sidecar = flaccurate.commands.sidecar.Sidecar(args)
+    sidecar.run()
+
+    db = sidecar.db
+    md5 = sidecar.plugins.plugin('mp3').digests(str(tmp_path / 'album/01.mp3'))['md5']
+    assert(db._retrieve_checksum(str(tmp_path / 'album/01.mp3')) == md5)
+    assert(db._retrieve_checksum(str(tmp_path / 'album/02.mp3')) is None)
+    sidecar.context.close()
+
+
+def test_compare_md5(tmp_path, caplog):
+    (tmp_path / 'album').mkdir()
+    for track in ('01.mp3', '02.mp3', '03.mp3'):
+        shutil.copy('tests/test-data/good-data/mp3/id3v23.mp3', str(tmp_path / 'album' / track))
+    args = flaccurate.library.settings(database=str(tmp_path / 'library.db'), input=str(tmp_path / 'album'), force=True)
+    curate = flaccurate.commands.curate.Curate(args)
+    curate.run()
+    audio_md5 = curate.db._retrieve_checksum(str(tmp_path / 'album/01.mp3'))
+    curate.context.close()
+
+    # md5sum of the whole file, an audio md5 as once exported, and neither
+    (tmp_path / 'album/album.md5').write_text('%s *01.mp3\n%s *02.mp3\n%s *03.mp3\n' % (
+        flaccurate.sidecar.file_md5(str(tmp_path / 'album/01.mp3')), audio_md5, '0' * 32))
+    args.compare = str(tmp_path / 'album')
+    caplog.set_level(logging.INFO)
+    compare = flaccurate.commands.compare.Compare(args)
+    compare.run()
+    compare.context.close()
+    assert('Compare complete: 2 matched, 0 missing, 0 extra, 1 mismatched' in caplog.text)
@@ -0,0 +1,52 @@
+import types
+
+import pytest
+import flaccurate.tuning
+
+MB = 1024 * 1024
+
+
+def test_recommend():
+    # Storage four times faster than a core decodes - four workers, the
+    # smallest buffer within 5% of the fastest
+    tuning = flaccurate.tuning.recommend({256 * 1024: 390 * MB, 1024 * 1024: 400 * MB, 4096 * 1024: 400 * MB}, 100 * MB, 500 * MB, 8)
+    assert(tuning == {'workers': 4, 'read_buffer': 256, 'read_ahead': 39})
+
+    # Never more workers than cores, nor fewer than one
+    assert(flaccurate.tuning.recommend({MB: 4000 * MB}, 100 * MB, 500 * MB, 2)['workers'] == 2)
+    assert(flaccurate.tuning.recommend({MB: 10 * MB}, None, 500 * MB, 8)['workers'] == 1)
+
+    # Without the storage measured
+    assert(flaccurate.tuning.recommend({}, 100 * MB, 500 * MB, 8) == {'workers': 8, 'read_buffer': 1024, 'read_ahead': 0})
+
+
+def test_smallest_within_margin():
+    assert(flaccurate.tuning.smallest_within_margin({0: 24 * MB, 256 * 1024: 22 * MB, 1024 * 1024: 25 * MB}) == 0)
+    assert(flaccurate.tuning.smallest_within_margin({0: 20 * MB, 256 * 1024: 22 * MB, 1024 * 1024: 22 * MB}) == 256 * 1024)
+
+
+def test_measure_read(tmp_path):
+    for i in range(3):
+        (tmp_path / ('%i.flac' % i)).write_bytes(bytes(300 * 1024))
+    rates = flaccurate.tuning.measure_read(flaccurate.tuning._files(str(tmp_path), {'flac'}), (64 * 1024, 128 * 1024), 400 * 1024)
+    assert(sorted(rates) == [64 * 1024, 128 * 1024])
+    assert(all(rate > 0 for rate in rates.values()))
+
+
+def test_apply(tmp_path):
+    tuning_file = str(tmp_path / 'tuning.json')
+    flaccurate.tuning.save(tuning_file, {'workers': 4, 'read_buffer': 256, 'read_ahead': 8, 'measured': {}})
+
+    # Only what the command line left out
+    args = types.SimpleNamespace(tuning=tuning_file, workers=2, read_buffer=None, read_ahead=None)
+    flaccurate.tuning.apply(args)
+    assert((args.workers, args.read_buffer, args.read_ahead) == (2, 256, 8))
+
+    # Not the threads per device
+    args = types.SimpleNamespace(tuning=tuning_file, schedule='device', workers=None, read_buffer=None, read_ahead=None)
+    flaccurate.tuning.apply(args)
+    assert((args.workers, args.read_buffer, args.read_ahead) == (None, 256, 8))
+
+    args = types.SimpleNamespace(tuning=str(tmp_path / 'missing.json'), workers=None, read_buffer=None, read_ahead=None)
+    flaccurate.tuning.apply(args)
+    assert((args.workers, args.read_buffer, args.read_ahead) == (None, None, None))
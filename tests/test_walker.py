@@ -0,0 +1,65 @@
+import os
+
+import pytest
+import flaccurate.rules
+import flaccurate.walker
+
+
+def _library(tmp_path):
+    for path in ('a/01.flac', 'a/cover.jpg', 'b/c/01.mp3', '.Trash/01.flac', 'a/.hidden.flac'):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_bytes(b'')
+    # Old enough to be trusted, see: flaccurate.walker.RACY_NS
+    for directory in ('', 'a', 'b', 'b/c'):
+        os.utime(tmp_path / directory, ns=(10 ** 18, 10 ** 18))
+
+
+def test_walk(tmp_path):
+    _library(tmp_path)
+    walker = flaccurate.walker.Walker(str(tmp_path))
+    assert(list(walker.walk()) == [
+        (str(tmp_path), []),
+        (str(tmp_path / 'a'), ['01.flac', 'cover.jpg']),
+        (str(tmp_path / 'b'), []),
+        (str(tmp_path / 'b/c'), ['01.mp3']),
+    ])
+    assert((walker.scanned, walker.reused) == (4, 0))
+    assert(walker.changed['a'] == (10 ** 18, [], ['01.flac', 'cover.jpg']))
+
+
+def test_walk_reuses_unchanged(tmp_path):
+    _library(tmp_path)
+    first = flaccurate.walker.Walker(str(tmp_path))
+    walked = list(first.walk())
+
+    # A stale listing with an unchanged mtime is trusted - proving it was not read
+    listings = dict(first.changed)
+    listings['a'] = (10 ** 18, [], ['stale.flac'])
+    (tmp_path / 'b/c/02.mp3').write_bytes(b'')
+    os.utime(tmp_path / 'b/c', ns=(10 ** 18, 10 ** 18 + 1))
+
+    second = flaccurate.walker.Walker(str(tmp_path), listings)
+    assert(dict(second.walk())[str(tmp_path / 'a')] == ['stale.flac'])
+    assert(dict(second.walk())[str(tmp_path / 'b/c')] == ['01.mp3', '02.mp3'])
+    assert((second.scanned, second.reused) == (1, 3))
+    assert(list(second.changed) == ['b/c'])
+
+    rescan = flaccurate.walker.Walker(str(tmp_path), listings, rescan=True)
+    assert(dict(rescan.walk())[str(tmp_path / 'a')] == ['01.flac', 'cover.jpg'])
+
+
+def test_rules(tmp_path):
+    for path in ('a/01.flac', 'a/@eaDir/01.flac/thumb.jpg', 'b/Samples/s.flac', 'b/02.flac', 'b/02.part', 'keep.part'):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_bytes(b'')
+    (tmp_path / flaccurate.rules.IGNORE_FILE).write_text('# thumbnails\n@eaDir/\n*.part\n')
+
+    rules = flaccurate.rules.load(str(tmp_path), exclude=['/b/Samples'], include=['/keep.part'])
+    walker = flaccurate.walker.Walker(str(tmp_path), rules=rules)
+    walked = {os.path.relpath(directory, str(tmp_path)): files for directory, files in walker.walk()}
+    assert(walked == {'.': ['keep.part'], 'a': ['01.flac'], 'b': ['02.flac']})
+    assert(walker.pruned == {'a/@eaDir', 'b/Samples'})
+
+    assert(rules.pruned('a/@eaDir/01.flac/thumb.jpg'))
+    assert(rules.pruned('b/Samples/s.flac'))
+    assert(not rules.pruned('b/02.flac'))